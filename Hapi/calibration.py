@@ -12,11 +12,17 @@ runoff at known locations based on given performance function
 
 """
 import numpy as np
+import pandas as pd
 import datetime as dt
-from Oasis.optimization import Optimization
-from Oasis.hsapi import HSapi
+import importlib
+import sys
+from types import ModuleType
+from multiprocessing import Pool, shared_memory, resource_tracker
 from Hapi.catchment import Catchment
 from Hapi.wrapper import Wrapper
+from Hapi.distrrm import DistributedRRM
+from Hapi.optimizers import Optimizers, History, ParetoArchive
+import Hapi.performancecriteria as PC
 
 
 class Calibration(Catchment):
@@ -35,7 +41,42 @@ class Calibration(Catchment):
     The calibration class is sub-class from the Catchment super class so you
     need to create the Catchment object first to be able to run the calibration
 
+    Methods:
+        1- ReadObjectiveFn
+        2- ExtractDischarge
+        3- ReadMuskingumCoef
+        4- RunCalibration
+        5- FW1Calibration
+        6- LumpedCalibration
+        7- CalculateError
+        8- BoundedError
+        9- ObjectivesVector
+        10- CalculateObjectives
+        11- EvaluatePopulation
+        12- PopulationCalibration
+        13- MultiObjectiveCalibration
+        14- MultiResolutionCalibration
+        15- ScaleParameters
+        16- CreatePool
+        17- ParallelEvaluate
+        18- ClosePool
+        19- ListAttributes
     """
+    # meteorological inputs that are shared between the workers of the pool
+    SharedInputs = ["Prec", "Temp", "ET", "ll_temp", "data"]
+    # results of the model and pool handles that are not sent to the workers
+    WorkerExclude = ["quz", "qlz", "quz_routed", "qlz_translated", "Qtot", "qout",
+                     "statevariables", "Qsim", "Pool", "SharedBlocks",
+                     "PrecStore", "TempStore", "ETStore", "llTempStore",
+                     "Cache", "ImpulseResponse", "GaugesQuz", "GaugesQlz", "GaugesQtot"]
+    # performance criteria of the multi-objective calibration
+    # {name: [function, perfect value]}
+    PerformanceCriteria = {"RMSE": [PC.RMSE, 0], "RMSEHF": [PC.RMSEHF, 0],
+                           "RMSELF": [PC.RMSELF, 0], "KGE": [PC.KGE, 1],
+                           "WB": [PC.WB, 100], "NSE": [PC.NSE, 1],
+                           "NSEHF": [PC.NSEHF, 1], "MBE": [PC.MBE, 0],
+                           "MAE": [PC.MAE, 0], "PearsonCorre": [PC.PearsonCorre, 1],
+                           "R2": [PC.R2, 1]}
 
     def __init__(self, name, StartDate, EndDate, fmt="%Y-%m-%d", SpatialResolution = 'Lumped',
                  TemporalResolution = "Daily"):
@@ -74,6 +115,8 @@ class Calibration(Catchment):
         self.TemporalResolution = TemporalResolution
         if TemporalResolution == "Daily":
             self.Timef = 24
+        elif TemporalResolution == "Hourly":
+            self.Timef = 1
         else:
             #TODO calculate the temporal resolution factor
             self.Tfactor = 24
@@ -113,10 +156,10 @@ class Calibration(Catchment):
         print("Objective function is read successfully")
 
 
-    def ExtractDischarge(self, Factor=None):
+    def ExtractDischarge(self, Factor=None, CalculateMetrics=False):
         """
         ================================================================
-                ExtractDischarge(self)
+                ExtractDischarge(self, Factor=None, CalculateMetrics=False)
         ================================================================
         ExtractDischarge method extracts the discharge hydrograph in the
         Q
@@ -127,6 +170,9 @@ class Calibration(Catchment):
             list of factor if you want to multiply the simulated discharge by
             a factor you have to provide a list of the factor (as many factors
             as the number of gauges). The default is False.
+        CalculateMetrics : [bool], optional
+            True to calculate the performance metrics (Metrics) of each gauge
+            as in Catchment.ExtractDischarge. The default is False.
 
         Returns
         -------
@@ -144,24 +190,71 @@ class Calibration(Catchment):
             # Qlz = self.qlz_translated[Xind,Yind,:-1]
             # self.Qsim[:,i] = Quz + Qlz
 
-            Qsim = np.reshape(self.Qtot[Xind,Yind,:-1],self.TS-1)
+            if hasattr(self, "Qtot"):
+                Qsim = np.reshape(self.Qtot[Xind,Yind,:-1],self.TS-1)
+            else:
+                # lean or impulse response run (only the discharge at the gauges is kept)
+                Qsim = self.GaugesQtot[i,:-1]
 
             if Factor != None:
                 self.Qsim[:,i] = Qsim * Factor[i]
             else:
                 self.Qsim[:,i] = Qsim
 
+        if CalculateMetrics:
+            index = ['RMSE', 'NSE', 'NSEhf', 'KGE', 'WB','Pearson-CC','R2']
+            gaugeids = self.GaugesTable.loc[:,"id"].tolist()
+            self.Metrics = pd.DataFrame(index = index, columns = gaugeids)
+            Qobs = np.asarray(self.QGauges, dtype=np.float64)[:self.TS-1,:].T
+            metrics = PC.FusedMetrics(Qobs, self.Qsim.T)
+            for name, row in self.MetricsNames.items():
+                self.Metrics.loc[row,gaugeids] = np.round(metrics[name],3)
+
             # Qobs = Coello.QGauges.loc[:,gaugeid]
             # error = error + OF(Qobs, Qsim)
 
         # return error
 
-    def RunCalibration(self, SpatialVarFun, OptimizationArgs, printError=None):
+
+    def ReadMuskingumCoef(self, SpatialVarFun):
+        """
+        ================================================================
+                ReadMuskingumCoef(SpatialVarFun)
+        ================================================================
+        ReadMuskingumCoef method takes the muskingum coefficients calculated
+        by the DistParameters object with the distributed parameters (Coef3d)
+        so the routing does not calculate them again for each run, the
+        coefficients are used only if they were calculated with the same
+        time step (Timef) as the catchment and only for the cells where the
+        k & x did not change since (see DistributedRRM.MuskingumCoefficients).
+
+        Parameters
+        ----------
+        SpatialVarFun : [DistParameters object]
+            DistParameters object after distributing the parameters.
+
+        Returns
+        -------
+        MuskingumCoef : [3d array attribute]
+            muskingum coefficients [c1, c2, c3] of each cell.
+        MuskingumPar : [3d array attribute]
+            copy of the k & x (RoutingParameters) the coefficients were
+            calculated from.
+        """
+        if hasattr(SpatialVarFun, "Coef3d") and getattr(SpatialVarFun, "Timef", None) == getattr(self, "Timef", None):
+            self.MuskingumCoef = SpatialVarFun.Coef3d
+            self.MuskingumPar = np.array(SpatialVarFun.Par3d[:,:,self.RoutingParameters])
+        elif hasattr(self, "MuskingumCoef"):
+            del self.MuskingumCoef, self.MuskingumPar
+
+    def RunCalibration(self, SpatialVarFun, OptimizationArgs, printError=None,
+                       HistoryPath=None, Decimals=None, Resume=False):
         """
         =======================================================================
             RunCalibration(ConceptualModel, Paths, p2, Q_obs, UB, LB,
                            SpatialVarFun, lumpedParNo, lumpedParPos,
-                           objective_function, printError=None, *args):
+                           objective_function, printError=None, *args,
+                           HistoryPath=None, Decimals=None, Resume=False):
         =======================================================================
         this function runs the calibration algorithm for the conceptual distributed
         hydrological model
@@ -200,6 +293,22 @@ class Calibration(Catchment):
                 and to be used in the calibration
             9-*args:
                 other arguments needed on the objective function
+            10-HistoryPath:
+                [str] path of a binary log (History) of the evaluated
+                parameter sets, an existing log is overwritten unless Resume
+                is True. default is None
+            11-Decimals:
+                [int] number of decimals the parameters are rounded to, to
+                memorize the objective function values, None to not memorize.
+                default is None
+            12-Resume:
+                [bool] True to append to the existing log in HistoryPath and
+                reuse its evaluations (with Decimals), the harmony search
+                does not continue from the last generation of a killed
+                calibration, it starts again and only the parameter sets
+                found in the log are not evaluated again (only
+                PopulationCalibration can resume from the last generation).
+                default is False
 
         Outputs:
         ----------
@@ -228,9 +337,13 @@ class Calibration(Catchment):
         assert fd_rows == self.rows and fd_cols == self.cols, "all input data should have the same number of rows"
 
         # input dimensions
-        assert np.shape(self.Prec)[0] == self.rows and np.shape(self.ET)[0] == self.rows and np.shape(self.Temp)[0] == self.rows, "all input data should have the same number of rows"
-        assert np.shape(self.Prec)[1] == self.cols and np.shape(self.ET)[1] == self.cols and np.shape(self.Temp)[1] == self.cols, "all input data should have the same number of columns"
-        assert np.shape(self.Prec)[2] == np.shape(self.ET)[2] and np.shape(self.Temp)[2], "all meteorological input data should have the same length"
+        if not hasattr(self, "PrecStore"):
+            assert np.shape(self.Prec)[0] == self.rows and np.shape(self.ET)[0] == self.rows and np.shape(self.Temp)[0] == self.rows, "all input data should have the same number of rows"
+            assert np.shape(self.Prec)[1] == self.cols and np.shape(self.ET)[1] == self.cols and np.shape(self.Temp)[1] == self.cols, "all input data should have the same number of columns"
+            assert np.shape(self.Prec)[2] == np.shape(self.ET)[2] and np.shape(self.Temp)[2], "all meteorological input data should have the same length"
+        else:
+            # forcing is read from the memory-mapped store (ReadForcingStore)
+            assert self.PrecStore.shape[0] == len(self.StoreCells), "the forcing store is not complete"
 
         # basic inputs
         # check if all inputs are included
@@ -246,13 +359,26 @@ class Calibration(Catchment):
         assert type(ApiObjArgs) == dict, "store_history should be 0 or 1"
         assert type(ApiSolveArgs) == dict, "history_fname should be of type string "
 
+        # log & memory of the evaluated parameter sets
+        if Resume:
+            assert HistoryPath is not None, "to reuse the evaluations of a killed calibration the HistoryPath of its log is needed"
+        if HistoryPath is not None or Decimals is not None:
+            Log = History(HistoryPath, len(self.LB), Append=Resume, Decimals=Decimals)
+        else:
+            Log = None
+
         print('Calibration starts')
         ### calculate the objective function
         def opt_fun(par):
+            if Log is not None and Log.Memo is not None:
+                error, found = Log.Lookup(np.atleast_2d(par))
+                if found[0]:
+                    return error[0], [], int(np.isnan(error[0]))
             try:
                 # distribute the parameters
                 SpatialVarFun.Function(par, kub=SpatialVarFun.Kub, klb=SpatialVarFun.Klb)
                 self.Parameters = SpatialVarFun.Par3d
+                self.ReadMuskingumCoef(SpatialVarFun)
                 #run the model
                 Wrapper.HapiModel(self)
                 # calculate performance of the model
@@ -271,9 +397,13 @@ class Calibration(Catchment):
                 error = np.nan
                 fail = 1
 
+            if Log is not None:
+                Log.Write(0, np.atleast_2d(np.asarray(par, dtype=np.float64)), [error])
+
             return error, [], fail
 
         ### define the optimization components
+        Optimization, HSapi = _HarmonySearch()
         opt_prob = Optimization('HBV Calibration', opt_fun)
         for i in range(len(self.LB)):
             opt_prob.addVar('x{0}'.format(i), type='c', lower=self.LB[i], upper=self.UB[i])
@@ -368,9 +498,13 @@ class Calibration(Catchment):
         # assert fd_rows == self.rows and fd_cols == self.cols, "all input data should have the same number of rows"
 
         # input dimensions
-        assert np.shape(self.Prec)[0] == self.rows and np.shape(self.ET)[0] == self.rows and np.shape(self.Temp)[0] == self.rows, "all input data should have the same number of rows"
-        assert np.shape(self.Prec)[1] == self.cols and np.shape(self.ET)[1] == self.cols and np.shape(self.Temp)[1] == self.cols, "all input data should have the same number of columns"
-        assert np.shape(self.Prec)[2] == np.shape(self.ET)[2] and np.shape(self.Temp)[2], "all meteorological input data should have the same length"
+        if not hasattr(self, "PrecStore"):
+            assert np.shape(self.Prec)[0] == self.rows and np.shape(self.ET)[0] == self.rows and np.shape(self.Temp)[0] == self.rows, "all input data should have the same number of rows"
+            assert np.shape(self.Prec)[1] == self.cols and np.shape(self.ET)[1] == self.cols and np.shape(self.Temp)[1] == self.cols, "all input data should have the same number of columns"
+            assert np.shape(self.Prec)[2] == np.shape(self.ET)[2] and np.shape(self.Temp)[2], "all meteorological input data should have the same length"
+        else:
+            # forcing is read from the memory-mapped store (ReadForcingStore)
+            assert self.PrecStore.shape[0] == len(self.StoreCells), "the forcing store is not complete"
 
         # basic inputs
         # check if all inputs are included
@@ -415,6 +549,7 @@ class Calibration(Catchment):
             return error, [], fail
 
         ### define the optimization components
+        Optimization, HSapi = _HarmonySearch()
         opt_prob = Optimization('HBV Calibration', opt_fun)
         for i in range(len(self.LB)):
             opt_prob.addVar('x{0}'.format(i), type='c', lower=self.LB[i], upper=self.UB[i])
@@ -555,6 +690,7 @@ class Calibration(Catchment):
             return error, [], fail
 
         ### define the optimization components
+        Optimization, HSapi = _HarmonySearch()
         opt_prob = Optimization('HBV Calibration', opt_fun)
 
         if InitialValues != []:
@@ -590,6 +726,1052 @@ class Calibration(Catchment):
 
         return res
 
+    def CalculateError(self, par, ModelType="Distributed", SpatialVarFun=None,
+                       Route=0, RoutingFn=[]):
+        """
+        ==============================================================
+            CalculateError(par, ModelType, SpatialVarFun, Route, RoutingFn)
+        ==============================================================
+        CalculateError method runs the model with one parameter set and
+        returns the value of the objective function (the same as the opt_fun
+        of RunCalibration, FW1Calibration and LumpedCalibration)
+
+        Parameters
+        ----------
+        par : [list/array]
+            parameter set.
+        ModelType : [str], optional
+            "Distributed" (RunCalibration), "FW1" (FW1Calibration) or
+            "Lumped" (LumpedCalibration). The default is "Distributed".
+        SpatialVarFun : [DistParameters object], optional
+            spatial distribution function (for "Distributed" & "FW1").
+        Route : [int], optional
+            1 to route the lumped discharge ("Lumped"). The default is 0.
+        RoutingFn : [function], optional
+            routing function ("Lumped"). The default is [].
+
+        Returns
+        -------
+        error : [float]
+            value of the objective function, nan if the model run fails.
+        """
+        assert ModelType in ["Distributed", "FW1", "Lumped"], "ModelType should be 'Distributed', 'FW1' or 'Lumped'"
+        try:
+            if ModelType == "Distributed":
+                SpatialVarFun.Function(par, kub=SpatialVarFun.Kub, klb=SpatialVarFun.Klb)
+                self.Parameters = SpatialVarFun.Par3d
+                self.ReadMuskingumCoef(SpatialVarFun)
+                Wrapper.HapiModel(self)
+                error = self.OF(self.QGauges, self.qout, self.quz_routed, self.qlz_translated,*[self.GaugesTable])
+            elif ModelType == "FW1":
+                SpatialVarFun.Function(par, kub=SpatialVarFun.Kub, klb=SpatialVarFun.Klb, Maskingum=SpatialVarFun.Maskingum)
+                self.Parameters = SpatialVarFun.Par3d
+                Wrapper.FW1(self)
+                error = self.OF(self.QGauges, self.qout,*[self.GaugesTable])
+            else:
+                self.Parameters = par
+                Wrapper.Lumped(self, Route, RoutingFn)
+                error = self.OF(self.QGauges[self.QGauges.columns[-1]],self.Qsim,*self.OFArgs)
+        except:
+            error = np.nan
+
+        return error
+
+
+    def BoundedError(self, par, SpatialVarFun, Threshold=np.inf, ChunkSize=1000,
+                     Metric="RMSE"):
+        """
+        ==============================================================
+            BoundedError(par, SpatialVarFun, Threshold, ChunkSize, Metric)
+        ==============================================================
+        BoundedError method runs the distributed model with one parameter set
+        in blocks of ChunkSize time steps (DistributedRRM.RunChunks) and
+        accumulates the squared errors of the simulated discharge at the
+        gauges (GaugesTable) against QGauges, the run stops as soon as the
+        error of the blocks already simulated exceeds the Threshold, the
+        error can only increase with the next blocks so the parameter set is
+        known to be worse than the threshold without simulating the whole
+        period.
+
+        the error is calculated from the squared errors of each gauge
+        (time steps with no observation (nan) are skipped) weighted by the
+        "weight" column of the GaugesTable (1 if there is no weight column)
+
+            "RMSE": sum(weight * sqrt(SSE / no of observations))
+            "SSE": sum(weight * SSE)
+
+        Parameters
+        ----------
+        par : [list/array]
+            parameter set.
+        SpatialVarFun : [DistParameters object]
+            spatial distribution function.
+        Threshold : [numeric], optional
+            the run stops if the error exceeds the Threshold. The default
+            is np.inf (the whole period is simulated).
+        ChunkSize : [integer], optional
+            number of time steps in each block. The default is 1000.
+        Metric : [str], optional
+            "RMSE" or "SSE". The default is "RMSE".
+
+        Returns
+        -------
+        error : [float]
+            the error of the whole period, or the error of the simulated
+            blocks (higher than the Threshold) if the run stopped, nan if
+            the model run fails.
+        aborted : [bool]
+            True if the run stopped before the end of the period (error is
+            only a lower bound of the error of the whole period).
+        """
+        assert Metric in ["RMSE", "SSE"], "Metric should be 'RMSE' or 'SSE'"
+        try:
+            SpatialVarFun.Function(par, kub=SpatialVarFun.Kub, klb=SpatialVarFun.Klb)
+            self.Parameters = SpatialVarFun.Par3d
+            self.ReadMuskingumCoef(SpatialVarFun)
+
+            rows, cols = np.where(self.FlowAccArr != self.NoDataValue)
+            index = np.ones((self.rows, self.cols), dtype=np.int64)*-1
+            index[rows, cols] = np.arange(len(rows))
+            gauges = index[self.GaugesTable["cell_row"].values.astype(int),
+                           self.GaugesTable["cell_col"].values.astype(int)]
+            if "weight" in self.GaugesTable.columns:
+                weights = self.GaugesTable["weight"].values.astype(np.float64)
+            else:
+                weights = np.ones(len(gauges))
+
+            # observed discharge (time steps, gauges) the same as ExtractDischarge
+            Qobs = np.asarray(self.QGauges, dtype=np.float64)[:self.TS-1,:]
+            observed = ~np.isnan(Qobs)
+            no_obs = np.maximum(observed.sum(axis=0), 1)
+            SSE = np.zeros(len(gauges))
+            error = 0.0
+            aborted = False
+
+            for start, quz_routed, qlz_translated in DistributedRRM.RunChunks(self, ChunkSize):
+                end = min(start + quz_routed.shape[1], len(Qobs))
+                if end <= start:
+                    break
+                Qsim = (quz_routed[gauges,:end-start] + qlz_translated[gauges,:end-start]).T
+                diff = np.where(observed[start:end], Qsim - Qobs[start:end], 0)
+                SSE = SSE + np.sum(diff**2, axis=0)
+
+                if Metric == "RMSE":
+                    error = np.sum(weights * np.sqrt(SSE / no_obs))
+                else:
+                    error = np.sum(weights * SSE)
+                if error > Threshold:
+                    aborted = end < len(Qobs)
+                    break
+        except:
+            error = np.nan
+            aborted = False
+
+        return error, aborted
+
+
+    @staticmethod
+    def ObjectivesVector(Qobs, Qsim, Objectives, Weights=None, PerGauge=False):
+        """
+        ==============================================================
+            ObjectivesVector(Qobs, Qsim, Objectives, Weights, PerGauge)
+        ==============================================================
+        ObjectivesVector method calculates the objectives of the
+        multi-objective calibration of one simulation at all the gauges,
+        each objective is the distance of a performance criterion from its
+        perfect value (|criterion - perfect value|, PerformanceCriteria) so
+        all the objectives are minimized, the time steps with no observation
+        (nan) are skipped for each gauge
+
+        Parameters
+        ----------
+        Qobs : [array]
+            2D array (time steps, gauges) of the observed discharge.
+        Qsim : [array]
+            2D array (time steps, gauges) of the simulated discharge.
+        Objectives : [list]
+            names of the performance criteria (PerformanceCriteria) e.g.
+            ["NSEHF", "WB", "KGE"], a criterion with arguments is given as a
+            tuple e.g. ("RMSEHF", 1, 2, 0.5).
+        Weights : [array], optional
+            weight of each gauge. The default is None (the same weight).
+        PerGauge : [bool], optional
+            True to have an objective for each criterion at each gauge
+            (criterion by criterion), False to average each criterion over
+            the gauges with the Weights. The default is False.
+
+        Returns
+        -------
+        objectives : [array]
+            1D array of the objectives (n_criteria or n_criteria * n_gauges).
+        """
+        Qobs = np.asarray(Qobs, dtype=np.float64)
+        Qsim = np.asarray(Qsim, dtype=np.float64)
+        values = np.zeros((len(Objectives), Qobs.shape[1]))
+        # criteria without arguments are calculated for all gauges together
+        fused = [objective for objective in Objectives
+                 if isinstance(objective, str) and objective in PC.FusedNames]
+        if len(fused) > 0:
+            metrics = PC.FusedMetrics(Qobs.T, Qsim.T, fused)
+
+        for i, objective in enumerate(Objectives):
+            name, args = (objective, ()) if isinstance(objective, str) else (objective[0], objective[1:])
+            Function, perfect = Calibration.PerformanceCriteria[name]
+            if isinstance(objective, str) and name in PC.FusedNames:
+                values[i,:] = np.abs(metrics[name] - perfect)
+                continue
+            for j in range(Qobs.shape[1]):
+                observed = ~np.isnan(Qobs[:,j])
+                values[i,j] = np.abs(Function(Qobs[observed,j], Qsim[observed,j], *args) - perfect)
+
+        if PerGauge:
+            return values.ravel()
+        if Weights is None:
+            Weights = np.ones(Qobs.shape[1])
+        return np.average(values, axis=1, weights=Weights)
+
+
+    def CalculateObjectives(self, par, Objectives, ModelType="Distributed",
+                            SpatialVarFun=None, Route=0, RoutingFn=[], PerGauge=False):
+        """
+        ==============================================================
+            CalculateObjectives(par, Objectives, ModelType, SpatialVarFun,
+                                Route, RoutingFn, PerGauge)
+        ==============================================================
+        CalculateObjectives method runs the model with one parameter set and
+        returns the objectives of the multi-objective calibration
+        (ObjectivesVector) at all the gauges of the GaugesTable ("Distributed")
+        or at the last column of the QGauges ("Lumped")
+
+        Parameters
+        ----------
+        par : [list/array]
+            parameter set.
+        Objectives : [list]
+            names of the performance criteria (see ObjectivesVector).
+        ModelType : [str], optional
+            "Distributed" or "Lumped". The default is "Distributed".
+        SpatialVarFun : [DistParameters object], optional
+            spatial distribution function (for "Distributed").
+        Route : [int], optional
+            1 to route the lumped discharge ("Lumped"). The default is 0.
+        RoutingFn : [function], optional
+            routing function ("Lumped"). The default is [].
+        PerGauge : [bool], optional
+            True to have an objective for each criterion at each gauge.
+            The default is False.
+
+        Returns
+        -------
+        objectives : [array]
+            1D array of the objectives, nan if the model run fails.
+        """
+        assert ModelType in ["Distributed", "Lumped"], "ModelType should be 'Distributed' or 'Lumped'"
+        try:
+            if ModelType == "Distributed":
+                SpatialVarFun.Function(par, kub=SpatialVarFun.Kub, klb=SpatialVarFun.Klb)
+                self.Parameters = SpatialVarFun.Par3d
+                self.ReadMuskingumCoef(SpatialVarFun)
+                Wrapper.HapiModel(self)
+                self.ExtractDischarge(CalculateMetrics=False)
+                Qobs = np.asarray(self.QGauges, dtype=np.float64)[:self.TS-1,:]
+                Qsim = self.Qsim
+                if "weight" in self.GaugesTable.columns:
+                    Weights = self.GaugesTable["weight"].values.astype(np.float64)
+                else:
+                    Weights = None
+            else:
+                self.Parameters = par
+                Wrapper.Lumped(self, Route, RoutingFn)
+                Qobs = np.asarray(self.QGauges[self.QGauges.columns[-1]], dtype=np.float64)
+                Qsim = np.asarray(self.Qsim, dtype=np.float64)[:len(Qobs)]
+                Qobs, Qsim, Weights = Qobs[:len(Qsim),None], Qsim[:,None], None
+            objectives = self.ObjectivesVector(Qobs, Qsim, Objectives, Weights, PerGauge)
+        except:
+            if ModelType == "Distributed" and PerGauge:
+                objectives = np.full(len(Objectives)*len(self.GaugesTable), np.nan)
+            else:
+                objectives = np.full(len(Objectives), np.nan)
+
+        return objectives
+
+
+    def EvaluatePopulation(self, Pars, ModelType="Distributed", SpatialVarFun=None,
+                           Route=0, RoutingFn=[], Thresholds=None, TimeChunk=1000,
+                           Metric="RMSE", Objectives=None, PerGauge=False):
+        """
+        ==============================================================
+            EvaluatePopulation(Pars, ModelType, SpatialVarFun, Route, RoutingFn,
+                               Thresholds, TimeChunk, Metric, Objectives, PerGauge)
+        ==============================================================
+        EvaluatePopulation method evaluates a population of parameter sets
+        in one call, the population is evaluated by the pool of workers if
+        it was created (CreatePool, with its own ModelType & SpatialVarFun),
+        the "Lumped" model runs all the parameter sets together as an
+        ensemble (Wrapper.LumpedEnsemble), otherwise each parameter set is
+        evaluated by CalculateError, or by BoundedError if Thresholds are
+        given (early abort of the "Distributed" model), or by
+        CalculateObjectives if Objectives are given (multi-objective)
+
+        Parameters
+        ----------
+        Pars : [array]
+            2D array (n_sets, n_par) of parameter sets.
+        ModelType : [str], optional
+            "Distributed", "FW1" or "Lumped". The default is "Distributed".
+        SpatialVarFun : [DistParameters object], optional
+            spatial distribution function (for "Distributed" & "FW1").
+        Route : [int], optional
+            1 to route the lumped discharge ("Lumped"). The default is 0.
+        RoutingFn : [function], optional
+            routing function ("Lumped"). The default is [].
+        Thresholds : [array], optional
+            1D array (n_sets) of the thresholds of BoundedError (np.inf to
+            simulate the whole period), None to use the objective function
+            (CalculateError). The default is None.
+        TimeChunk : [integer], optional
+            number of time steps in each block of BoundedError. The default is 1000.
+        Metric : [str], optional
+            metric of BoundedError "RMSE" or "SSE". The default is "RMSE".
+        Objectives : [list], optional
+            names of the performance criteria of the multi-objective
+            calibration (see ObjectivesVector). The default is None.
+        PerGauge : [bool], optional
+            True to have an objective for each criterion at each gauge
+            (Objectives). The default is False.
+
+        Returns
+        -------
+        errors : [array]
+            1D array (n_sets) of the objective function values in the same
+            order as Pars (nan for failed runs), 2D array (n_sets, n_obj)
+            of the objectives if Objectives are given.
+        aborted : [array]
+            1D bool array (n_sets) of the runs of BoundedError that stopped
+            early, only returned if Thresholds are given.
+        """
+        Pars = np.atleast_2d(np.asarray(Pars, dtype=np.float64))
+
+        if Objectives is not None:
+            if hasattr(self, "Pool"):
+                return self.ParallelEvaluate(Pars, Objectives=Objectives, PerGauge=PerGauge)
+
+            if ModelType == "Lumped" and len(Pars) > 1:
+                try:
+                    Wrapper.LumpedEnsemble(self, Pars, Route, RoutingFn)
+                except:
+                    pass
+                else:
+                    Qobs = np.asarray(self.QGauges[self.QGauges.columns[-1]], dtype=np.float64)
+                    Qsim = np.asarray(self.QsimEnsemble, dtype=np.float64)[:,:len(Qobs)]
+                    Qobs = Qobs[:Qsim.shape[1],None]
+                    objectives = np.zeros((len(Pars), len(Objectives)))
+                    for i in range(len(Pars)):
+                        try:
+                            objectives[i] = self.ObjectivesVector(Qobs, Qsim[i][:,None], Objectives)
+                        except:
+                            objectives[i] = np.nan
+                    del self.QsimEnsemble
+                    return objectives
+
+            return np.array([self.CalculateObjectives(par, Objectives, ModelType, SpatialVarFun,
+                                                      Route, RoutingFn, PerGauge)
+                             for par in Pars], dtype=np.float64)
+
+        if Thresholds is not None:
+            assert ModelType == "Distributed", "the early abort (Thresholds) is only available for the Distributed model"
+            Thresholds = np.broadcast_to(np.asarray(Thresholds, dtype=np.float64), (len(Pars),))
+
+        if hasattr(self, "Pool"):
+            return self.ParallelEvaluate(Pars, Thresholds=Thresholds, TimeChunk=TimeChunk, Metric=Metric)
+
+        if Thresholds is not None:
+            results = [self.BoundedError(par, SpatialVarFun, threshold, TimeChunk, Metric)
+                       for par, threshold in zip(Pars, Thresholds)]
+            errors, aborted = np.array(results, dtype=np.float64).reshape(len(Pars), 2).T
+            return errors, aborted.astype(bool)
+
+        if ModelType == "Lumped" and len(Pars) > 1:
+            try:
+                Wrapper.LumpedEnsemble(self, Pars, Route, RoutingFn)
+            except:
+                pass
+            else:
+                Qobs = self.QGauges[self.QGauges.columns[-1]]
+                errors = np.zeros(len(Pars))
+                for i in range(len(Pars)):
+                    try:
+                        errors[i] = self.OF(Qobs, self.QsimEnsemble[i], *self.OFArgs)
+                    except:
+                        errors[i] = np.nan
+                del self.QsimEnsemble
+                return errors
+
+        return np.array([self.CalculateError(par, ModelType, SpatialVarFun, Route, RoutingFn)
+                         for par in Pars], dtype=np.float64)
+
+
+    def PopulationCalibration(self, Algorithm="DE", ModelType="Distributed",
+                              SpatialVarFun=None, Route=0, RoutingFn=[],
+                              OptimizationArgs={}, HistoryPath=None, Resume=False,
+                              Decimals=10, printError=None, EarlyAbort=False,
+                              TimeChunk=1000, Metric="RMSE"):
+        """
+        ==============================================================
+            PopulationCalibration(Algorithm, ModelType, SpatialVarFun, Route,
+                                  RoutingFn, OptimizationArgs, HistoryPath,
+                                  Resume, Decimals, printError, EarlyAbort,
+                                  TimeChunk, Metric)
+        ==============================================================
+        PopulationCalibration method calibrates the model with one of the
+        population based optimizers (Differential Evolution, SCE-UA or
+        CMA-ES), each generation is evaluated in one call of
+        EvaluatePopulation (by the pool of workers if CreatePool was called
+        before, or as an ensemble for the lumped model) within the parameters
+        bounds (ReadParametersBounds)
+
+        Parameters
+        ----------
+        Algorithm : [str], optional
+            "DE", "SCEUA" or "CMAES". The default is "DE".
+        ModelType : [str], optional
+            "Distributed" (RunCalibration), "FW1" (FW1Calibration) or
+            "Lumped" (LumpedCalibration). The default is "Distributed".
+        SpatialVarFun : [DistParameters object], optional
+            spatial distribution function (for "Distributed" & "FW1"), the
+            bounds should have ParametersNO values.
+        Route : [int], optional
+            1 to route the lumped discharge ("Lumped"). The default is 0.
+        RoutingFn : [function], optional
+            routing function ("Lumped"). The default is [].
+        OptimizationArgs : [dict], optional
+            arguments of the optimizer (Optimizers.DE, Optimizers.SCEUA or
+            Optimizers.CMAES) e.g. {"Generations":100, "PopSize":50, "Seed":1}.
+            The default is {}.
+        HistoryPath : [str], optional
+            path of the binary log of all the evaluated parameter sets
+            (read it with History.Read). The default is None.
+        Resume : [bool], optional
+            True to resume a calibration that was killed from the log in
+            HistoryPath, the optimizer has to be given the same "Seed" and
+            arguments, the generations in the log are replayed from the
+            memory without running the model (except the runs that were
+            aborted with EarlyAbort, they are logged with an infinite
+            error and are simulated again). The default is False.
+        Decimals : [int], optional
+            number of decimals the parameters are rounded to, to memorize
+            the objective function values, parameter sets that are the same
+            after rounding are evaluated only once, None to not memorize.
+            The default is 10.
+        printError : [integer], optional
+            1 to print the best value of each generation. The default is None.
+        EarlyAbort : [bool], optional
+            True to use the error of BoundedError instead of the objective
+            function ("Distributed" model with "DE" or "SCEUA"), each
+            candidate is simulated in blocks and stops as soon as it is
+            worse than the parameter set it competes with. The default is False.
+        TimeChunk : [integer], optional
+            number of time steps in each block (EarlyAbort). The default is 1000.
+        Metric : [str], optional
+            "RMSE" or "SSE" metric of BoundedError (EarlyAbort). The default
+            is "RMSE".
+
+        Returns
+        -------
+        res : [list]
+            [value of the objective function, parameters] of the best
+            parameter set.
+        Parameters : [attribute]
+            best parameter set.
+        OFvalue : [attribute]
+            value of the objective function of the best parameter set.
+
+        Example
+        -------
+            Coello.ReadParametersBounds(UB, LB, Snow)
+            Coello.CreatePool("Distributed", SpatialVarFun, Processes=32)
+            res = Coello.PopulationCalibration("SCEUA", "Distributed", SpatialVarFun,
+                                               OptimizationArgs={"Complexes":8, "Generations":50},
+                                               HistoryPath="calibration.hst")
+            Coello.ClosePool()
+        """
+        assert Algorithm in ["DE", "SCEUA", "CMAES"], "Algorithm should be 'DE', 'SCEUA' or 'CMAES'"
+        assert ModelType in ["Distributed", "FW1", "Lumped"], "ModelType should be 'Distributed', 'FW1' or 'Lumped'"
+        assert hasattr(self, "UB") and hasattr(self, "LB"), "please read the parameters bounds first using the ReadParametersBounds method"
+        assert EarlyAbort or hasattr(self, "OF"), "please read the objective function first using the ReadObjectiveFn method"
+        assert type(OptimizationArgs) == dict, "OptimizationArgs should be a dictionary"
+        if ModelType != "Lumped":
+            assert SpatialVarFun is not None, "the spatial distribution function (SpatialVarFun) is needed for the " + ModelType + " model"
+            assert len(self.LB) == SpatialVarFun.ParametersNO, "the bounds should have " + str(SpatialVarFun.ParametersNO) + " values (SpatialVarFun.ParametersNO)"
+
+        if Resume:
+            assert HistoryPath is not None, "to resume the calibration the HistoryPath of the killed calibration is needed"
+            assert Decimals is not None, "to resume the calibration the evaluations have to be memorized (Decimals)"
+            assert OptimizationArgs.get("Seed") is not None, "to resume the calibration the same Seed of the killed calibration is needed"
+
+        if HistoryPath is not None or Decimals is not None:
+            Log = History(HistoryPath, len(self.LB), Append=Resume, Decimals=Decimals)
+        else:
+            Log = None
+
+        if EarlyAbort:
+            assert ModelType == "Distributed", "EarlyAbort is only available for the Distributed model"
+            assert Algorithm in ["DE", "SCEUA"], "EarlyAbort is only available for 'DE' and 'SCEUA'"
+            OptimizationArgs = dict(OptimizationArgs, Bounded=True)
+
+            def Evaluate(Pars, Thresholds=None):
+                if Thresholds is None:
+                    # the whole period is simulated (no run is aborted)
+                    return self.EvaluatePopulation(Pars, ModelType, SpatialVarFun,
+                                                   Thresholds=np.inf, TimeChunk=TimeChunk,
+                                                   Metric=Metric)[0]
+                # errors & the runs that stopped early
+                return self.EvaluatePopulation(Pars, ModelType, SpatialVarFun,
+                                               Thresholds=Thresholds, TimeChunk=TimeChunk,
+                                               Metric=Metric)
+        else:
+            def Evaluate(Pars):
+                return self.EvaluatePopulation(Pars, ModelType, SpatialVarFun, Route, RoutingFn)
+
+        print('Calibration starts')
+        Optimizer = getattr(Optimizers, Algorithm)
+        error, par = Optimizer(Evaluate, self.LB, self.UB, History=Log,
+                               printError=printError, **OptimizationArgs)
+
+        self.Parameters = par
+        self.OFvalue = error
+
+        return [error, par]
+
+
+    def MultiObjectiveCalibration(self, Objectives=["NSEHF", "WB", "KGE"],
+                                  ModelType="Distributed", SpatialVarFun=None,
+                                  Route=0, RoutingFn=[], PerGauge=False,
+                                  OptimizationArgs={}, ArchivePath=None,
+                                  Epsilon=None, Resume=False, printError=None):
+        """
+        ==============================================================
+            MultiObjectiveCalibration(Objectives, ModelType, SpatialVarFun,
+                                      Route, RoutingFn, PerGauge,
+                                      OptimizationArgs, ArchivePath, Epsilon,
+                                      Resume, printError)
+        ==============================================================
+        MultiObjectiveCalibration method calibrates the model against many
+        performance criteria at once with the NSGA-II algorithm
+        (Optimizers.NSGA2), each parameter set is run once and all the
+        criteria are calculated at all the gauges from the same run
+        (ObjectivesVector), the result is the Pareto front (the parameter
+        sets that are not worse than any other parameter set in all the
+        criteria) which is kept in a Pareto archive (ParetoArchive) saved
+        after each generation.
+
+        the objectives are the distances of the criteria from their perfect
+        values e.g. 1 - NSEHF, 100 - WB, 1 - KGE, RMSE.
+
+        Parameters
+        ----------
+        Objectives : [list], optional
+            names of the performance criteria (PerformanceCriteria), a
+            criterion with arguments is given as a tuple e.g.
+            ("RMSEHF", 1, 2, 0.5). The default is ["NSEHF", "WB", "KGE"].
+        ModelType : [str], optional
+            "Distributed" or "Lumped". The default is "Distributed".
+        SpatialVarFun : [DistParameters object], optional
+            spatial distribution function (for "Distributed").
+        Route : [int], optional
+            1 to route the lumped discharge ("Lumped"). The default is 0.
+        RoutingFn : [function], optional
+            routing function ("Lumped"). The default is [].
+        PerGauge : [bool], optional
+            True to have an objective for each criterion at each gauge, False
+            to average each criterion over the gauges (with the "weight"
+            column of the GaugesTable if it exists). The default is False.
+        OptimizationArgs : [dict], optional
+            arguments of Optimizers.NSGA2 e.g. {"Generations":100,
+            "PopSize":100, "Seed":1}. The default is {}.
+        ArchivePath : [str], optional
+            path of the Pareto archive file. The default is None.
+        Epsilon : [numeric/list], optional
+            size of the epsilon boxes of the archive for each objective, None
+            to keep all the non-dominated parameter sets. The default is None.
+        Resume : [bool], optional
+            True to continue from the archive in ArchivePath, the parameter
+            sets of the archive are added to the first population. The
+            default is False.
+        printError : [integer], optional
+            1 to print the size of the first front of each generation.
+
+        Returns
+        -------
+        res : [list]
+            [objectives, parameters] 2D arrays of the Pareto archive.
+        ParetoFront : [dataframe attribute]
+            the objectives and the parameters of the Pareto archive.
+
+        Example
+        -------
+            Coello.ReadParametersBounds(UB, LB, Snow)
+            objectives, pars = Coello.MultiObjectiveCalibration(["NSEHF", "WB", "KGE"], "Distributed",
+                                                                SpatialVarFun, PerGauge=True,
+                                                                OptimizationArgs={"Generations":50, "Seed":1},
+                                                                ArchivePath="pareto.bin", Epsilon=0.01)
+        """
+        assert ModelType in ["Distributed", "Lumped"], "ModelType should be 'Distributed' or 'Lumped'"
+        assert hasattr(self, "UB") and hasattr(self, "LB"), "please read the parameters bounds first using the ReadParametersBounds method"
+        assert type(OptimizationArgs) == dict, "OptimizationArgs should be a dictionary"
+        names = [objective if isinstance(objective, str) else objective[0] for objective in Objectives]
+        for name in names:
+            assert name in self.PerformanceCriteria, name + " is not one of the performance criteria " + str(list(self.PerformanceCriteria.keys()))
+        if ModelType == "Distributed":
+            assert SpatialVarFun is not None, "the spatial distribution function (SpatialVarFun) is needed for the Distributed model"
+            assert len(self.LB) == SpatialVarFun.ParametersNO, "the bounds should have " + str(SpatialVarFun.ParametersNO) + " values (SpatialVarFun.ParametersNO)"
+        if Resume:
+            assert ArchivePath is not None, "to resume the calibration the ArchivePath of the killed calibration is needed"
+
+        if ModelType == "Distributed" and PerGauge:
+            if "id" in self.GaugesTable.columns:
+                gauges = self.GaugesTable["id"].tolist()
+            else:
+                gauges = self.GaugesTable.index.tolist()
+            names = [name + "_" + str(gauge) for name in names for gauge in gauges]
+
+        Archive = ParetoArchive(ArchivePath, len(self.LB), len(names), Epsilon, Append=Resume)
+
+        OptimizationArgs = dict(OptimizationArgs)
+        if len(Archive.Parameters) > 0:
+            InitialValues = OptimizationArgs.get("InitialValues")
+            if InitialValues is None or len(InitialValues) == 0:
+                OptimizationArgs["InitialValues"] = Archive.Parameters
+            else:
+                OptimizationArgs["InitialValues"] = np.vstack([np.atleast_2d(InitialValues), Archive.Parameters])
+
+        def Evaluate(Pars):
+            return self.EvaluatePopulation(Pars, ModelType, SpatialVarFun, Route, RoutingFn,
+                                           Objectives=Objectives, PerGauge=PerGauge)
+
+        print('Calibration starts')
+        Optimizers.NSGA2(Evaluate, self.LB, self.UB, Archive=Archive,
+                         printError=printError, **OptimizationArgs)
+
+        self.ParetoFront = pd.DataFrame(np.hstack([Archive.Objectives, Archive.Parameters]),
+                                        columns=names + ["par" + str(i) for i in range(len(self.LB))])
+
+        return [Archive.Objectives, Archive.Parameters]
+
+
+    def MultiResolutionCalibration(self, Factor, Algorithm="DE", ModelType="Distributed",
+                                   SpatialVarFun=None, Route=0, RoutingFn=[],
+                                   Scaling={}, ScaleK=True, Narrow=0.2, CoarseArgs={},
+                                   FineArgs={}):
+        """
+        ==============================================================
+            MultiResolutionCalibration(Factor, Algorithm, ModelType, SpatialVarFun,
+                                       Route, RoutingFn, Scaling, ScaleK, Narrow,
+                                       CoarseArgs, FineArgs)
+        ==============================================================
+        MultiResolutionCalibration method calibrates the model in two stages,
+        first the meteorological inputs and the gauges discharge are
+        aggregated to a time step Factor times longer (e.g. daily from hourly
+        Factor=24) and the model is calibrated with the cheap coarse runs
+        (PopulationCalibration), then the best parameter set is used as the
+        first member of the calibration with the original time step within
+        bounds narrowed around it.
+
+        the coarse inputs are the sum of the precipitation & the
+        evapotranspiration, the mean of the temperature, ll_temp & the gauges
+        discharge (nan are skipped) of each Factor time steps (the last time
+        steps that do not fill a coarse time step are dropped), the time
+        factor (Timef) and the muskingum k bounds of the SpatialVarFun (Kub,
+        Klb & the constraints of calculateK, ScaleK) are multiplied by the
+        Factor and the parameters that depend on the length of the time step are
+        converted between the two time steps (Scaling, ScaleParameters), the
+        original inputs are restored after the coarse stage.
+
+        Parameters
+        ----------
+        Factor : [int]
+            number of time steps in each coarse time step.
+        Algorithm : [str], optional
+            "DE", "SCEUA" or "CMAES". The default is "DE".
+        ModelType : [str], optional
+            "Distributed", "FW1" or "Lumped". The default is "Distributed".
+        SpatialVarFun : [DistParameters object], optional
+            spatial distribution function (for "Distributed" & "FW1").
+        Route : [int], optional
+            1 to route the lumped discharge ("Lumped"). The default is 0.
+        RoutingFn : [function], optional
+            routing function ("Lumped"). The default is [].
+        Scaling : [dict], optional
+            {order of the parameter: "rate"/"depth"/"steps"} parameters that
+            depend on the length of the time step (see ScaleParameters), the
+            other parameters are the same in both time steps. The default is {}.
+        ScaleK : [bool], optional
+            True to multiply the muskingum k bounds of the SpatialVarFun by the
+            Factor (the muskingum coefficients of the coarse time step are the
+            same as the original for the same x & position of k), False to
+            keep the same k (travel time). The default is True.
+        Narrow : [numeric], optional
+            width of the bounds of the second stage as a fraction of the
+            width of the original bounds (centered on the best parameter set
+            of the coarse stage). The default is 0.2.
+        CoarseArgs : [dict], optional
+            arguments of PopulationCalibration for the coarse stage e.g.
+            {"OptimizationArgs":{"Generations":100, "Seed":1},
+             "HistoryPath":"coarse.hst"}. The default is {}.
+        FineArgs : [dict], optional
+            arguments of PopulationCalibration for the second stage, the best
+            parameter set of the coarse stage is added to the InitialValues
+            of the OptimizationArgs. The default is {}.
+
+        Returns
+        -------
+        res : [list]
+            [value of the objective function, parameters] of the best
+            parameter set with the original time step.
+        CoarseParameters : [attribute]
+            best parameter set of the coarse stage (converted to the original
+            time step).
+        CoarseOFvalue : [attribute]
+            value of the objective function of the coarse stage.
+        Parameters : [attribute]
+            best parameter set.
+        OFvalue : [attribute]
+            value of the objective function of the best parameter set.
+
+        Example
+        -------
+            Coello.ReadParametersBounds(UB, LB, Snow)
+            # k, k1 & perc (order 5, 6 & 8 in the bounds) of the hourly model
+            res = Coello.MultiResolutionCalibration(24, "DE", "Distributed", SpatialVarFun,
+                                                    Scaling={5:"rate", 6:"rate", 8:"depth"},
+                                                    CoarseArgs={"OptimizationArgs":{"Generations":200}},
+                                                    FineArgs={"OptimizationArgs":{"Generations":30}})
+        """
+        assert type(Factor) == int and Factor >= 1, "Factor should be an integer number >= 1"
+        assert ModelType in ["Distributed", "FW1", "Lumped"], "ModelType should be 'Distributed', 'FW1' or 'Lumped'"
+        assert hasattr(self, "UB") and hasattr(self, "LB"), "please read the parameters bounds first using the ReadParametersBounds method"
+        assert hasattr(self, "Timef"), "the time factor (Timef) of the catchment is not defined"
+        assert hasattr(self, "QGauges"), "please read the gauges discharge first using the ReadDischargeGauges method"
+        assert not hasattr(self, "PrecStore"), "the forcing store (ReadForcingStore) can not be aggregated please read the forcing in memory"
+        assert 0 < Narrow <= 1, "Narrow should be between 0 and 1"
+        if ModelType != "Lumped":
+            assert SpatialVarFun is not None, "the spatial distribution function (SpatialVarFun) is needed for the " + ModelType + " model"
+
+        LB = np.asarray(self.LB, dtype=np.float64)
+        UB = np.asarray(self.UB, dtype=np.float64)
+        if hasattr(self, "TS"):
+            NoSteps = self.TS - 1
+        else:
+            # lumped inputs (ReadLumpedInputs)
+            NoSteps = len(self.data)
+        NoCoarse = NoSteps // Factor
+        assert NoCoarse >= 2, "the time series is too short to be aggregated by " + str(Factor)
+
+        def Aggregate(arr, Function, axis):
+            # aggregate Factor time steps along the time axis
+            arr = np.moveaxis(np.asarray(arr), axis, -1)[..., :NoCoarse*Factor]
+            arr = Function(arr.reshape(arr.shape[:-1] + (NoCoarse, Factor)), axis=-1)
+            return np.moveaxis(arr, -1, axis)
+
+        # the attributes that are replaced during the coarse stage
+        Replaced = ["Prec", "Temp", "ET", "ll_temp", "data", "QGauges", "TS",
+                    "Timef", "LB", "UB", "Cache", "ImpulseResponse", "Pool",
+                    "SharedBlocks", "Seed", "Evaluations"]
+        Original = {key: self.__dict__[key] for key in Replaced if key in self.__dict__}
+        if SpatialVarFun is not None:
+            OriginalFun = (SpatialVarFun.Timef, SpatialVarFun.KScale)
+
+        try:
+            for key, Function in [("Prec", np.sum), ("ET", np.sum), ("Temp", np.mean),
+                                  ("ll_temp", np.mean)]:
+                if isinstance(Original.get(key), np.ndarray) and np.ndim(Original[key]) == 3:
+                    setattr(self, key, Aggregate(Original[key], Function, 2))
+            if isinstance(Original.get("data"), np.ndarray):
+                # lumped inputs (prec, et, temp, tm)
+                data = Aggregate(Original["data"][:NoSteps], np.mean, 0)
+                data[:,:2] = data[:,:2]*Factor
+                self.data = data
+
+            QGauges = self.QGauges.iloc[:NoCoarse*Factor]
+            self.QGauges = QGauges.groupby(np.arange(len(QGauges)) // Factor).mean()
+            self.QGauges.index = QGauges.index[::Factor]
+
+            self.TS = NoCoarse + 1
+            self.Timef = self.Timef*Factor
+            self.LB = self.ScaleParameters(LB, Scaling, Factor)
+            self.UB = self.ScaleParameters(UB, Scaling, Factor)
+            if "Cache" in Original:
+                # the cache of the original time step can not be used
+                self.Cache = {}
+            if SpatialVarFun is not None:
+                SpatialVarFun.Timef = SpatialVarFun.Timef*Factor
+                if ScaleK:
+                    SpatialVarFun.KScale = SpatialVarFun.KScale*Factor
+
+            if "Pool" in Original:
+                # a pool with the coarse inputs
+                for key in ["Pool", "SharedBlocks"]:
+                    del self.__dict__[key]
+                self.CreatePool(ModelType, SpatialVarFun, Route, RoutingFn,
+                                Processes=Original["Pool"]._processes, Seed=Original["Seed"])
+
+            print("Coarse calibration (" + str(Factor) + " time steps)")
+            try:
+                CoarseError, CoarsePar = self.PopulationCalibration(Algorithm, ModelType, SpatialVarFun,
+                                                                    Route, RoutingFn, **CoarseArgs)
+            finally:
+                if "Pool" in Original:
+                    self.ClosePool()
+        finally:
+            for key in Replaced:
+                if key in Original:
+                    self.__dict__[key] = Original[key]
+                elif key in self.__dict__:
+                    del self.__dict__[key]
+            if SpatialVarFun is not None:
+                SpatialVarFun.Timef, SpatialVarFun.KScale = OriginalFun
+
+        self.CoarseParameters = np.clip(self.ScaleParameters(CoarsePar, Scaling, 1/Factor), LB, UB)
+        self.CoarseOFvalue = CoarseError
+
+        # narrow the bounds around the best parameter set of the coarse stage
+        Width = Narrow*(UB - LB)/2
+        FineLB = np.maximum(LB, self.CoarseParameters - Width)
+        FineUB = np.minimum(UB, self.CoarseParameters + Width)
+
+        FineArgs = dict(FineArgs)
+        OptimizationArgs = dict(FineArgs.get("OptimizationArgs", {}))
+        InitialValues = OptimizationArgs.get("InitialValues")
+        if InitialValues is None or len(InitialValues) == 0:
+            OptimizationArgs["InitialValues"] = self.CoarseParameters[None,:]
+        else:
+            OptimizationArgs["InitialValues"] = np.vstack([self.CoarseParameters[None,:],
+                                                           np.atleast_2d(InitialValues)])
+        FineArgs["OptimizationArgs"] = OptimizationArgs
+
+        print("Calibration with the original time step")
+        self.LB, self.UB = FineLB, FineUB
+        try:
+            res = self.PopulationCalibration(Algorithm, ModelType, SpatialVarFun,
+                                             Route, RoutingFn, **FineArgs)
+        finally:
+            self.LB, self.UB = Original["LB"], Original["UB"]
+
+        return res
+
+
+    @staticmethod
+    def ScaleParameters(Pars, Scaling, Factor):
+        """
+        ==============================================================
+            ScaleParameters(Pars, Scaling, Factor)
+        ==============================================================
+        ScaleParameters method converts the parameters that depend on the
+        length of the time step to a time step Factor times longer (1/Factor
+        for the opposite conversion)
+
+            "rate": fraction of the storage that leaves it in one time step
+                    (recession coefficients k, k1), 1 - (1 - par)**Factor
+            "depth": depth in one time step (perc, cfmax), par * Factor
+            "steps": duration in time steps (maxbas), par / Factor
+
+        Parameters
+        ----------
+        Pars : [list/array]
+            parameter set (or 2D array of parameter sets).
+        Scaling : [dict]
+            {order of the parameter: "rate"/"depth"/"steps"}.
+        Factor : [numeric]
+            ratio between the new and the current time step.
+
+        Returns
+        -------
+        Pars : [array]
+            converted parameters.
+        """
+        Pars = np.array(Pars, dtype=np.float64)
+        for i, kind in Scaling.items():
+            assert kind in ["rate", "depth", "steps"], "the scaling of the parameters should be 'rate', 'depth' or 'steps'"
+            if kind == "rate":
+                Pars[...,i] = 1 - (1 - Pars[...,i])**Factor
+            elif kind == "depth":
+                Pars[...,i] = Pars[...,i]*Factor
+            else:
+                Pars[...,i] = Pars[...,i]/Factor
+
+        return Pars
+
+
+    def CreatePool(self, ModelType="Distributed", SpatialVarFun=None, Route=0,
+                   RoutingFn=[], Processes=None, Seed=None):
+        """
+        ==============================================================
+            CreatePool(ModelType, SpatialVarFun, Route, RoutingFn, Processes, Seed)
+        ==============================================================
+        CreatePool method starts a pool of worker processes to evaluate many
+        parameter sets in parallel (ParallelEvaluate), the meteorological
+        inputs (Prec, Temp, ET, ll_temp, data) are copied once to shared
+        memory and all the workers read them from there, the rest of the
+        static inputs (flow direction table, gauges, ...) are sent once to
+        each worker when it starts, if the forcing is read from a store
+        (ReadForcingStore) each worker opens the same memory-mapped files
+
+        Parameters
+        ----------
+        ModelType : [str], optional
+            "Distributed", "FW1" or "Lumped". The default is "Distributed".
+        SpatialVarFun : [DistParameters object], optional
+            spatial distribution function (for "Distributed" & "FW1").
+        Route : [int], optional
+            1 to route the lumped discharge ("Lumped"). The default is 0.
+        RoutingFn : [function], optional
+            routing function ("Lumped"). The default is [].
+        Processes : [int], optional
+            number of worker processes. The default is None (number of cores).
+        Seed : [int], optional
+            if given the random generator of numpy is seeded with Seed + the
+            order of the parameter set before each evaluation, so the results
+            do not depend on which worker evaluates which parameter set.
+            The default is None.
+
+        Returns
+        -------
+        None.
+
+        Example
+        -------
+            Coello.CreatePool("Distributed", SpatialVarFun, Processes=32, Seed=1)
+            errors = Coello.ParallelEvaluate(population)
+            Coello.ClosePool()
+        """
+        assert ModelType in ["Distributed", "FW1", "Lumped"], "ModelType should be 'Distributed', 'FW1' or 'Lumped'"
+        assert hasattr(self, "OF"), "please read the objective function first using the ReadObjectiveFn method"
+
+        if hasattr(self, "Pool"):
+            self.ClosePool()
+
+        # copy the meteorological inputs to shared memory blocks
+        self.SharedBlocks = []
+        SharedArrays = {}
+        for key in self.SharedInputs:
+            if isinstance(self.__dict__.get(key), np.ndarray):
+                arr = self.__dict__[key]
+                block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+                np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+                self.SharedBlocks.append(block)
+                SharedArrays[key] = (block.name, arr.shape, arr.dtype.str)
+
+        # the rest of the attributes are sent once to each worker, modules
+        # (LumpedModel) are sent by name and imported again in the worker
+        State = {}
+        Modules = {}
+        for key, val in self.__dict__.items():
+            if key in SharedArrays or key in self.WorkerExclude:
+                continue
+            if isinstance(val, ModuleType):
+                Modules[key] = val.__name__
+            else:
+                State[key] = val
+
+        self.Seed = Seed
+        self.Evaluations = 0
+        self.Pool = Pool(Processes, initializer=_WorkerInit,
+                         initargs=(type(self), State, Modules, SharedArrays,
+                                   (ModelType, SpatialVarFun, Route, RoutingFn)))
+
+
+    def ParallelEvaluate(self, Pars, ChunkSize=1, Thresholds=None, TimeChunk=1000,
+                         Metric="RMSE", Objectives=None, PerGauge=False):
+        """
+        ==============================================================
+            ParallelEvaluate(Pars, ChunkSize=1, Thresholds=None, TimeChunk=1000,
+                             Metric="RMSE", Objectives=None, PerGauge=False)
+        ==============================================================
+        ParallelEvaluate method evaluates a population of parameter sets
+        across the pool of worker processes created by CreatePool
+
+        Parameters
+        ----------
+        Pars : [array]
+            2D array (n_sets, n_par) of parameter sets.
+        ChunkSize : [int], optional
+            number of parameter sets sent to a worker at a time. The default is 1.
+        Thresholds : [array], optional
+            1D array (n_sets) of the thresholds to evaluate the parameter sets
+            with BoundedError (the pool has to be created for the
+            "Distributed" model), None to use CalculateError. The default is None.
+        TimeChunk : [integer], optional
+            number of time steps in each block of BoundedError. The default is 1000.
+        Metric : [str], optional
+            metric of BoundedError "RMSE" or "SSE". The default is "RMSE".
+        Objectives : [list], optional
+            names of the performance criteria to evaluate the parameter sets
+            with CalculateObjectives (multi-objective). The default is None.
+        PerGauge : [bool], optional
+            True to have an objective for each criterion at each gauge
+            (Objectives). The default is False.
+
+        Returns
+        -------
+        errors : [array]
+            1D array (n_sets) of the objective function values in the same
+            order as Pars (nan for failed runs), 2D array (n_sets, n_obj)
+            of the objectives if Objectives are given.
+        aborted : [array]
+            1D bool array (n_sets) of the runs of BoundedError that stopped
+            early, only returned if Thresholds are given.
+        """
+        assert hasattr(self, "Pool"), "please create the pool of workers first using the CreatePool method"
+
+        Pars = np.atleast_2d(np.asarray(Pars, dtype=np.float64))
+        if self.Seed is None:
+            Seeds = [None] * len(Pars)
+        else:
+            Seeds = [self.Seed + self.Evaluations + i for i in range(len(Pars))]
+        self.Evaluations = self.Evaluations + len(Pars)
+
+        if Objectives is not None:
+            Args = [(Objectives, PerGauge)] * len(Pars)
+            objectives = self.Pool.map(_WorkerObjectives, zip(Pars, Seeds, Args), chunksize=ChunkSize)
+            return np.array(objectives, dtype=np.float64)
+
+        if Thresholds is None:
+            Bounds = [None] * len(Pars)
+        else:
+            Bounds = [(threshold, TimeChunk, Metric) for threshold in np.broadcast_to(Thresholds, (len(Pars),))]
+
+        errors = self.Pool.map(_WorkerEvaluate, zip(Pars, Seeds, Bounds), chunksize=ChunkSize)
+
+        if Thresholds is not None:
+            errors, aborted = np.array(errors, dtype=np.float64).reshape(len(Pars), 2).T
+            return errors, aborted.astype(bool)
+        return np.array(errors, dtype=np.float64)
+
+
+    def ClosePool(self):
+        """
+        ==============================================================
+            ClosePool()
+        ==============================================================
+        ClosePool method stops the worker processes and frees the shared
+        memory blocks created by CreatePool
+
+        Returns
+        -------
+        None.
+        """
+        if hasattr(self, "Pool"):
+            self.Pool.close()
+            self.Pool.join()
+            del self.Pool
+
+        if hasattr(self, "SharedBlocks"):
+            for block in self.SharedBlocks:
+                block.close()
+                block.unlink()
+            del self.SharedBlocks
+
+
     def ListAttributes(self):
         """
         Print Attributes List
@@ -604,3 +1786,90 @@ class Calibration(Catchment):
                 print(str(key) + ' : ' + repr(self.__dict__[key]))
 
         print('\n')
+
+
+def _HarmonySearch():
+    """
+    import the harmony search of Oasis, it is only used by RunCalibration,
+    FW1Calibration & LumpedCalibration (PopulationCalibration uses the
+    optimizers of Hapi) so Oasis is an optional dependency
+    """
+    try:
+        from Oasis.optimization import Optimization
+        from Oasis.hsapi import HSapi
+    except ImportError:
+        raise ImportError("the harmony search calibration needs the optional dependency oasis, "
+                          "PopulationCalibration does not need it")
+    return Optimization, HSapi
+
+
+# calibration object of each worker process of Calibration.CreatePool
+_Worker = {}
+
+def _AttachSharedMemory(name):
+    """
+    attach a worker of Calibration.CreatePool to a shared memory block of the
+    main process without registering the block with the resource tracker,
+    the block belongs to the main process (ClosePool unlinks it).
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # the tracker is shared with the main process, unregistering the block
+    # from the worker would remove the registration of the main process too,
+    # so the block is not registered at all
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _WorkerInit(cls, State, Modules, SharedArrays, EvaluateArgs):
+    """
+    initialize a worker of Calibration.CreatePool, rebuild the calibration
+    object with the meteorological inputs as views on the shared memory
+    """
+    Model = cls.__new__(cls)
+    Model.__dict__.update(State)
+    for key, name in Modules.items():
+        setattr(Model, key, importlib.import_module(name))
+
+    Blocks = []
+    for key, (name, shape, dtype) in SharedArrays.items():
+        block = _AttachSharedMemory(name)
+        Blocks.append(block)
+        setattr(Model, key, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+
+    if hasattr(Model, "ForcingStore"):
+        Model.ReadForcingStore(Model.ForcingStore)
+
+    _Worker["Model"] = Model
+    _Worker["Blocks"] = Blocks
+    _Worker["Args"] = EvaluateArgs
+
+
+def _WorkerEvaluate(args):
+    """
+    evaluate one parameter set in a worker of Calibration.CreatePool
+    """
+    par, seed, bound = args
+    if seed is not None:
+        np.random.seed(seed)
+
+    if bound is not None:
+        # early abort of the distributed model (BoundedError)
+        return _Worker["Model"].BoundedError(par, _Worker["Args"][1], *bound)
+    return _Worker["Model"].CalculateError(par, *_Worker["Args"])
+
+
+def _WorkerObjectives(args):
+    """
+    calculate the objectives of one parameter set (multi-objective) in a
+    worker of Calibration.CreatePool
+    """
+    par, seed, (Objectives, PerGauge) = args
+    if seed is not None:
+        np.random.seed(seed)
+
+    return _Worker["Model"].CalculateObjectives(par, Objectives, *_Worker["Args"], PerGauge=PerGauge)
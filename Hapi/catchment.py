@@ -8,6 +8,7 @@ import numpy as np
 import pandas as pd
 import datetime as dt
 import os
+import hashlib
 import gdal
 from types import ModuleType
 import matplotlib.pyplot as plt
@@ -35,20 +36,32 @@ class Catchment():
         1-ReadRainfall
         2-ReadTemperature
         3-ReadET
-        4-ReadFlowAcc
-        5-ReadFlowDir
-        6-ReadFlowPathLength
-        7-ReadParameters
-        8-ReadLumpedModel
-        9-ReadLumpedInputs
-        10-ReadGaugeTable
-        11-ReadDischargeGauges
-        12-ReadParametersBounds
-        13-ExtractDischarge
-        14-PlotHydrograph
-        15-PlotDistributedQ
-        16-SaveResults
+        4-CreateForcingStore
+        5-ReadForcingStore
+        6-ReadFlowAcc
+        7-ReadFlowDir
+        8-ReadFlowPathLength
+        9-ReadParameters
+        10-ReadLumpedModel
+        11-ReadLumpedInputs
+        12-ReadGaugeTable
+        13-ReadDischargeGauges
+        14-ReadParametersBounds
+        15-CreateCache
+        16-RunoffKey
+        17-ExtractDischarge
+        18-PlotHydrograph
+        19-PlotDistributedQ
+        20-SaveResults
     """
+    # indices of the routing parameters (muskingum k & x) in the parameters
+    # cube, the rest of the parameters are used by the lumped model
+    RoutingParameters = [10, 11]
+    # rows of the Metrics dataframe {name in PC.FusedMetrics: row}
+    MetricsNames = {"RMSE": 'RMSE', "NSE": 'NSE', "NSEHF": 'NSEhf', "KGE": 'KGE',
+                    "WB": 'WB', "PearsonCorre": 'Pearson-CC', "R2": 'R2'}
+    # increased every time forcing data are read (part of the RunoffKey)
+    ForcingVersion = 0
 
     def __init__(self, name, StartDate, EndDate, fmt="%Y-%m-%d", SpatialResolution = 'Lumped',
                  TemporalResolution = "Daily"):
@@ -121,6 +134,7 @@ class Catchment():
             assert len(os.listdir(Path)) > 0, Path+" folder you have provided is empty"
             # read data
             self.Prec = Raster.ReadRastersFolder(Path)
+            self.ForcingVersion += 1
             self.TS = self.Prec.shape[2] + 1 # no of time steps =length of time series +1
             assert type(self.Prec) == np.ndarray, "array should be of type numpy array"
             print("Rainfall data are read successfully")
@@ -129,18 +143,24 @@ class Catchment():
     def ReadTemperature(self,Path, ll_temp=None):
         """
         =========================================================
-            ReadTemperature(Path)
+            ReadTemperature(Path, ll_temp=None)
         =========================================================
 
         Parameters
         ----------
         Path : [String]
             path to the Folder contains temperature rasters.
+        ll_temp : [numpy array], optional
+            long term average temperature, 2D array (rows, cols) or 3D array
+            with the same shape as the temperature data. The default is None
+            (the average temperature of each cell).
 
         Returns
         -------
         Temp : [array attribute]
             array containing the spatial temperature values
+        ll_temp : [array attribute]
+            array containing the long term average temperature
 
         """
         if not hasattr(self, 'Temp'):
@@ -152,6 +172,7 @@ class Catchment():
             assert len(os.listdir(Path)) > 0, Path+" folder you have provided is empty"
             # read data
             self.Temp = Raster.ReadRastersFolder(Path)
+            self.ForcingVersion += 1
             assert type(self.Temp) == np.ndarray, "array should be of type numpy array"
 
             if ll_temp is None:
@@ -160,6 +181,13 @@ class Catchment():
                 for i in range(self.Temp.shape[0]):
                     for j in range(self.Temp.shape[1]):
                         self.ll_temp[i,j,:] = avg[i,j]
+            else:
+                ll_temp = np.asarray(ll_temp, dtype=np.float32)
+                if ll_temp.ndim == 2:
+                    # one long term value for each cell
+                    ll_temp = np.broadcast_to(ll_temp[:,:,np.newaxis], self.Temp.shape)
+                assert ll_temp.shape == self.Temp.shape, "ll_temp should be a 2D array (rows, cols) or have the same shape as the temperature data"
+                self.ll_temp = ll_temp
 
             print("Temperature data are read successfully")
 
@@ -190,10 +218,150 @@ class Catchment():
             assert len(os.listdir(Path)) > 0, Path+" folder you have provided is empty"
             # read data
             self.ET = Raster.ReadRastersFolder(Path)
+            self.ForcingVersion += 1
             assert type(self.ET) == np.ndarray, "array should be of type numpy array"
             print("Potential Evapotranspiration data are read successfully")
 
 
+    def CreateForcingStore(self, Path, PrecPath, TempPath, ETPath, BlockSize=256,
+                           ll_temp=None):
+        """
+        =========================================================
+            CreateForcingStore(Path, PrecPath, TempPath, ETPath, BlockSize=256, ll_temp=None)
+        =========================================================
+        CreateForcingStore method writes the rainfall, temperature and
+        evapotranspiration rasters to a store of memory-mapped numpy files
+        (Prec.npy, Temp.npy, ET.npy) with one float32 row (n_cells, T) for
+        each cell in the catchment (cells of the flow accumulation raster
+        with values), the rasters are read one by one so the whole cube is
+        never in memory, the store has to be created once and can be read by
+        any number of processes using ReadForcingStore
+
+        Parameters
+        ----------
+        Path : [String]
+            path to the folder where the store is going to be saved.
+        PrecPath : [String]
+            path to the Folder contains precipitation rasters.
+        TempPath : [String]
+            path to the Folder contains temperature rasters.
+        ETPath : [String]
+            path to the Folder contains Evapotranspiration rasters.
+        BlockSize : [integer], optional
+            number of rasters kept in memory before writing them to the store.
+            The default is 256.
+        ll_temp : [numpy array], optional
+            long term average temperature, 2D array (rows, cols) with one
+            value for each cell or 3D array (rows, cols, T). The default is
+            None (the average temperature of each cell).
+
+        Returns
+        -------
+        None.
+
+        Example
+        -------
+            Coello.ReadFlowAcc("GIS/acc4000.tif")
+            Coello.CreateForcingStore("store/", "meteodata/prec", "meteodata/temp",
+                                      "meteodata/evap")
+            Coello.ReadForcingStore("store/")
+        """
+        assert hasattr(self, "FlowAccArr"), "please read the flow accumulation raster first using the ReadFlowAcc method"
+        if not os.path.exists(Path):
+            os.makedirs(Path)
+
+        rows, cols = np.where(self.FlowAccArr != self.NoDataValue)
+        np.save(os.path.join(Path, "Cells.npy"), np.column_stack([rows, cols]).astype(np.int32))
+
+        for name, Folder in zip(["Prec", "Temp", "ET"], [PrecPath, TempPath, ETPath]):
+            assert type(Folder) == str, name + " path input should be string type"
+            assert os.path.exists(Folder), Folder + " you have provided does not exist"
+            files = os.listdir(Folder)
+            if "desktop.ini" in files: files.remove("desktop.ini")
+            assert len(files) > 0, Folder + " folder you have provided is empty"
+            assert all(f.endswith(".tif") for f in files), "all files in the given folder should have .tif extension"
+            # the same order as Raster.ReadRastersFolder (number at the beginning of the name)
+            try:
+                files = [x for _, x in sorted((int(f.split("_")[0]), f) for f in files)]
+            except ValueError:
+                assert False, "please include a number at the beginning of the rasters name to indicate the order of the raster"
+
+            store = np.lib.format.open_memmap(os.path.join(Path, name + ".npy"), mode="w+",
+                                              dtype=np.float32, shape=(len(rows), len(files)))
+            for start in range(0, len(files), BlockSize):
+                end = min(start + BlockSize, len(files))
+                block = np.zeros((len(rows), end - start), dtype=np.float32)
+                for i in range(start, end):
+                    block[:, i - start] = gdal.Open(os.path.join(Folder, files[i])).ReadAsArray()[rows, cols]
+                store[:, start:end] = block
+
+            if name == "Temp":
+                # long term average temperature of each cell (n_cells,) or the
+                # given one (n_cells,) / (n_cells, T)
+                if ll_temp is None:
+                    cell_ll_temp = store.mean(axis=1, dtype=np.float64)
+                else:
+                    assert np.ndim(ll_temp) in [2, 3] and np.shape(ll_temp)[:2] == self.FlowAccArr.shape, "ll_temp should have the same rows & columns as the flow accumulation raster"
+                    assert np.ndim(ll_temp) == 2 or np.shape(ll_temp)[2] == len(files), "ll_temp should have the same number of time steps as the temperature data"
+                    cell_ll_temp = ll_temp[rows, cols]
+                np.save(os.path.join(Path, "ll_temp.npy"), np.asarray(cell_ll_temp, dtype=np.float32))
+            store.flush()
+            del store
+
+        print("Forcing store is created successfully")
+
+
+    def ReadForcingStore(self, Path):
+        """
+        =========================================================
+            ReadForcingStore(Path)
+        =========================================================
+        ReadForcingStore method opens the store created by CreateForcingStore
+        as read-only memory-mapped arrays, the data are read from the disk
+        when they are needed and the pages are shared between all the
+        processes that open the same store (no copies), the model uses the
+        store instead of the Prec, Temp & ET arrays
+
+        Parameters
+        ----------
+        Path : [String]
+            path to the folder of the store.
+
+        Returns
+        -------
+        PrecStore : [array attribute]
+            (n_cells, T) float32 rainfall of each cell.
+        TempStore : [array attribute]
+            (n_cells, T) float32 temperature of each cell.
+        ETStore : [array attribute]
+            (n_cells, T) float32 Evapotranspiration of each cell.
+        llTempStore : [array attribute]
+            (n_cells, T) float32 long term average temperature of each cell.
+        StoreCells : [array attribute]
+            (n_cells, 2) row & column of each cell in the store.
+        """
+        assert os.path.exists(Path), Path + " you have provided does not exist"
+        for name in ["Cells", "Prec", "Temp", "ET", "ll_temp"]:
+            assert os.path.exists(os.path.join(Path, name + ".npy")), name + ".npy does not exist in the store please create it using CreateForcingStore"
+
+        self.StoreCells = np.load(os.path.join(Path, "Cells.npy"))
+        self.PrecStore = np.load(os.path.join(Path, "Prec.npy"), mmap_mode="r")
+        self.TempStore = np.load(os.path.join(Path, "Temp.npy"), mmap_mode="r")
+        self.ETStore = np.load(os.path.join(Path, "ET.npy"), mmap_mode="r")
+        assert self.PrecStore.shape == self.TempStore.shape == self.ETStore.shape, "all meteorological input data should have the same length"
+        ll_temp = np.load(os.path.join(Path, "ll_temp.npy"), mmap_mode="r")
+        if ll_temp.ndim == 1:
+            # the long term temperature does not change with time (no copies)
+            ll_temp = np.broadcast_to(ll_temp[:, np.newaxis], self.TempStore.shape)
+        assert ll_temp.shape == self.TempStore.shape, "ll_temp.npy should have the same shape as the temperature store"
+        self.llTempStore = ll_temp
+
+        self.ForcingStore = Path
+        self.ForcingVersion += 1
+        self.TS = self.PrecStore.shape[1] + 1 # no of time steps =length of time series +1
+        print("Forcing store is read successfully")
+
+
     def ReadFlowAcc(self, Path):
         """
         =========================================================
@@ -259,6 +427,10 @@ class Catchment():
         # no_cells=np.size(raster[:,:])-np.count_nonzero(raster[raster==no_val])
         self.px_tot_area = self.no_elem*self.px_area # total area of pixels
 
+        # the routing order has to be calculated again for the new raster
+        if hasattr(self, "RoutingLevels"):
+            del self.RoutingLevels
+
         print("Flow Accmulation input is read successfully")
 
 
@@ -278,8 +450,21 @@ class Catchment():
         -------
         FlowDirArr : [array].
             array of the flow direction raster
+        CellIndex : [array]
+            index of each cell in the flow direction table (-1 for cells
+            without flow direction).
+        Cells : [array]
+            int32 array (no_cells, 2) of the row & column of each cell.
+        DownstreamCell : [array]
+            int32 index of the cell each cell drains into (-1 if outside).
+        UpstreamOffsets : [array]
+            int32 array (no_cells + 1), the upstream cells of cell i are
+            UpstreamCells[UpstreamOffsets[i]:UpstreamOffsets[i+1]].
+        UpstreamCells : [array]
+            int32 indices of the upstream cells.
         FDT : [dictionary]
-            flow direction table
+            the flow direction table {"row,col": [(row, col) of the upstream
+            cells]} built from the arrays above when it is first used.
         """
         # data type
         assert type(Path) == str, "PrecPath input should be string type"
@@ -296,16 +481,43 @@ class Catchment():
         # check flow direction input raster
         fd_noval = np.float32(FlowDir.GetRasterBand(1).GetNoDataValue())
         self.FlowDirArr = FlowDir.ReadAsArray()
-        fd_val = [int(self.FlowDirArr[i,j]) for i in range(rows) for j in range(cols) if self.FlowDirArr[i,j] != fd_noval]
-        fd_val = list(set(fd_val))
+        fd_val = np.unique(self.FlowDirArr[self.FlowDirArr != fd_noval]).astype(int).tolist()
         fd_should = [1,2,4,8,16,32,64,128]
         assert all(fd_val[i] in fd_should for i in range(len(fd_val))), "flow direction raster should contain values 1,2,4,8,16,32,64,128 only "
 
-        # create the flow direction table
-        self.FDT = GC.FlowDirecTable(FlowDir)
+        # create the flow direction table (upstream adjacency arrays)
+        (self.CellIndex, self.Cells, self.DownstreamCell, self.UpstreamOffsets,
+         self.UpstreamCells) = GC.FlowDirecTableCSR(FlowDir)
+        # the routing order has to be calculated again for the new table
+        if hasattr(self, "RoutingLevels"):
+            del self.RoutingLevels
+        if hasattr(self, "_FDT"):
+            del self._FDT
         print("Flow Direction input is read successfully")
 
 
+    @property
+    def FDT(self):
+        """
+        ================================================================
+            FDT
+        ================================================================
+        the flow direction table as a dictionary with the cells indices
+        ("row,col") as a key and the indices of the directly upstream cells
+        as values (list of tuples), the same as GISCatchment.FlowDirecTable.
+        the routing uses the upstream adjacency arrays (ReadFlowDir), the
+        dictionary is built from them the first time it is used.
+        """
+        if not hasattr(self, "_FDT"):
+            assert hasattr(self, "UpstreamCells"), "please read the flow direction raster first (ReadFlowDir)"
+            cells = self.Cells
+            self._FDT = {}
+            for i in range(len(cells)):
+                upstream = self.UpstreamCells[self.UpstreamOffsets[i]:self.UpstreamOffsets[i+1]]
+                self._FDT[str(cells[i,0])+','+str(cells[i,1])] = [(int(cells[k,0]),int(cells[k,1])) for k in upstream]
+        return self._FDT
+
+
     def ReadFlowPathLength(self, Path):
         """
         ==============================================================
@@ -385,6 +597,9 @@ class Catchment():
             assert len(os.listdir(Path)) > 0, Path+" folder you have provided is empty"
             # parameters
             self.Parameters = Raster.ReadRastersFolder(Path)
+            # coefficients of old parameters (see Calibration.ReadMuskingumCoef)
+            if hasattr(self, "MuskingumCoef"):
+                del self.MuskingumCoef, self.MuskingumPar
         else:
             self.Parameters = pd.read_csv(Path, index_col = 0, header = None)[1].tolist()
 
@@ -421,6 +636,15 @@ class Catchment():
               ReadLumpedModel(LumpedModel, CatArea, InitialCond, q_init=None)
         =============================================================================
 
+        the lumped model module has to have a Simulate function or a batched
+        SimulateBatch function (hbv, hbvlumped and hbv_bergestrom92), the
+        batched version runs all the cells together and is used when it exists
+        SimulateBatch(prec, temp, et, ll_temp, par, init_st, q_init, snow, states)
+        takes (n_cells, n) inputs and (n_cells, n_par) parameters (ordered as
+        the module's PAR_NAMES[snow]) and returns the upper and lower zone
+        discharge (n_cells, n+1) in mm/timestep and the states (n_cells, n+1, 5)
+        ordered as the module's ST_NAMES.
+
         Parameters
         ----------
         LumpedModel : [module]
@@ -445,6 +669,7 @@ class Catchment():
         """
 
         assert isinstance(LumpedModel,ModuleType) , "ConceptualModel should be a module or a python file contains functions "
+        assert hasattr(LumpedModel, "SimulateBatch") or hasattr(LumpedModel, "Simulate"), "the lumped model module should have a Simulate or a SimulateBatch function"
         self.LumpedModel = LumpedModel
         self.CatArea = CatArea
 
@@ -639,6 +864,67 @@ class Catchment():
         print("Parameters bounds are read successfully")
 
 
+    def CreateCache(self):
+        """
+        =============================================================
+            CreateCache()
+        =============================================================
+        CreateCache method enables the cache of the last run of Wrapper.HapiModel,
+        if the next run changes only the routing parameters (RoutingParameters)
+        the discharge generated by the lumped model (quz & qlz) is reused and
+        only the downstream paths of the cells whose routing parameters have
+        changed are routed again
+
+        Returns
+        -------
+        Cache : [dict attribute]
+            {"Runoff": key of the parameters of the lumped model,
+             "Routing": routing parameters of the last run}
+        """
+        self.Cache = {}
+
+
+    def RunoffKey(self, Forcing=True):
+        """
+        =============================================================
+            RunoffKey(Forcing=True)
+        =============================================================
+        RunoffKey method returns a hash of everything the lumped model run
+        (RunLumpedRRM) depends on, the parameters except the routing
+        parameters, the initial conditions, the lumped model, Timef, the
+        areas and the forcing (shape of the forcing arrays, TS and
+        ForcingVersion, the forcing is not hashed so if the forcing arrays
+        are changed without the Read methods ForcingVersion has to be
+        increased)
+
+        Parameters
+        ----------
+        Forcing : [bool], optional
+            False to leave the forcing out of the key (e.g. the checkpoint of
+            StreamRun can be continued with more forcing data). The default
+            is True.
+
+        Returns
+        -------
+        key : [str]
+            sha1 hash.
+        """
+        runoff = np.delete(np.asarray(self.Parameters), self.RoutingParameters, axis=-1)
+        key = hashlib.sha1(np.ascontiguousarray(runoff).tobytes())
+        key.update(repr((runoff.shape, self.InitialCond, self.q_init, self.Snow,
+                         self.LumpedModel.__name__, self.Timef, self.CatArea,
+                         self.px_tot_area, self.px_area)).encode())
+
+        if Forcing:
+            forcing = []
+            for name in ["Prec", "Temp", "ET", "ll_temp", "PrecStore", "TempStore", "ETStore", "llTempStore"]:
+                if hasattr(self, name):
+                    arr = np.asarray(getattr(self, name))
+                    forcing.append((name, arr.shape, arr.dtype.str))
+            key.update(repr((forcing, self.ForcingVersion, self.TS)).encode())
+        return key.hexdigest()
+
+
     def ExtractDischarge(self, CalculateMetrics=True, FW1=False, Factor=None):
         """
         =============================================================================
@@ -674,6 +960,8 @@ class Catchment():
             if CalculateMetrics:
                 index = ['RMSE', 'NSE', 'NSEhf', 'KGE', 'WB','Pearson-CC','R2']
                 self.Metrics = pd.DataFrame(index = index, columns = self.QGauges.columns)
+                # simulated discharge of all gauges to calculate the metrics together
+                Qsims = np.empty((len(self.GaugesTable), self.TS-1))
 
             for i in range(len(self.GaugesTable)):
                 Xind = int(self.GaugesTable.loc[self.GaugesTable.index[i],"cell_row"])
@@ -684,21 +972,25 @@ class Catchment():
                 # Qlz = np.reshape(self.qlz_translated[Xind,Yind,:-1],self.TS-1)
                 # Qsim = Quz + Qlz
 
-                Qsim = np.reshape(self.Qtot[Xind,Yind,:-1],self.TS-1)
+                if hasattr(self, "Qtot"):
+                    Qsim = np.reshape(self.Qtot[Xind,Yind,:-1],self.TS-1)
+                else:
+                    # lean or impulse response run (only the discharge at the gauges is kept)
+                    Qsim = self.GaugesQtot[i,:-1]
                 if Factor != None:
                     self.Qsim.loc[:,gaugeid] = Qsim * Factor[i]
                 else:
                     self.Qsim.loc[:,gaugeid] = Qsim
 
                 if CalculateMetrics:
-                    Qobs = self.QGauges.loc[:,gaugeid]
-                    self.Metrics.loc['RMSE',gaugeid] = round(PC.RMSE(Qobs, Qsim),3)
-                    self.Metrics.loc['NSE',gaugeid] = round(PC.NSE(Qobs, Qsim),3)
-                    self.Metrics.loc['NSEhf',gaugeid] = round(PC.NSEHF(Qobs, Qsim),3)
-                    self.Metrics.loc['KGE',gaugeid] = round(PC.KGE(Qobs, Qsim),3)
-                    self.Metrics.loc['WB',gaugeid] = round(PC.WB(Qobs, Qsim),3)
-                    self.Metrics.loc['Pearson-CC',gaugeid] = round(PC.PearsonCorre(Qobs, Qsim),3)
-                    self.Metrics.loc['R2',gaugeid] = round(PC.R2(Qobs, Qsim),3)
+                    Qsims[i,:] = Qsim
+
+            if CalculateMetrics:
+                gaugeids = self.GaugesTable.loc[:,"id"].tolist()
+                Qobs = self.QGauges.loc[:,gaugeids].values.astype(np.float64).T
+                metrics = PC.FusedMetrics(Qobs, Qsims)
+                for name, row in self.MetricsNames.items():
+                    self.Metrics.loc[row,gaugeids] = np.round(metrics[name],3)
         else:
 
             self.Qsim = pd.DataFrame(index = self.Index)
@@ -710,14 +1002,10 @@ class Catchment():
                 index = ['RMSE', 'NSE', 'NSEhf', 'KGE', 'WB','Pearson-CC', 'R2']
                 self.Metrics = pd.DataFrame(index = index)
             if CalculateMetrics:
-                    Qobs = self.QGauges.loc[:,gaugeid]
-                    self.Metrics.loc['RMSE',gaugeid] = round(PC.RMSE(Qobs, Qsim),3)
-                    self.Metrics.loc['NSE',gaugeid] = round(PC.NSE(Qobs, Qsim),3)
-                    self.Metrics.loc['NSEhf',gaugeid] = round(PC.NSEHF(Qobs, Qsim),3)
-                    self.Metrics.loc['KGE',gaugeid] = round(PC.KGE(Qobs, Qsim),3)
-                    self.Metrics.loc['WB',gaugeid] = round(PC.WB(Qobs, Qsim),3)
-                    self.Metrics.loc['Pearson-CC',gaugeid] = round(PC.PearsonCorre(Qobs, Qsim),3)
-                    self.Metrics.loc['R2',gaugeid] = round(PC.R2(Qobs, Qsim),3)
+                    Qobs = self.QGauges.loc[:,gaugeid].values.astype(np.float64)
+                    metrics = PC.FusedMetrics(Qobs, Qsim)
+                    for name, row in self.MetricsNames.items():
+                        self.Metrics.loc[row,gaugeid] = round(metrics[name],3)
 
 
     def PlotHydrograph(self, plotstart, plotend, gaugei, Hapicolor="#004c99",
@@ -14,6 +14,8 @@ import os
 import gdal
 from Hapi.raster import Raster
 from Hapi.giscatchment import GISCatchment as GC
+from Hapi.routing import Routing
+from Hapi.catchment import Catchment
 
 
 class DistParameters():
@@ -34,14 +36,19 @@ class DistParameters():
     5- HRU_HAND
     6- ParametersNumber
     7- SaveParameters
+    8- ParametersArray
+    9- calculateK
+    10- MuskingumCoefficients
     """
 
     def __init__(self, raster, no_parameters, no_lumped_par=0, lumped_par_pos=[],
-                 Lake = 0, Snow=0, HRUs=0, Function=1, Kub=1, Klb= 0.5, Maskingum=False):
+                 Lake = 0, Snow=0, HRUs=0, Function=1, Kub=1, Klb= 0.5, Maskingum=False,
+                 Timef=1):
         """
         =============================================================================
              DistParameters(self, raster, no_parameters, no_lumped_par=0, lumped_par_pos=[],
-                         Lake = 0, Snow=0, HRUs=0, Function=1, Kub=1, Klb= 0.5, Maskingum=False):
+                         Lake = 0, Snow=0, HRUs=0, Function=1, Kub=1, Klb= 0.5, Maskingum=False,
+                         Timef=1):
         =============================================================================
         To initiate the DistParameters class you have to provide the Flow Acc
         raster
@@ -73,6 +80,10 @@ class DistParameters():
             lower bound for the k-muskingum parameter. The default is 0.5.
         Maskingum : [bool], optional
             if the routing function is muskingum. The default is False.
+        Timef : [numeric], optional
+            time step (hours) used to calculate the muskingum coefficients
+            (Coef3d) of the distributed k & x, it should be the same as the
+            Timef of the catchment. The default is 1.
 
         Returns
         -------
@@ -97,6 +108,9 @@ class DistParameters():
         self.Kub = Kub
         self.Klb = Klb
         self.Maskingum = Maskingum
+        self.Timef = Timef
+        # factor of the k bounds & constraints (Calibration.MultiResolutionCalibration)
+        self.KScale = 1
         # read the raster
         self.raster = raster
         self.raster_A = raster.ReadAsArray()
@@ -106,26 +120,22 @@ class DistParameters():
         # get the no_value of in the raster
         self.noval = np.float32(raster.GetRasterBand(1).GetNoDataValue())
 
+        # store the indeces of the non-empty cells (row by row)
+        self.celli, self.cellj = np.where(self.raster_A != self.noval)
+
         # count the number of non-empty cells
         if self.HRUs == 1:
-            self.values = list(set([int(self.raster_A[i,j]) for i in range(self.rows) for j in range(self.cols) if self.raster_A[i,j] != self.noval]))
+            self.values = list(set(self.raster_A[self.celli, self.cellj].astype(int).tolist()))
             self.no_elem = len(self.values)
         else:
             self.no_elem = np.size(self.raster_A[:,:])-np.count_nonzero((self.raster_A[self.raster_A == self.noval]))
 
         self.no_parameters = no_parameters
 
-        # store the indeces of the non-empty cells
-        self.celli=[]
-        self.cellj=[]
-        for i in range(self.rows):
-            for j in range(self.cols):
-                if self.raster_A[i,j] != self.noval:
-                    self.celli.append(i)
-                    self.cellj.append(j)
-
         # create an empty 3D array [[raster dimension], no_parameters]
         self.Par3d = np.zeros([self.rows, self.cols, self.no_parameters])*np.nan
+        # muskingum coefficients [c1, c2, c3] of the k & x of each cell
+        self.Coef3d = np.zeros([self.rows, self.cols, 3])*np.nan
 
         if no_lumped_par >= 1:
             # parameters in array
@@ -136,6 +146,25 @@ class DistParameters():
         # create a 2d array [no_parameters, no_cells]
         self.Par2d = np.ones((self.no_parameters,self.no_elem))
 
+        # rows of the distributed & the lumped parameters in Par2d after
+        # inserting the lumped parameters at their positions
+        order = list(range(self.no_parameters))
+        for i in range(no_lumped_par):
+            order.insert(lumped_par_pos[i], -1-i)
+        self.DistRows = np.array([r for r in range(len(order)) if order[r] >= 0], dtype=np.int64)
+        self.LumpedRows = np.array([order.index(-1-i) for i in range(no_lumped_par)], dtype=np.int64)
+
+        # HRU (column in Par2d) of each cell
+        if self.HRUs == 1:
+            values = np.asarray(self.values, dtype=np.float64)
+            cellvalues = self.raster_A[self.celli, self.cellj].astype(np.float64)
+            sort = np.argsort(values)
+            hru = sort[np.searchsorted(values[sort], cellvalues).clip(max=len(values)-1)]
+            # cells with values that are not a class (not integer) are not assigned
+            classified = values[hru] == cellvalues
+            self.HRUCells = (self.celli[classified], self.cellj[classified])
+            self.HRUClass = hru[classified]
+
         if Function == 1:
             self.Function = self.par3dLumped
         elif Function == 2:
@@ -244,32 +273,21 @@ class DistParameters():
             assert len(par_g) == self.no_elem*self.no_parameters,"As there is no lumped parameters length of input parameters should be "+str(self.no_elem)+"*"+str(self.no_parameters)+"="+str(self.no_elem*self.no_parameters)
 
         # parameters in array
-        # create a 2d array [no_parameters, no_cells]
-        self.Par2d = np.ones((self.no_parameters,self.no_elem))
-        # take the parameters from the generated parameters or the 1D list and
-        # assign them to each cell
-        for i in range(self.no_elem):
-            self.Par2d[:,i] = par_g[i*self.no_parameters:(i*self.no_parameters) + self.no_parameters]
-
-        ### lumped parameters
-        if self.no_lumped_par > 0:
-            for i in range(self.no_lumped_par):
-                # create a list with the value of the lumped parameter(k1)
-                # (stored at the end of the list of the parameters)
-                pk1 = np.ones((1,self.no_elem))*par_g[(self.no_parameters * np.shape(self.Par2d)[1])+i]
-                # put the list of parameter k1 at the 6 row
-                self.Par2d = np.vstack([self.Par2d[:self.lumped_par_pos[i],:],pk1,self.Par2d[self.lumped_par_pos[i]:,:]])
+        # create a 2d array [no_parameters, no_cells] the parameters of each
+        # cell are consecutive in the generated parameters or the 1D list
+        # and the lumped parameters (k1) are stored at the end of the list
+        self.Par2d = self.ParametersArray(par_g)
 
         # assign the parameters from the array (no_parameters, no_cells) to
         # the spatially corrected location in par2d
-        for i in range(self.no_elem):
-            self.Par3d[self.celli[i],self.cellj[i],:] = self.Par2d[:,i]
+        self.Par3d[self.celli,self.cellj,:] = self.Par2d.T
 
         # calculate the value of k(travelling time in muskingum based on value of
         # x and the position and upper, lower bound of k value
         if Maskingum == True:
-            for i in range(self.no_elem):
-                self.Par3d[self.celli[i],self.cellj[i],-2]= DistParameters.calculateK(self.Par3d[self.celli[i],self.cellj[i],-1],self.Par3d[self.celli[i],self.cellj[i],-2],kub,klb)
+            self.Par3d[self.celli,self.cellj,-2] = DistParameters.calculateK(self.Par3d[self.celli,self.cellj,-1],self.Par3d[self.celli,self.cellj,-2],kub,klb,self.KScale)
+
+        self.MuskingumCoefficients()
 
 
 
@@ -320,59 +338,130 @@ class DistParameters():
 
         # take the parameters from the generated parameters or the 1D list and
         # assign them to each cell
-        for i in range(self.no_elem):
-            self.Par2d[:,i] = par_g
+        self.Par2d[:,:] = np.asarray(par_g)[:,np.newaxis]
 
         # assign the parameters from the array (no_parameters, no_cells) to
         # the spatially corrected location in par2d
-        for i in range(self.no_elem):
-            self.Par3d[self.celli[i],self.cellj[i],:] = self.Par2d[:,i]
+        self.Par3d[self.celli,self.cellj,:] = self.Par2d.T
 
         # calculate the value of k(travelling time in muskingum based on value of
         # x and the position and upper, lower bound of k value
         if Maskingum == True:
-            for i in range(self.no_elem):
-                self.Par3d[self.celli[i],self.cellj[i],-2] = DistParameters.calculateK(self.Par3d[self.celli[i],self.cellj[i],-1],self.Par3d[self.celli[i],self.cellj[i],-2],kub,klb)
+            self.Par3d[self.celli,self.cellj,-2] = DistParameters.calculateK(self.Par3d[self.celli,self.cellj,-1],self.Par3d[self.celli,self.cellj,-2],kub,klb,self.KScale)
+
+        self.MuskingumCoefficients()
+
+
+    def ParametersArray(self, par_g):
+        """
+        ===================================================
+            ParametersArray(par_g)
+        ===================================================
+        ParametersArray method arranges the list of parameters [generated
+        from the optimization algorithm] in a 2D array (no_parameters, no_elem),
+        the parameters of each cell (HRU) are consecutive in the list and the
+        lumped parameters are at the end of the list, they are inserted in
+        the rows given by lumped_par_pos (DistRows & LumpedRows)
+
+        Inputs:
+        ----------
+            1- par_g : [list/numpy array]
+                list of parameters
+
+        Outputs:
+        ----------
+            1- Par2d : [2d array]
+                2D array (no_parameters + no_lumped_par, no_elem) of the
+                parameters of each cell (HRU)
+        """
+        par = np.asarray(par_g, dtype=np.float64)
+        no_dist = self.no_parameters*self.no_elem
+
+        Par2d = np.empty((len(self.DistRows) + len(self.LumpedRows), self.no_elem))
+        Par2d[self.DistRows,:] = par[:no_dist].reshape(self.no_elem, self.no_parameters).T
+        Par2d[self.LumpedRows,:] = par[no_dist:no_dist + self.no_lumped_par][:,np.newaxis]
+
+        return Par2d
 
 
     @staticmethod
-    def calculateK(x,position,UB,LB):
+    def calculateK(x,position,UB,LB,Scale=1):
         """
         ===================================================
-            calculateK(x,position,UB,LB):
+            calculateK(x,position,UB,LB,Scale=1):
         ===================================================
         calculateK method takes value of x parameter and generate 100 random
         value of k parameters between upper & lower constraint then the output
         will be the value coresponding to the giving position
 
+        the bounds & the constraints are multiplied by the Scale, a time step
+        Scale times longer gives k Scale times higher and the same muskingum
+        coefficients for the same x & position
+
         Inputs:
         ----------
-            1- x : [numeric]
+            1- x : [numeric/numpy array]
                 weighting coefficient to determine the linearity of the water surface
                 (one of the parameters of muskingum routing method)
-            2- position : [integer]
+            2- position : [integer/numpy array]
                 random position between upper and lower bounds of the k parameter
             3-UB : [numeric]
                 upper bound for k parameter
             3-LB : [numeric]
                 Lower bound for k parameter
+            4-Scale : [numeric]
+                factor of the bounds & the constraints. default is 1
+
+        Outputs:
+        ----------
+            1- k : [numeric/numpy array]
+                k of each x & position (arrays are calculated all together)
         """
+        x = np.asarray(x, dtype=np.float64)
+        position = np.asarray(position, dtype=np.float64)
         # k has to be smaller than this constraint
-        constraint1 = 0.5*1/(1-x)
+        constraint1 = 0.5*Scale/(1-x)
         # k has to be greater than this constraint
-        constraint2 = 0.5*1/x
+        constraint2 = 0.5*Scale/x
+        UB = UB*Scale
+        LB = LB*Scale
         #if constraint is higher than UB take UB
-        if constraint2 >= UB :
-            constraint2 = UB
+        constraint2 = np.where(constraint2 >= UB, UB, constraint2)
         #if constraint is lower than LB take UB
-        if constraint1 <= LB :
-            constraint1 = LB
-
-        generatedK = np.linspace(constraint1,constraint2,101)
-        k = generatedK[int(round(position,0))]
+        constraint1 = np.where(constraint1 <= LB, LB, constraint1)
+
+        # the value of the position in np.linspace(constraint1,constraint2,101)
+        position = np.round(position).astype(np.int64)
+        assert np.all((position >= -101) & (position <= 100)), "position should be between 0 and 100"
+        position = np.where(position < 0, position + 101, position)
+        k = np.where(position == 100, constraint2,
+                     constraint1 + position*((constraint2 - constraint1)/100))
+        if k.ndim == 0:
+            k = k[()]
         return k
 
 
+    def MuskingumCoefficients(self):
+        """
+        ===================================================
+            MuskingumCoefficients()
+        ===================================================
+        MuskingumCoefficients method calculates the muskingum coefficients
+        [c1, c2, c3] of the k & x (Catchment.RoutingParameters) of each cell, the
+        coefficients are stored in Coef3d (rows, cols, 3) next to Par3d so the
+        routing does not need to calculate them again (Catchment.MuskingumCoef)
+
+        Outputs:
+        ----------
+            1- Coef3d : [3d array]
+                3D array of the muskingum coefficients of each cell.
+        """
+        k, x = Catchment.RoutingParameters
+        self.Coef3d[self.celli,self.cellj,:] = Routing.MuskingumCoefficients(self.Par3d[self.celli,self.cellj,k],
+                                                                             self.Par3d[self.celli,self.cellj,x],
+                                                                             self.Timef)
+
+
     def par2d_lumpedK1_lake(self,par_g,no_parameters_lake,kub,klb):
         """
         ===========================================================
@@ -419,34 +508,28 @@ class DistParameters():
         # remove a place for the lumped parameter (k1) lower zone coefficient
         no_parameters = self.no_parameters-1
 
-        # create a 2d array [no_parameters, no_cells]
-        self.Par2d = np.ones((no_parameters,self.no_elem))
-
-        # take the parameters from the generated parameters or the 1D list and
-        # assign them to each cell
-        for i in range(self.no_elem):
-            self.Par2d[:,i] = par_g[i*no_parameters:(i*no_parameters)+no_parameters]
+        # create a 2d array [no_parameters, no_cells] from the parameters
+        # of each cell in the generated parameters or the 1D list
+        par = np.asarray(par_g, dtype=np.float64)
+        self.Par2d = par[:no_parameters*self.no_elem].reshape(self.no_elem, no_parameters).T
 
-        # create a list with the value of the lumped parameter(k1)
-        # (stored at the end of the list of the parameters)
-        pk1 = np.ones((1,self.no_elem))*par_g[(np.shape(self.Par2d)[0]*np.shape(self.Par2d)[1])]
-
-        # put the list of parameter k1 at the 6 row
-        self.Par2d = np.vstack([self.Par2d[:6,:],pk1,self.Par2d[6:,:]])
+        # put the value of the lumped parameter(k1) (stored at the end of the
+        # list of the parameters) at the 6 row
+        self.Par2d = np.insert(self.Par2d, 6, par[no_parameters*self.no_elem], axis=0)
 
         # assign the parameters from the array (no_parameters, no_cells) to
         # the spatially corrected location in par2d
-        for i in range(self.no_elem):
-            self.Par3d[self.celli[i],self.cellj[i],:] = self.Par2d[:,i]
+        self.Par3d[self.celli,self.cellj,:] = self.Par2d.T
 
         # calculate the value of k(travelling time in muskingum based on value of
         # x and the position and upper, lower bound of k value
-        for i in range(self.no_elem):
-            self.Par3d[self.celli[i],self.cellj[i],-2]= DistParameters.calculateK(self.Par3d[self.celli[i],self.cellj[i],-1],self.Par3d[self.celli[i],self.cellj[i],-2],kub,klb)
+        self.Par3d[self.celli,self.cellj,-2] = DistParameters.calculateK(self.Par3d[self.celli,self.cellj,-1],self.Par3d[self.celli,self.cellj,-2],kub,klb,self.KScale)
+
+        self.MuskingumCoefficients()
 
         # lake parameters
         self.lake_par = par_g[len(par_g)-no_parameters_lake:]
-        self.lake_par[-2] = DistParameters.calculateK(self.lake_par[-1],self.lake_par[-2],kub,klb)
+        self.lake_par[-2] = DistParameters.calculateK(self.lake_par[-1],self.lake_par[-2],kub,klb,self.KScale)
 
         # return self.Par3d, lake_par
 
@@ -534,29 +617,19 @@ class DistParameters():
             assert len(par_g) == self.no_elem*self.no_parameters,"As there is no lumped parameters length of input parameters should be "+str(self.no_elem)+"*"+str(self.no_parameters)+"="+str(self.no_elem*self.no_parameters)
 
         # take the parameters from the generated parameters or the 1D list and
-        # assign them to each cell
-        for i in range(self.no_elem):
-            self.Par2d[:,i] = par_g[i*self.no_parameters:(i*self.no_parameters) + self.no_parameters]
-
-        ### lumped parameters
-        if self.no_lumped_par > 0:
-            for i in range(self.no_lumped_par):
-                # create a list with the value of the lumped parameter(k1)
-                # (stored at the end of the list of the parameters)
-                pk1 = np.ones((1,self.no_elem))*par_g[(self.no_parameters*np.shape(self.Par2d)[1])+i]
-                # put the list of parameter k1 at the 6 row
-                self.Par2d = np.vstack([self.Par2d[:self.lumped_par_pos[i],:],pk1,self.Par2d[self.lumped_par_pos[i]:,:]])
+        # assign them to each HRU with the lumped parameters
+        self.Par2d = self.ParametersArray(par_g)
 
         # calculate the value of k(travelling time in muskingum based on value of
         # x and the position and upper, lower bound of k value
-        for i in range(self.no_elem):
-            self.Par2d[-2,i] = DistParameters.calculateK(self.Par2d[-1,i],self.Par2d[-2,i],kub,klb)
+        self.Par2d[-2,:] = DistParameters.calculateK(self.Par2d[-1,:],self.Par2d[-2,:],kub,klb,self.KScale)
 
         # assign the parameters from the array (no_parameters, no_cells) to
         # the spatially corrected location in par2d each soil type will have the same
         # generated parameters
-        for i in range(self.no_elem):
-            self.Par3d[self.raster_A == self.values[i]] = self.Par2d[:,i]
+        self.Par3d[self.HRUCells[0],self.HRUCells[1],:] = self.Par2d[:,self.HRUClass].T
+
+        self.MuskingumCoefficients()
 
 
     @staticmethod
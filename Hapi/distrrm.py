@@ -4,6 +4,10 @@ Created on Wed Jun 27 19:17:15 2018
 @author: Mostafa
 """
 
+import os
+import hashlib
+import inspect
+import warnings
 import numpy as np
 from Hapi.raster import Raster as raster
 from Hapi.routing import Routing as routing
@@ -19,21 +23,34 @@ class DistributedRRM():
     Methods:
         1-RunLumpedRRM
         2-SpatialRouting
-        3-DistMaxBas1
-        4-DistMaxBas2
-        5-Dist_HBV2
+        3-RoutingOrder
+        4-MuskingumCoefficients
+        5-RunChunks
+        6-LeanRun
+        7-StreamRun
+        8-ReadStream
+        9-ImpulseResponses
+        10-ImpulseRouting
+        11-ForcingHash
+        12-DistMaxBas1
+        13-DistMaxBas2
+        14-Dist_HBV2
     """
     def __init__(self):
         pass
 
     @staticmethod
-    def RunLumpedRRM(Model):
+    def RunLumpedRRM(Model, ChunkSize=1000):
         """
         ========================================================================
           RunLumpedRRM(Raster,sp_prec,sp_et,sp_temp,sp_pars,p2,init_st,ll_temp,q_init)
         ========================================================================
         RunLumpedRRM method runs the rainfall runoff lumped model (HBV, GR4,...) separately
-        for each cell and return a time series of arrays
+        for each cell and return a time series of arrays, if the lumped model
+        module has a SimulateBatch function all the cells in the domain are
+        advanced together as one (n_cells, n_steps) block in windows of
+        ChunkSize time steps (only one window of the forcing store is read at
+        a time), to run without the (rows, cols, T) arrays use LeanRun
 
         Inputs:
         ----------
@@ -67,6 +84,8 @@ class DistributedRRM():
                 [numpy array] 3d array of the long term average temperature data
             10-q_init:
                 [float] initial discharge m3/s
+            11-ChunkSize:
+                [integer] number of time steps in each window. default=1000
         Outputs:
         ----------
             1-statevariables : [numpy ndarray]
@@ -76,6 +95,10 @@ class DistributedRRM():
             3-quz : [numpy ndarray]
                 3D array of the upper zone discharge
         """
+        # quz & qlz of the cached run are going to be replaced
+        if hasattr(Model, "Cache"):
+            Model.Cache.clear()
+
         Model.statevariables = np.zeros([Model.rows,Model.cols,Model.TS,5], dtype=np.float32)
         # Model.statevariables[:] = np.nan
         Model.quz = np.zeros([Model.rows,Model.cols, Model.TS], dtype=np.float32)
@@ -83,34 +106,91 @@ class DistributedRRM():
         Model.qlz = np.zeros([Model.rows,Model.cols, Model.TS], dtype=np.float32)
         # Model.qlz[:] = np.nan
 
-        for x in range(Model.rows):
-            for y in range(Model.cols):
-                # only for cells in the domain
-                if Model.FlowAccArr [x, y] != Model.NoDataValue:
-                        Model.quz[x,y,:], Model.qlz[x,y,:], Model.statevariables[x,y,:,:] = Model.LumpedModel.Simulate(prec = Model.Prec[x, y,:],
-                                                                     temp = Model.Temp[x, y,:],
-                                                                     et = Model.ET[x, y,:],
-                                                                     ll_temp = Model.ll_temp[x, y,:],
-                                                                     par = Model.Parameters[x, y, :],
-                                                                     init_st = Model.InitialCond,
-                                                                     q_init = Model.q_init,
-                                                                     snow=Model.Snow)
+        # cells in the domain
+        rows, cols = np.where(Model.FlowAccArr != Model.NoDataValue)
+        if hasattr(Model, "PrecStore"):
+            # read the forcing directly from the memory-mapped store (n_cells, n_steps),
+            # only one window is read from the disk at a time (float32)
+            assert np.array_equal(Model.StoreCells[:,0], rows) and np.array_equal(Model.StoreCells[:,1], cols), "the forcing store was created with a different flow accumulation raster"
+            forcing = [Model.PrecStore, Model.TempStore, Model.ETStore, Model.llTempStore]
+            window = lambda x, t1, t2: np.ascontiguousarray(x[:, t1:t2])
+            cell = lambda i: i
+        else:
+            forcing = [Model.Prec, Model.Temp, Model.ET, Model.ll_temp]
+            window = lambda x, t1, t2: x[rows, cols, t1:t2]
+            cell = lambda i: (rows[i], cols[i])
+
+        if hasattr(Model.LumpedModel, "SimulateBatch"):
+            # run all the cells in the domain together as one (n_cells, n_steps)
+            # block in windows of ChunkSize time steps, the results are
+            # written directly into the cubes
+            no_steps = forcing[0].shape[-1]
+            par = Model.Parameters[rows, cols, :]
+            start = 0
+            while start < Model.TS:
+                # the same blocks as RunChunks
+                if start == 0:
+                    t1, t2 = 0, min(ChunkSize, no_steps)
+                    states, q_init = Model.InitialCond, Model.q_init
+                else:
+                    # one time step overlap, the window starts from the states
+                    # of the last kept step of the previous window, the
+                    # discharge of this step is already calculated and is kept
+                    t1, t2 = start - 1, min(start + ChunkSize, no_steps)
+                    states, q_init = Model.statevariables[rows, cols, t1, :], None
+                    q = Model.quz[rows, cols, t1], Model.qlz[rows, cols, t1]
+
+                Model.LumpedModel.SimulateBatch(prec = window(forcing[0], t1, t2),
+                                                temp = window(forcing[1], t1, t2),
+                                                et = window(forcing[2], t1, t2),
+                                                ll_temp = window(forcing[3], t1, t2),
+                                                par = par,
+                                                init_st = states,
+                                                q_init = q_init,
+                                                snow=Model.Snow,
+                                                out = (Model.quz[:,:,t1:t2+1], Model.qlz[:,:,t1:t2+1],
+                                                       Model.statevariables[:,:,t1:t2+1,:]),
+                                                cells = (rows, cols))
+                if start > 0:
+                    Model.quz[rows, cols, t1], Model.qlz[rows, cols, t1] = q
+                start = start + min(ChunkSize, Model.TS - start)
+        else:
+            # if Simulate takes an out argument the results of each cell are
+            # written directly into the cubes
+            out = "out" in inspect.signature(Model.LumpedModel.Simulate).parameters
+            for i in range(len(rows)):
+                x, y = rows[i], cols[i]
+                inputs = dict(prec = forcing[0][cell(i)],
+                              temp = forcing[1][cell(i)],
+                              et = forcing[2][cell(i)],
+                              ll_temp = forcing[3][cell(i)],
+                              par = Model.Parameters[x, y, :],
+                              init_st = Model.InitialCond,
+                              q_init = Model.q_init,
+                              snow=Model.Snow)
+                if out:
+                    Model.LumpedModel.Simulate(out = (Model.quz[x,y,:], Model.qlz[x,y,:],
+                                                      Model.statevariables[x,y,:,:]),
+                                               **inputs)
+                else:
+                    Model.quz[x,y,:], Model.qlz[x,y,:], Model.statevariables[x,y,:,:] = Model.LumpedModel.Simulate(**inputs)
 
         area_coef = Model.CatArea/Model.px_tot_area
-        # convert quz from mm/time step to m3/sec
-        Model.quz = Model.quz * Model.px_area * area_coef / (Model.Timef*3.6)
-        # convert Qlz to m3/sec
-        Model.qlz = Model.qlz * Model.px_area * area_coef / (Model.Timef*3.6)
+        # convert quz & qlz from mm/time step to m3/sec (in place)
+        Model.quz *= Model.px_area * area_coef / (Model.Timef*3.6)
+        Model.qlz *= Model.px_area * area_coef / (Model.Timef*3.6)
 
 
     @staticmethod
-    def SpatialRouting(Model):
+    def SpatialRouting(Model, Changed=None):
         """
         ====================================================================
           SpatialRouting(qlz,quz,flow_acc,flow_direct,sp_pars,p2)
         ====================================================================
         SpatialRouting method routes the discharge from cell to another following
-        the flow direction input raster
+        the flow direction input raster, if Changed is given (2D boolean array
+        of the cells whose k & x has changed since the last run with the same
+        quz & qlz) only these cells' downstream paths are routed again
 
         Inputs:
         ----------
@@ -128,6 +208,10 @@ class DistributedRRM():
                 [List] list of unoptimized parameters
                 p2[0] = tfac, 1 for hourly, 0.25 for 15 min time step and 24 for daily time step
                 p2[1] = catchment area in km2
+            7-Changed:
+                [numpy ndarray] 2D boolean array (rows, cols) of the cells whose
+                routing parameters have changed, quz_routed & qlz_translated of
+                the previous run are updated. default is None (route all cells)
 
         Outputs:
         ----------
@@ -147,47 +231,63 @@ class DistributedRRM():
     #    #new
     #    quz[lakecell[0],lakecell[1],:]=quz[lakecell[0],lakecell[1],:]+q_lake
 
-        ### cells at the divider
-        Model.quz_routed = np.zeros_like(Model.quz)
-        """
-        lower zone discharge is going to be just translated without any attenuation
-        in order to be able to calculate total discharge (uz+lz) at internal points
-        in the catchment
-        """
-        Model.qlz_translated = np.zeros_like(Model.quz)#*np.nan
-        Model.Qtot = np.zeros_like(Model.quz)
-        # for all cell with 0 flow acc put the quz
-        for x in range(Model.rows): # no of rows
-            for y in range(Model.cols): # no of columns
-                if Model.FlowAccArr [x, y] != Model.NoDataValue and Model.FlowAccArr [x, y]==0:
-                    Model.quz_routed[x,y,:]= Model.quz[x,y,:]
-                    Model.qlz_translated[x,y,:]= Model.qlz[x,y,:]
+        if Changed is None:
+            ### cells at the divider
+            Model.quz_routed = np.zeros_like(Model.quz)
+            """
+            lower zone discharge is going to be just translated without any attenuation
+            in order to be able to calculate total discharge (uz+lz) at internal points
+            in the catchment
+            """
+            Model.qlz_translated = np.zeros_like(Model.quz)#*np.nan
+            Model.Qtot = np.zeros_like(Model.quz)
+            # for all cell with 0 flow acc put the quz
+            divider = np.logical_and(Model.FlowAccArr != Model.NoDataValue, Model.FlowAccArr == 0)
+            Model.quz_routed[divider,:] = Model.quz[divider,:]
+            Model.qlz_translated[divider,:] = Model.qlz[divider,:]
+        else:
+            # cells whose outflow to the downstream cell has changed (their
+            # own k & x or their routed discharge)
+            Changed = np.array(Changed, dtype=bool)
 
         ### remaining cells
-        for j in range(1,len(Model.acc_val)):
-            #TODO parallelize
-            # all cells with the same acc_val can run at the same time
-            for x in range(Model.rows): # no of rows
-                for y in range(Model.cols): # no of columns
-                        # check from total flow accumulation
-                        if Model.FlowAccArr[x, y] != Model.NoDataValue and Model.FlowAccArr[x, y] == Model.acc_val[j]:
-                            # for UZ
-                            q_uzi = np.zeros(Model.TS)
-                            # for lz
-                            qlzi = np.zeros(Model.TS)
-                            # iterate to route uz and translate lz
-                            for i in range(len(Model.FDT[str(x)+","+str(y)])): #  Model.acc_val[j]
-                                # bring the indexes of the us cell
-                                x_ind = Model.FDT[str(x)+","+str(y)][i][0]
-                                y_ind = Model.FDT[str(x)+","+str(y)][i][1]
-                                # sum the Q of the US cells (already routed for its cell)
-                                # route first with there own k & xthen sum
-                                q_uzi = q_uzi + routing.Muskingum_V(Model.quz_routed[x_ind,y_ind,:],Model.quz_routed[x_ind,y_ind,0],Model.Parameters[x_ind,y_ind,10],Model.Parameters[x_ind,y_ind,11],Model.Timef)
-                                qlzi = qlzi + Model.qlz_translated[x_ind,y_ind,:]
+        if not hasattr(Model, "RoutingLevels"):
+            DistributedRRM.RoutingOrder(Model)
+
+        # all cells with the same acc_val are routed at the same time
+        for rows, cols, up_rows, up_cols, owner in Model.RoutingLevels:
+            if Changed is not None:
+                # only the cells with a changed upstream cell are routed again
+                affected = np.bincount(owner, weights=Changed[up_rows, up_cols],
+                                       minlength=len(rows)) > 0
+                if not affected.any():
+                    continue
+                Changed[rows[affected], cols[affected]] = True
+                upstream = affected[owner]
+                rows, cols = rows[affected], cols[affected]
+                up_rows, up_cols = up_rows[upstream], up_cols[upstream]
+                owner = (np.cumsum(affected) - 1)[owner[upstream]]
 
-                            # add the routed upstream flows to the current Quz in the cell
-                            Model.quz_routed[x,y,:] = Model.quz[x,y,:] + q_uzi
-                            Model.qlz_translated[x,y,:] = Model.qlz[x,y,:] + qlzi
+            # for UZ
+            q_uzi = np.zeros((len(rows), Model.TS))
+            # for lz
+            qlzi = np.zeros((len(rows), Model.TS))
+
+            if len(up_rows) > 0:
+                # route the Q of the US cells (already routed for its cell) with
+                # their own k & x then sum them for each DS cell
+                routed = routing.MuskingumBatch(Model.quz_routed[up_rows, up_cols, :],
+                                                Model.quz_routed[up_rows, up_cols, 0],
+                                                coefficients=DistributedRRM.MuskingumCoefficients(Model, up_rows, up_cols))
+                np.add.at(q_uzi, owner, routed)
+                if Changed is None:
+                    np.add.at(qlzi, owner, Model.qlz_translated[up_rows, up_cols, :])
+
+            # add the routed upstream flows to the current Quz in the cell
+            Model.quz_routed[rows, cols, :] = Model.quz[rows, cols, :] + q_uzi
+            # the lower zone discharge does not depend on k & x
+            if Changed is None:
+                Model.qlz_translated[rows, cols, :] = Model.qlz[rows, cols, :] + qlzi
 
 
         outletx = Model.Outlet[0][0]
@@ -196,6 +296,683 @@ class DistributedRRM():
         Model.qout = Model.qlz_translated[outletx,outlety,:] + Model.quz_routed[outletx,outlety,:]
         Model.Qtot = Model.qlz_translated + Model.quz_routed
 
+    @staticmethod
+    def RoutingOrder(Model):
+        """
+        =========================================================
+              RoutingOrder(Model)
+        =========================================================
+        RoutingOrder method sorts the cells in the domain into levels of equal
+        flow accumulation value (a topological order of the river network),
+        all cells in the same level are independent from each other and can
+        be routed at the same time
+
+        Parameters
+        ----------
+        Model : [Catchment object]
+            catchment object with the flow accumulation (ReadFlowAcc) and
+            the flow direction table arrays (ReadFlowDir).
+
+        Returns
+        -------
+        RoutingLevels : [list]
+            list of tuples (rows, cols, up_rows, up_cols, owner) one for each
+            flow accumulation value in acc_val[1:], rows & cols are the
+            indices of the cells in the level, up_rows & up_cols are the
+            indices of all the upstream cells of the level and owner is the
+            order (in rows/cols) of the cell each upstream cell drains into.
+        """
+        rows, cols = np.where(Model.FlowAccArr != Model.NoDataValue)
+        acc = Model.FlowAccArr[rows, cols]
+        # sort the cells once by the flow accumulation value
+        order = np.argsort(acc, kind='stable')
+        rows, cols, acc = rows[order], cols[order], acc[order]
+
+        # index of each cell in the flow direction table
+        index = Model.CellIndex[rows, cols]
+        counts = np.where(index >= 0,
+                          Model.UpstreamOffsets[index + 1] - Model.UpstreamOffsets[index], 0)
+
+        Model.RoutingLevels = []
+        for val in Model.acc_val[1:]:
+            first = np.searchsorted(acc, val, side='left')
+            last = np.searchsorted(acc, val, side='right')
+            # expand the upstream ranges of all the cells in the level
+            owner = np.repeat(np.arange(last - first), counts[first:last])
+            start = np.cumsum(counts[first:last]) - counts[first:last]
+            pos = (Model.UpstreamOffsets[index[first:last]][owner]
+                   + np.arange(len(owner)) - start[owner])
+            upstream = Model.UpstreamCells[pos]
+
+            Model.RoutingLevels.append((rows[first:last], cols[first:last],
+                                        Model.Cells[upstream, 0].astype(np.int64),
+                                        Model.Cells[upstream, 1].astype(np.int64),
+                                        owner.astype(np.int64)))
+
+
+    @staticmethod
+    def MuskingumCoefficients(Model, rows, cols):
+        """
+        ==========================================================
+            MuskingumCoefficients(Model, rows, cols)
+        ==========================================================
+        MuskingumCoefficients returns the muskingum coefficients [c1, c2, c3]
+        of the given cells, the coefficients calculated by the DistParameters
+        object with the parameters (Model.MuskingumCoef) are used if they exist
+        and the k & x of the cells did not change since they were calculated
+        (Model.MuskingumPar), otherwise they are calculated from the k & x
+        parameters (Model.RoutingParameters)
+
+        Parameters
+        ----------
+        Model : [Catchment object]
+            catchment object with the parameters.
+        rows : [array]
+            rows of the cells.
+        cols : [array]
+            columns of the cells.
+
+        Returns
+        -------
+        coefficients : [numpy array]
+            2D array (n_cells, 3) of c1, c2 & c3.
+        """
+        k, x = Model.RoutingParameters
+        if hasattr(Model, "MuskingumCoef"):
+            # the parameters could have been changed after the coefficients
+            # were calculated (e.g. by the optimizer or by the user)
+            pars = Model.Parameters[rows, cols][:, Model.RoutingParameters]
+            if np.array_equal(pars, Model.MuskingumPar[rows, cols], equal_nan=True):
+                return Model.MuskingumCoef[rows, cols, :]
+
+        return routing.MuskingumCoefficients(Model.Parameters[rows, cols, k],
+                                             Model.Parameters[rows, cols, x],
+                                             Model.Timef)
+
+    @staticmethod
+    def RunChunks(Model, ChunkSize=1000, Checkpoint=None):
+        """
+        =========================================================
+              RunChunks(Model, ChunkSize=1000, Checkpoint=None)
+        =========================================================
+        RunChunks method runs the lumped model and the spatial routing (the
+        same as RunLumpedRRM & SpatialRouting) in blocks of ChunkSize time
+        steps, the states of the cells and the memory of the muskingum routing
+        (last inflow & outflow of each cell) are carried from a block to the
+        next, so the (rows, cols, T) arrays are never created, the lumped
+        model module has to have a SimulateBatch function
+
+        RunChunks is a generator, it yields the results of each block and
+        after each block Model.ChunkState contains everything needed to
+        continue the run from the next block (checkpoint)
+
+        Parameters
+        ----------
+        Model : [Catchment object]
+            catchment object with the inputs of RunLumpedRRM & SpatialRouting.
+        ChunkSize : [integer], optional
+            number of time steps in each block. The default is 1000.
+        Checkpoint : [dict], optional
+            Model.ChunkState of a previous run to continue from. The default
+            is None (start from the initial conditions).
+
+        Yields
+        ------
+        start : [integer]
+            index of the first time step of the block.
+        quz_routed : [numpy array]
+            2D array (n_cells, block length) of the routed upper zone discharge
+            of the cells in the domain (cells in row order).
+        qlz_translated : [numpy array]
+            2D array (n_cells, block length) of the translated lower zone discharge.
+        """
+        assert hasattr(Model.LumpedModel, "SimulateBatch"), "the lumped model module should have a SimulateBatch function to run the model in blocks"
+        assert ChunkSize >= 1, "ChunkSize should be at least 1 time step"
+
+        # the full arrays of the previous run are not valid anymore
+        for key in ["statevariables", "quz", "qlz", "quz_routed", "qlz_translated", "Qtot"]:
+            if hasattr(Model, key):
+                delattr(Model, key)
+        if hasattr(Model, "Cache"):
+            Model.Cache.clear()
+
+        # cells in the domain
+        rows, cols = np.where(Model.FlowAccArr != Model.NoDataValue)
+        if hasattr(Model, "PrecStore"):
+            assert np.array_equal(Model.StoreCells[:,0], rows) and np.array_equal(Model.StoreCells[:,1], cols), "the forcing store was created with a different flow accumulation raster"
+            forcing = [Model.PrecStore, Model.TempStore, Model.ETStore, Model.llTempStore]
+            domain = lambda t1, t2: (slice(None), slice(t1, t2))
+        else:
+            forcing = [Model.Prec, Model.Temp, Model.ET, Model.ll_temp]
+            domain = lambda t1, t2: (rows, cols, slice(t1, t2))
+        no_steps = forcing[0].shape[-1]
+        par = Model.Parameters[rows, cols, :]
+
+        # index of each cell in the (n_cells, T) blocks
+        index = np.ones((Model.rows, Model.cols), dtype=np.int64)*-1
+        index[rows, cols] = np.arange(len(rows))
+        divider = np.where(Model.FlowAccArr[rows, cols] == 0)[0]
+
+        if not hasattr(Model, "RoutingLevels"):
+            DistributedRRM.RoutingOrder(Model)
+        levels = []
+        for lrows, lcols, up_rows, up_cols, owner in Model.RoutingLevels:
+            levels.append([index[lrows, lcols], index[up_rows, up_cols], owner,
+                           DistributedRRM.MuskingumCoefficients(Model, up_rows, up_cols)])
+        # position of the upstream cells of each level in the routing memory
+        offsets = np.cumsum([0] + [len(level[1]) for level in levels])
+
+        if Checkpoint is None:
+            start = 0
+            states = Model.InitialCond
+            Iprevious = Oprevious = None
+        else:
+            assert len(Checkpoint["States"]) == len(rows), "the checkpoint was created for a different catchment"
+            assert len(Checkpoint["Iprevious"]) == offsets[-1], "the checkpoint was created for a different river network"
+            start = int(Checkpoint["Start"])
+            states = np.asarray(Checkpoint["States"])
+            Iprevious = np.asarray(Checkpoint["Iprevious"])
+            Oprevious = np.asarray(Checkpoint["Oprevious"])
+
+        area_coef = Model.CatArea/Model.px_tot_area
+        while start < Model.TS:
+            if start == 0:
+                # the first block starts with the initial conditions
+                t1, t2, first = 0, min(ChunkSize, no_steps), 0
+                q_init = Model.q_init
+            else:
+                # one time step overlap, the output at the first step of the
+                # block is calculated from the initial states (not used)
+                t1, t2, first = start - 1, min(start + ChunkSize, no_steps), 1
+                q_init = None
+            kept = min(ChunkSize, Model.TS - start)
+
+            quz, qlz, st = Model.LumpedModel.SimulateBatch(prec = forcing[0][domain(t1, t2)],
+                                                           temp = forcing[1][domain(t1, t2)],
+                                                           et = forcing[2][domain(t1, t2)],
+                                                           ll_temp = forcing[3][domain(t1, t2)],
+                                                           par = par,
+                                                           init_st = states,
+                                                           q_init = q_init,
+                                                           snow=Model.Snow)
+            states = st[:, first + kept - 1, :]
+            # convert quz & qlz from mm/time step to m3/sec
+            quz = quz[:, first:first + kept] * (Model.px_area * area_coef / (Model.Timef*3.6))
+            qlz = qlz[:, first:first + kept] * (Model.px_area * area_coef / (Model.Timef*3.6))
+
+            ### routing of the block
+            quz_routed = np.zeros_like(quz)
+            qlz_translated = np.zeros_like(quz)
+            quz_routed[divider,:] = quz[divider,:]
+            qlz_translated[divider,:] = qlz[divider,:]
+
+            Inext = np.zeros(offsets[-1], dtype=quz.dtype)
+            Onext = np.zeros(offsets[-1], dtype=quz.dtype)
+            for i, (cells, up, owner, coef) in enumerate(levels):
+                q_uzi = np.zeros((len(cells), kept))
+                qlzi = np.zeros((len(cells), kept))
+
+                if len(up) > 0:
+                    if start == 0:
+                        routed = routing.MuskingumBatch(quz_routed[up,:], quz_routed[up,0],
+                                                        coefficients=coef)
+                    else:
+                        # continue the muskingum recursion from the last step
+                        # of the previous block
+                        inflow = np.column_stack([Iprevious[offsets[i]:offsets[i+1]], quz_routed[up,:]])
+                        routed = routing.MuskingumBatch(inflow, Oprevious[offsets[i]:offsets[i+1]],
+                                                        coefficients=coef)[:,1:]
+                    Inext[offsets[i]:offsets[i+1]] = quz_routed[up,-1]
+                    Onext[offsets[i]:offsets[i+1]] = routed[:,-1]
+                    np.add.at(q_uzi, owner, routed)
+                    np.add.at(qlzi, owner, qlz_translated[up,:])
+
+                quz_routed[cells,:] = quz[cells,:] + q_uzi
+                qlz_translated[cells,:] = qlz[cells,:] + qlzi
+
+            Iprevious, Oprevious = Inext, Onext
+            Model.ChunkState = {"Start": start + kept, "States": states,
+                                "Iprevious": Iprevious, "Oprevious": Oprevious}
+
+            yield start, quz_routed, qlz_translated
+            start = start + kept
+
+
+    @staticmethod
+    def LeanRun(Model, ChunkSize=1000):
+        """
+        =========================================================
+              LeanRun(Model, ChunkSize=1000)
+        =========================================================
+        LeanRun method runs the model in blocks of ChunkSize time steps
+        (RunChunks) and keeps only the states of the cells at the end of the
+        last block and the hydrographs at the outlet and at the gauges
+        (GaugesTable)
+
+        Parameters
+        ----------
+        Model : [Catchment object]
+            catchment object with the inputs of RunLumpedRRM & SpatialRouting.
+        ChunkSize : [integer], optional
+            number of time steps in each block. The default is 1000.
+
+        Returns
+        -------
+        qout : [numpy array]
+            1D timeseries of discharge at the outlet of the catchment (m3/sec).
+        GaugesQuz : [numpy array]
+            2D array (no_gauges, TS) of the routed upper zone discharge at the
+            gauges in the order of the GaugesTable.
+        GaugesQlz : [numpy array]
+            2D array (no_gauges, TS) of the translated lower zone discharge.
+        GaugesQtot : [numpy array]
+            2D array (no_gauges, TS) of the total discharge at the gauges.
+        FinalStates : [numpy array]
+            3D array (rows, cols, 5) of the states of each cell at the last
+            time step (statevariables[:,:,-1,:] of RunLumpedRRM).
+        """
+        rows, cols = np.where(Model.FlowAccArr != Model.NoDataValue)
+        index = np.ones((Model.rows, Model.cols), dtype=np.int64)*-1
+        index[rows, cols] = np.arange(len(rows))
+
+        # the outlet and the gauges
+        outlet = index[Model.Outlet[0][0], Model.Outlet[1][0]]
+        if hasattr(Model, "GaugesTable"):
+            gauges = index[Model.GaugesTable["cell_row"].values.astype(int),
+                           Model.GaugesTable["cell_col"].values.astype(int)]
+        else:
+            gauges = np.array([], dtype=np.int64)
+        Model.GaugesQuz = np.zeros((len(gauges), Model.TS), dtype=np.float32)
+        Model.GaugesQlz = np.zeros((len(gauges), Model.TS), dtype=np.float32)
+        Model.qout = np.zeros(Model.TS, dtype=np.float32)
+
+        for start, quz_routed, qlz_translated in DistributedRRM.RunChunks(Model, ChunkSize):
+            end = start + quz_routed.shape[1]
+            Model.qout[start:end] = qlz_translated[outlet,:] + quz_routed[outlet,:]
+            Model.GaugesQuz[:, start:end] = quz_routed[gauges,:]
+            Model.GaugesQlz[:, start:end] = qlz_translated[gauges,:]
+
+        Model.GaugesQtot = Model.GaugesQlz + Model.GaugesQuz
+        Model.FinalStates = np.zeros((Model.rows, Model.cols, 5), dtype=np.float32)
+        Model.FinalStates[rows, cols, :] = Model.ChunkState["States"]
+
+
+    @staticmethod
+    def StreamRun(Model, Path, ChunkSize=1000, Resume=False):
+        """
+        =========================================================
+              StreamRun(Model, Path, ChunkSize=1000, Resume=False)
+        =========================================================
+        StreamRun method runs the model in blocks of ChunkSize time steps
+        (RunChunks) and writes the results of each block to the disk as soon
+        as it is calculated, after each block a checkpoint (states of the
+        cells & memory of the routing) is saved so the run can be continued
+        later from the last block (Resume=True), e.g. after a failure or to
+        continue an operational run after adding new forcing data
+
+        Parameters
+        ----------
+        Model : [Catchment object]
+            catchment object with the inputs of RunLumpedRRM & SpatialRouting.
+        Path : [str]
+            folder where the results are saved, the folder contains
+            Cells.npy (row & column of each cell), chunk_<start>.npz for each
+            block (start, quz_routed, qlz_translated) and checkpoint.npz.
+        ChunkSize : [integer], optional
+            number of time steps in each block. The default is 1000.
+        Resume : [bool], optional
+            True to continue from the checkpoint in Path, the parameters,
+            initial conditions, Timef & areas have to be the same, the
+            forcing can be longer than the forcing of the checkpoint but the
+            part that was already simulated has to be the same. The default
+            is False.
+
+        Returns
+        -------
+        None.
+
+        Example
+        -------
+            DistributedRRM.StreamRun(Coello, "results/", ChunkSize=8760)
+            # continue later
+            DistributedRRM.StreamRun(Coello, "results/", ChunkSize=8760, Resume=True)
+            Cells, quz_routed, qlz_translated = DistributedRRM.ReadStream("results/")
+        """
+        if not os.path.exists(Path):
+            os.makedirs(Path)
+
+        rows, cols = np.where(Model.FlowAccArr != Model.NoDataValue)
+        routingkey = hashlib.sha1(np.ascontiguousarray(Model.Parameters[rows, cols][:,Model.RoutingParameters]).tobytes()).hexdigest()
+        # the forcing is checked separately (it can be extended)
+        runoffkey = Model.RunoffKey(Forcing=False)
+        CheckpointPath = os.path.join(Path, "checkpoint.npz")
+
+        Checkpoint = None
+        if Resume:
+            assert os.path.exists(CheckpointPath), CheckpointPath + " does not exist"
+            data = np.load(CheckpointPath)
+            assert str(data["RunoffKey"]) == runoffkey and str(data["RoutingKey"]) == routingkey, "the checkpoint was created with different parameters or initial conditions"
+            Checkpoint = {key: data[key] for key in ["Start", "States", "Iprevious", "Oprevious"]}
+            first = int(Checkpoint["Start"])
+            assert Model.TS >= first, "the forcing is shorter than the part that was already simulated"
+            # hash of the forcing of each block [end of the block, hash]
+            ForcingHashes = [list(block) for block in data["ForcingHashes"]]
+            begin = 0
+            for end, forcinghash in ForcingHashes:
+                assert DistributedRRM.ForcingHash(Model, begin, int(end)) == forcinghash, "the forcing of the part that was already simulated has changed"
+                begin = int(end)
+        else:
+            np.save(os.path.join(Path, "Cells.npy"), np.column_stack([rows, cols]).astype(np.int32))
+            first = 0
+            ForcingHashes = []
+
+        # remove the blocks of previous runs that are going to be calculated again
+        for f in os.listdir(Path):
+            if f.startswith("chunk_") and f.endswith(".npz") and int(f[6:-4]) >= first:
+                os.remove(os.path.join(Path, f))
+
+        for start, quz_routed, qlz_translated in DistributedRRM.RunChunks(Model, ChunkSize, Checkpoint):
+            np.savez(os.path.join(Path, "chunk_{0:010d}.npz".format(start)), start=start,
+                     quz_routed=quz_routed, qlz_translated=qlz_translated)
+            # the forcing of the time steps before the start of the next block
+            begin = int(ForcingHashes[-1][0]) if len(ForcingHashes) > 0 else 0
+            end = Model.ChunkState["Start"] - 1
+            ForcingHashes.append([end, DistributedRRM.ForcingHash(Model, begin, end)])
+            # write the checkpoint to a temporary file first so a failure
+            # while writing does not corrupt the last checkpoint
+            temp = os.path.join(Path, "checkpoint_temp.npz")
+            np.savez(temp, RunoffKey=runoffkey, RoutingKey=routingkey,
+                     ForcingHashes=np.array(ForcingHashes, dtype=object).astype(str),
+                     **Model.ChunkState)
+            os.replace(temp, CheckpointPath)
+
+
+    @staticmethod
+    def ReadStream(Path, Cells=None):
+        """
+        =========================================================
+              ReadStream(Path, Cells=None)
+        =========================================================
+        ReadStream method reads the results saved by StreamRun
+
+        Parameters
+        ----------
+        Path : [str]
+            folder of the results of StreamRun.
+        Cells : [list], optional
+            list of (row, col) of the cells to read. The default is None (all
+            the cells in the domain).
+
+        Returns
+        -------
+        Cells : [numpy array]
+            2D array (n_cells, 2) of the row & column of the cells.
+        quz_routed : [numpy array]
+            2D array (n_cells, TS) of the routed upper zone discharge.
+        qlz_translated : [numpy array]
+            2D array (n_cells, TS) of the translated lower zone discharge.
+        """
+        assert os.path.exists(os.path.join(Path, "Cells.npy")), Path + " does not contain the results of StreamRun"
+        AllCells = np.load(os.path.join(Path, "Cells.npy"))
+        if Cells is None:
+            ind = np.arange(len(AllCells))
+        else:
+            position = {(r, c): i for i, (r, c) in enumerate(AllCells.tolist())}
+            assert all(tuple(cell) in position for cell in Cells), "some of the cells are not in the domain"
+            ind = np.array([position[tuple(cell)] for cell in Cells], dtype=np.int64)
+
+        files = sorted(f for f in os.listdir(Path) if f.startswith("chunk_") and f.endswith(".npz"))
+        quz_routed = []
+        qlz_translated = []
+        for f in files:
+            data = np.load(os.path.join(Path, f))
+            quz_routed.append(data["quz_routed"][ind,:])
+            qlz_translated.append(data["qlz_translated"][ind,:])
+
+        return AllCells[ind], np.concatenate(quz_routed, axis=1), np.concatenate(qlz_translated, axis=1)
+
+
+    @staticmethod
+    def ForcingHash(Model, Start, End):
+        """
+        =========================================================
+              ForcingHash(Model, Start, End)
+        =========================================================
+        ForcingHash method returns a hash of the forcing (rainfall,
+        temperature, evapotranspiration & long term temperature) of the cells
+        in the domain between the time steps Start & End (not included)
+
+        Parameters
+        ----------
+        Model : [Catchment object]
+            catchment object with the forcing arrays or the forcing store.
+        Start : [integer]
+            first time step.
+        End : [integer]
+            last time step (not included).
+
+        Returns
+        -------
+        key : [str]
+            sha1 hash.
+        """
+        rows, cols = np.where(Model.FlowAccArr != Model.NoDataValue)
+        if hasattr(Model, "PrecStore"):
+            forcing = [Model.PrecStore, Model.TempStore, Model.ETStore, Model.llTempStore]
+            window = lambda x: x[:, Start:End]
+        else:
+            forcing = [Model.Prec, Model.Temp, Model.ET, Model.ll_temp]
+            window = lambda x: x[rows, cols, Start:End]
+
+        key = hashlib.sha1()
+        for x in forcing:
+            # float32 as in the store so both give the same hash
+            key.update(np.ascontiguousarray(window(x), dtype=np.float32).tobytes())
+        return key.hexdigest()
+
+
+    @staticmethod
+    def ImpulseResponses(Model, Tolerance=1e-6):
+        """
+        =========================================================
+              ImpulseResponses(Model, Tolerance=1e-6)
+        =========================================================
+        ImpulseResponses method calculates the response of the routed discharge
+        at the outlet and at the gauges (GaugesTable) to a unit discharge
+        generated in each upstream cell, the Muskingum routing is linear so
+        the response of a cell is the convolution of the impulse responses
+        (Routing.MuskingumResponse) of all the cells on its flow path.
+        the responses are truncated when the response of each reach on the
+        path has decayed below the Tolerance, and are calculated again only
+        if k & x (Parameters[:,:,10:12]) have changed.
+
+        Parameters
+        ----------
+        Model : [Catchment object]
+            catchment object with the flow accumulation (ReadFlowAcc), the
+            flow direction (ReadFlowDir) and the parameters.
+        Tolerance : [numeric], optional
+            the response of each reach is truncated after it decays below
+            the Tolerance. The default is 1e-6.
+
+        Returns
+        -------
+        ImpulseResponse : [dict]
+            Key: hash of k, x, Timef, TS & Tolerance.
+            Points: list of tuples (rows, cols, Responses, Initial, Length)
+            for the outlet and then each gauge, rows & cols are the indices
+            of the cells upstream of the point (including the point),
+            Responses are the truncated responses of these cells
+            (n_cells, Length) float32, Initial is the extra response
+            (n_cells, Length) to the discharge at the first time step.
+        """
+        rows, cols = np.where(Model.FlowAccArr != Model.NoDataValue)
+        k = Model.Parameters[rows, cols, Model.RoutingParameters[0]].astype(np.float64)
+        x = Model.Parameters[rows, cols, Model.RoutingParameters[1]].astype(np.float64)
+        key = hashlib.sha1(np.column_stack([k, x]).tobytes()
+                           + str((Model.Timef, Model.TS, Tolerance)).encode()).hexdigest()
+        if hasattr(Model, "ImpulseResponse") and Model.ImpulseResponse["Key"] == key:
+            return
+
+        no_cells = len(rows)
+        index = np.ones((Model.rows, Model.cols), dtype=np.int64)*-1
+        index[rows, cols] = np.arange(no_cells)
+
+        # downstream cell of each cell in the domain (-1 for the outlet)
+        downstream = np.ones(no_cells, dtype=np.int64)*-1
+        table = Model.CellIndex[rows, cols]
+        ds = np.where(table >= 0, Model.DownstreamCell[np.maximum(table, 0)], -1)
+        downstream[ds >= 0] = index[Model.Cells[ds[ds >= 0], 0], Model.Cells[ds[ds >= 0], 1]]
+
+        # number of time steps for the response of each reach to decay
+        dt = Model.Timef
+        c3 = np.abs((2*k*(1-x)-dt)/(2*k*(1-x)+dt))
+        steps = np.ceil(np.log(Tolerance)/np.log(np.maximum(c3, 1e-300))).astype(np.int64) + 2
+
+        # levels of cells with the same flow accumulation from downstream to upstream
+        acc = Model.FlowAccArr[rows, cols]
+        order = np.argsort(-acc, kind='stable')
+        bounds = np.flatnonzero(np.diff(acc[order])) + 1
+        levels = np.split(order, bounds)
+
+        points = [index[Model.Outlet[0][0], Model.Outlet[1][0]]]
+        if hasattr(Model, "GaugesTable"):
+            points = points + list(index[Model.GaugesTable["cell_row"].values.astype(int),
+                                         Model.GaugesTable["cell_col"].values.astype(int)])
+
+        Points = []
+        for point in points:
+            # cells upstream of the point and the length of their responses
+            member = np.zeros(no_cells, dtype=bool)
+            member[point] = True
+            length = np.zeros(no_cells, dtype=np.int64)
+            for cells in levels:
+                cells = cells[downstream[cells] >= 0]
+                cells = cells[member[downstream[cells]]]
+                member[cells] = True
+                length[cells] = length[downstream[cells]] + steps[cells]
+
+            cells = np.flatnonzero(member)
+            L = int(max(min(length.max(), Model.TS), 1))
+            nfft = 1 << (2*L - 1).bit_length()
+            position = np.ones(no_cells, dtype=np.int64)*-1
+            position[cells] = np.arange(len(cells))
+
+            # response of each cell is its own response convolved with the
+            # response of its downstream cell
+            b = np.zeros((len(cells), L))
+            b0 = np.zeros((len(cells), L))
+            b[position[point], 0] = 1
+            b0[position[point], 0] = 1
+            for level in levels:
+                level = level[member[level] & (level != point)]
+                if len(level) == 0:
+                    continue
+                h, h0 = routing.MuskingumResponse(k[level], x[level], dt, L)
+                bd = b[position[downstream[level]]]
+                b0d = b0[position[downstream[level]]]
+                Bd = np.fft.rfft(bd, nfft, axis=1)
+                b[position[level]] = np.fft.irfft(Bd * np.fft.rfft(h, nfft, axis=1), nfft, axis=1)[:, :L]
+                b0[position[level]] = (np.fft.irfft(Bd * np.fft.rfft(h0, nfft, axis=1), nfft, axis=1)[:, :L]
+                                       + b0d - bd)
+
+            # only the real responses are kept, the spectra are calculated
+            # in blocks of cells by ImpulseRouting
+            Points.append((rows[cells], cols[cells], b.astype(np.float32),
+                           (b0 - b).astype(np.float32), L))
+
+        Model.ImpulseResponse = {"Key": key, "Points": Points}
+
+
+    @staticmethod
+    def ImpulseRouting(Model, Tolerance=1e-6, CellBlock=256):
+        """
+        =========================================================
+              ImpulseRouting(Model, Tolerance=1e-6, CellBlock=256)
+        =========================================================
+        ImpulseRouting method calculates the discharge at the outlet and at
+        the gauges as the sum of the upper zone discharge of the upstream
+        cells convolved (FFT overlap-add) with their impulse responses
+        (ImpulseResponses, the spectra of CellBlock cells at a time) plus
+        the sum of the lower zone discharge, it
+        replaces SpatialRouting when only the hydrographs at the outlet and
+        at the gauges are needed (e.g. calibration).
+        the responses are of the Muskingum recursion without the check on the
+        negative outflow (MuskingumBatch with nonnegative=False), the outflow
+        can go negative only if c1 < 0 (2*k*x > Timef) so if c1 of any cell is
+        negative a warning is raised and SpatialRouting is used instead.
+
+        Parameters
+        ----------
+        Model : [Catchment object]
+            catchment object with the quz & qlz of RunLumpedRRM.
+        Tolerance : [numeric], optional
+            truncation of the responses (see ImpulseResponses). The default
+            is 1e-6.
+        CellBlock : [integer], optional
+            number of cells whose spectra are in memory at a time. The
+            default is 256.
+
+        Returns
+        -------
+        qout : [numpy array]
+            1D timeseries of discharge at the outlet of the catchment (m3/sec).
+        GaugesQuz : [numpy array]
+            2D array (no_gauges, TS) of the routed upper zone discharge at the
+            gauges in the order of the GaugesTable.
+        GaugesQlz : [numpy array]
+            2D array (no_gauges, TS) of the translated lower zone discharge.
+        GaugesQtot : [numpy array]
+            2D array (no_gauges, TS) of the total discharge at the gauges.
+        """
+        rows, cols = np.where(Model.FlowAccArr != Model.NoDataValue)
+        if np.any(DistributedRRM.MuskingumCoefficients(Model, rows, cols)[:, 0] < 0):
+            warnings.warn("c1 of the muskingum coefficients is negative (2*k*x > Timef) "
+                          "in some cells, the impulse responses do not clamp the negative "
+                          "outflow so SpatialRouting is used instead")
+            for key in ["GaugesQuz", "GaugesQlz", "GaugesQtot"]:
+                if hasattr(Model, key):
+                    delattr(Model, key)
+            DistributedRRM.SpatialRouting(Model)
+            return
+
+        DistributedRRM.ImpulseResponses(Model, Tolerance)
+
+        # the distributed routed arrays are not calculated
+        for key in ["quz_routed", "qlz_translated", "Qtot"]:
+            if hasattr(Model, key):
+                delattr(Model, key)
+
+        no_steps = Model.quz.shape[2]
+        Quz = np.zeros((len(Model.ImpulseResponse["Points"]), no_steps), dtype=np.float32)
+        Qlz = np.zeros((len(Model.ImpulseResponse["Points"]), no_steps), dtype=np.float32)
+        for i, (rows, cols, responses, initial, L) in enumerate(Model.ImpulseResponse["Points"]):
+            quz = Model.quz[rows, cols, :]
+            # overlap-add of blocks so the convolution is not circular
+            nfft = 1 << (2*L - 1).bit_length()
+            block = nfft - L + 1
+            starts = range(0, no_steps, block)
+            spectrum = np.zeros((len(starts), nfft//2 + 1), dtype=np.complex128)
+            for c in range(0, len(rows), CellBlock):
+                spectra = np.fft.rfft(responses[c:c + CellBlock].astype(np.float64), nfft, axis=1)
+                for j, start in enumerate(starts):
+                    spectrum[j] += (np.fft.rfft(quz[c:c + CellBlock, start:start + block].astype(np.float64),
+                                                nfft, axis=1) * spectra).sum(axis=0)
+            q = np.zeros(no_steps + nfft)
+            for j, start in enumerate(starts):
+                q[start:start + nfft] += np.fft.irfft(spectrum[j], nfft)
+            q = q[:no_steps]
+            q[:L] += quz[:, 0] @ initial
+
+            Quz[i, :] = q
+            Qlz[i, :] = Model.qlz[rows, cols, :].sum(axis=0)
+
+        Model.qout = Quz[0, :] + Qlz[0, :]
+        Model.GaugesQuz = Quz[1:, :]
+        Model.GaugesQlz = Qlz[1:, :]
+        Model.GaugesQtot = Model.GaugesQlz + Model.GaugesQuz
+
+
     @staticmethod
     def DistMaxbas1(Model):
         """
@@ -218,10 +995,10 @@ class DistributedRRM():
 
         Maxbas = Model.Parameters[:,:,-1]
 
-        for x in range(Model.rows):
-            for y in range(Model.cols):
-                if Model.FlowAccArr [x, y] != Model.NoDataValue:
-                    Model.quz[x,y,:] = routing.TriangularRouting1(Model.quz[x,y,:], Maxbas[x,y])
+        # route all the cells in the domain in one call
+        rows, cols = np.where(Model.FlowAccArr != Model.NoDataValue)
+        Model.quz[rows,cols,:] = routing.TriangularRoutingBatch(Model.quz[rows,cols,:],
+                                                                Maxbas[rows,cols])
 
     @staticmethod
     def DistMaxbas2(Model):
@@ -255,10 +1032,11 @@ class DistributedRRM():
 
         NormalizedFPL = resize_fun(Model.FPLArr)
 
-        for x in range(Model.rows):
-            for y in range(Model.cols):
-                if not np.isnan(Model.FPLArr[x,y]):# FPLArray[x,y] != np.nan: #NoDataValue:
-                    Model.quz[x,y,:] = routing.TriangularRouting2(Model.quz[x,y,:], NormalizedFPL[x,y])
+        # route all the cells in the domain in one call
+        rows, cols = np.where(~np.isnan(Model.FPLArr))
+        Model.quz[rows,cols,:] = routing.TriangularRoutingBatch(Model.quz[rows,cols,:],
+                                                                NormalizedFPL[rows,cols],
+                                                                method=2)
 
 
 
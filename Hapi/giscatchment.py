@@ -26,11 +26,12 @@ class GISCatchment():
         1- D8
         2- FlowDirectIndex
         3- FlowDirecTable
-        4- DeleteBasins
-        5- NearestCell
-        6- GroupNeighbours
-        7- Cluster
-        8- ListAttributes
+        4- FlowDirecTableCSR
+        5- DeleteBasins
+        6- NearestCell
+        7- GroupNeighbours
+        8- Cluster
+        9- ListAttributes
     """
     def __init__(self):
         pass
@@ -366,40 +367,90 @@ class GISCatchment():
         """
         # input data validation
         # validation is inside FlowDirectِِIndex
-        FDI=GISCatchment.FlowDirectIndex(flow_direct)
-
-        rows=flow_direct.RasterYSize
-        cols=flow_direct.RasterXSize
-
-        celli=[]
-        cellj=[]
-        celli_content=[]
-        cellj_content=[]
-        for i in range(rows): # rows
-            for j in range(cols): # columns
-                if not np.isnan(FDI[i,j,0]):
-                    # store the indexes of not empty cells and the indexes stored inside these cells
-                    celli.append(i)
-                    cellj.append(j)
-                    # store the index of the receiving cells
-                    celli_content.append(FDI[i,j,0])
-                    cellj_content.append(FDI[i,j,1])
+        _, cells, _, offsets, upstream = GISCatchment.FlowDirecTableCSR(flow_direct)
 
         flow_acc_table={}
         # for each cell store the directly giving cells
-        for i in range(rows): # rows
-            for j in range(cols): # columns
-                if not np.isnan(FDI[i,j,0]):
-                    # get the indexes of the cell and use it as a key in a dictionary
-                    name=str(i)+','+str(j)
-                    flow_acc_table[name]=[]
-                    for k in range(len(celli_content)):
-                        # search if any cell are giving this cell
-                        if i==celli_content[k] and j==cellj_content[k]:
-                            flow_acc_table[name].append((celli[k],cellj[k]))
+        for i in range(len(cells)):
+            # get the indexes of the cell and use it as a key in a dictionary
+            name=str(cells[i,0])+','+str(cells[i,1])
+            flow_acc_table[name]=[(int(cells[k,0]),int(cells[k,1])) for k in upstream[offsets[i]:offsets[i+1]]]
 
         return flow_acc_table
 
+    @staticmethod
+    def FlowDirecTableCSR(flow_direct):
+        """
+        ====================================================================
+             FlowDirecTableCSR(flow_direct)
+        ====================================================================
+        this function takes flow direction indices created by FlowDirectِِIndex function
+        and create a compact (CSR) upstream adjacency table, each cell with a
+        flow direction has an index (cells are numbered row by row) and the
+        upstream cells of cell i are upstream[offsets[i]:offsets[i+1]]
+
+        Inputs:
+        ----------
+            1- flow_direct:
+                [gdal.dataset] flow direction raster obtained from catchment delineation
+                it only contains values [1,2,4,8,16,32,64,128]
+
+        Outputs:
+        ----------
+            1-cellindex:
+                [numpy array] int32 array with the same dimensions of the raster
+                contains the index of each cell and -1 for cells without flow direction
+            2-cells:
+                [numpy array] int32 array (no_cells, 2) of the row & column of each cell
+            3-downstream:
+                [numpy array] int32 array of the index of the downstream cell
+                of each cell (-1 if it drains outside the domain)
+            4-offsets:
+                [numpy array] int32 array (no_cells + 1) of the start of the
+                upstream cells of each cell in the upstream array
+            5-upstream:
+                [numpy array] int32 array of the indices of the upstream cells
+
+        Example:
+        ----------
+            fd = gdal.Open("Flowdir.tif")
+            cellindex, cells, downstream, offsets, upstream = FlowDirecTableCSR(fd)
+        """
+        # input data validation
+        # validation is inside FlowDirectِِIndex
+        FDI=GISCatchment.FlowDirectIndex(flow_direct)
+
+        rows=flow_direct.RasterYSize
+        cols=flow_direct.RasterXSize
+
+        # store the indexes of not empty cells
+        celli, cellj = np.where(~np.isnan(FDI[:,:,0]))
+        no_cells = len(celli)
+        cells = np.column_stack([celli, cellj]).astype(np.int32)
+
+        cellindex = np.ones((rows,cols), dtype=np.int32)*-1
+        cellindex[celli, cellj] = np.arange(no_cells, dtype=np.int32)
+
+        # index of the receiving cells (-1 if it is outside the raster or
+        # has no flow direction)
+        ds_i = FDI[celli, cellj, 0].astype(np.int64)
+        ds_j = FDI[celli, cellj, 1].astype(np.int64)
+        inside = (ds_i >= 0) & (ds_i < rows) & (ds_j >= 0) & (ds_j < cols)
+        downstream = np.ones(no_cells, dtype=np.int32)*-1
+        downstream[inside] = cellindex[ds_i[inside], ds_j[inside]]
+
+        # group the giving cells by the receiving cell (stable sort keeps the
+        # giving cells ordered row by row)
+        giving = np.where(downstream >= 0)[0]
+        order = np.argsort(downstream[giving], kind='stable')
+        upstream = giving[order].astype(np.int32)
+
+        counts = np.bincount(downstream[giving], minlength=no_cells)
+        offsets = np.zeros(no_cells + 1, dtype=np.int32)
+        offsets[1:] = np.cumsum(counts)
+
+        return cellindex, cells, downstream, offsets, upstream
+
     @staticmethod
     def DeleteBasins(basins,pathout):
         """
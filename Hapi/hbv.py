@@ -69,6 +69,16 @@ P_UB = [2.5, #ttm
 DEF_ST = [0.0, 10.0, 10.0, 10.0, 0.0]
 DEF_q0 = 0
 
+# model interface used by the distributed and lumped runners (see
+# Catchment.ReadLumpedModel), every HBV module defines PAR_NAMES, ST_NAMES
+# and SimulateBatch
+# parameters order with snow (1) and without snow (0)
+PAR_NAMES = {1: ["ltt", "utt", "rfcf", "sfcf", "ttm", "cfmax", "cwh", "cfr", "fc",
+                 "beta", "e_corr", "etf", "lp", "c_flux", "k", "k1", "alpha", "perc"],
+             0: ["rfcf", "fc", "beta", "etf", "lp", "c_flux", "k", "k1", "alpha", "perc"]}
+# states order
+ST_NAMES = ["sp", "sm", "uz", "lz", "wc"]
+
 # Get random parameter set
 #def get_random_pars():
 #    return np.random.uniform(P_LB, P_UB)
@@ -497,10 +507,10 @@ def StepRun(p, v, St, snow=0): #p2,
 
 
 def Simulate(prec, temp, et, par, init_st=None, ll_temp=None,#p2,
-             q_init=None, snow=0):
+             q_init=None, snow=0, out=None):
     """
     ================================================================
-        Simulate(prec, temp, et, par, p2, init_st=None, ll_temp=None, q_0=None, snow=0):
+        Simulate(prec, temp, et, par, p2, init_st=None, ll_temp=None, q_0=None, snow=0, out=None):
     ================================================================
     Run the HBV model for the number of steps (n) in precipitation. The
     resluts are (n+1) simulation of discharge as the model calculates step n+1
@@ -528,6 +538,10 @@ def Simulate(prec, temp, et, par, init_st=None, ll_temp=None,#p2,
         Long term average temptearature. If unspecified, calculated from temp.
     q_0 : float, optional
         Initial discharge value. If unspecified set to 10.0
+    out : tuple of arrays, optional
+        (q_uz [n+1], q_lz [n+1], st [n+1, 5]) arrays to write the results
+        into (e.g. the cells of the distributed model cubes), if unspecified
+        float32 arrays are created.
 
 
     Returns
@@ -544,35 +558,313 @@ def Simulate(prec, temp, et, par, init_st=None, ll_temp=None,#p2,
     # assert len(p2) == 2, "p2 should contains tfac and catchment area"
     assert snow == 0 or snow == 1, " snow input defines whether to consider snow subroutine or not it has to be 0 or 1"
 
+    no_steps = len(prec)
+    if out is None:
+        q_uz = np.zeros(no_steps+1, dtype=np.float32)
+        q_lz = np.zeros(no_steps+1, dtype=np.float32)
+        st = np.zeros((no_steps+1, 5), dtype=np.float32)
+    else:
+        q_uz, q_lz, st = out
+        assert q_uz.shape == (no_steps+1,) and q_lz.shape == (no_steps+1,), "out discharge arrays should have n+1 values"
+        assert st.shape == (no_steps+1, 5), "out state array should be of shape (n+1, 5)"
+
+    # the states are carried in float64 and written to st at each step
     if init_st is None:#   0  1  2  3  4  5
-        st = [DEF_ST, ]  #[sp,sm,uz,lz,wc,LA]
+        st_i = DEF_ST  #[sp,sm,uz,lz,wc,LA]
     else:
-        st = [init_st,]
+        st_i = init_st
+    st[0,:] = st_i
 
     if ll_temp is None:
-        ll_temp = [np.mean(temp), ] * len(prec)
+        ll_temp = [np.mean(temp), ] * no_steps
 
     if q_init == None:
         if snow == 0:
-            q_uz=[par[6]*((st[0][2])**(1.0 + par[8])), ]
-            q_lz=[par[7]*st[0][3], ]
+            q_uz[0] = par[6]*((st_i[2])**(1.0 + par[8]))
+            q_lz[0] = par[7]*st_i[3]
     else:
-        q_uz=[par[14]*((st[0][2])**(1.0 + par[16])), ]
-        q_lz=[par[15]*st[0][3], ]
+        q_uz[0] = par[14]*((st_i[2])**(1.0 + par[16]))
+        q_lz[0] = par[15]*st_i[3]
 
-#    uz_int_2 = [st[0][2], ]
-#    lz_int_1 = [st[0][3], ]
+    for i in range(no_steps):
+        v = [prec[i], temp[i], et[i], ll_temp[i]]
+        q_uz[i+1], q_lz[i+1], st_i = StepRun(par, v, st_i, snow=0)
+        st[i+1,:] = st_i
 
+    return q_uz, q_lz, st
 
-    for i in range(len(prec)):
-        v = [prec[i], temp[i], et[i], ll_temp[i]]
-#        q_out, st_out, uz_int_2_out, lz_int_1_out = StepRun(par, p2, v, st[i], snow=0)
-        q_uzi, q_lzi, st_out = StepRun(par, v, st[i], snow=0)# p2,
-#        q_sim.append(q_out)
-        q_uz.append(q_uzi)
-        q_lz.append(q_lzi)
-        st.append(st_out)
-#        uz_int_2.append(uz_int_2_out) # upper zone - perc
-#        lz_int_1.append(lz_int_1_out) # lower zone + perc
-
-    return np.float32(q_uz), np.float32(q_lz), np.float32(st)
\ No newline at end of file
+def StepRunBatch(p, v, St, snow=0):
+    """
+    ============================================================
+        StepRunBatch(p, v, St, snow=0)
+    ============================================================
+    Vectorized version of StepRun, advances the states of many cells (or
+    parameter sets) by one time step at once.
+
+    Parameters
+    ----------
+    p : array_like [n_cells, 10+]
+        Parameter array, one row per cell, set up as PAR_NAMES[snow]:
+        [rfcf, fc, beta, etf, lp, c_flux, k, k1, alpha, perc, ...]
+    v : array_like [4, n_cells]
+        Input array setup as:
+        [prec, temp, evap, llt]
+    St : array_like [n_cells, 5]
+        Previous model states setup as:
+        [sp, sm, uz, lz, wc]
+    snow : integer, optional
+        0 or 1. The default is 0.
+
+    Returns
+    -------
+    q_uz : array_like [n_cells]
+        upper zone discharge [mm/timestep]
+    q_lz : array_like [n_cells]
+        lower zone discharge [mm/timestep]
+    St : array_like [n_cells, 5]
+        Posterior model states
+    """
+    ## Parse of parameters (same fixed values as StepRun)
+    if snow == 1:
+        ltt = p[:,0]
+        utt = p[:,1]
+        rfcf = p[:,2]
+        sfcf = p[:,3]
+        ttm = p[:,4]
+        cfmax = p[:,5]
+        cwh = p[:,6]
+        cfr = p[:,7]
+        fc = p[:,8]
+        beta = p[:,9]
+        e_corr = p[:,10]
+        etf = p[:,11]
+        lp = p[:,12]
+        c_flux = p[:,13]
+        k = p[:,14]
+        k1 = p[:,15]
+        alpha = p[:,16]
+        perc = p[:,17]
+    else:
+        ltt = 1.0
+        utt = 2.0
+        rfcf = p[:,0]
+        sfcf = 0.00001
+        ttm = 1
+        cfmax = 0.00001
+        cwh = 0.00001
+        cfr = 0.000001
+        fc = p[:,1]
+        beta = p[:,2]
+        e_corr = 1
+        etf = p[:,3]
+        lp = p[:,4]
+        c_flux = p[:,5]
+        k = p[:,6]
+        k1 = p[:,7]
+        alpha = p[:,8]
+        perc = p[:,9]
+
+    ## Parse of Inputs
+    prec = v[0]
+    temp = v[1]
+    ep = v[2]
+    tm = v[3]
+
+    ## Parse of states
+    sp_old = St[:,0]
+    sm_old = St[:,1]
+    uz_old = St[:,2]
+    lz_old = St[:,3]
+    wc_old = St[:,4]
+
+    ### Precipitation
+    frac = np.clip((temp - ltt)/(utt - ltt), 0.0, 1.0)
+    rf = frac * prec * rfcf
+    sf = (1.0 - frac) * prec * sfcf
+
+    ### Snow
+    melting = temp > ttm
+    melt = np.minimum(cfmax*(temp - ttm), sp_old + sf)
+    refr = np.minimum(cfr*cfmax*(ttm - temp), wc_old + rf)
+    sp_new = np.where(melting, sp_old + sf - melt, sp_old + sf + refr)
+    wc_int = np.where(melting, wc_old + melt + rf, wc_old - refr + rf)
+
+    excess = wc_int > cwh*sp_new
+    inf = np.where(excess, wc_int - cwh*sp_new, 0.0)
+    wc_new = np.where(excess, cwh*sp_new, wc_int)
+
+    ### Soil
+    qdr = np.maximum(sm_old + inf - fc, 0)
+    inf = inf - qdr
+    r = ((sm_old/fc)** beta) * inf
+    ep_int = (1.0 + etf*(temp - tm))*e_corr*ep
+    ea = np.minimum(ep_int, (sm_old/(lp*fc))*ep_int)
+    cf = c_flux*((fc - sm_old)/fc)
+
+    dry = uz_old + r < cf
+    cf = np.where(dry, uz_old + r, cf)
+    uz_int_1 = np.where(dry, 0.0, uz_old + r - cf + qdr)
+    sm_new = np.maximum(sm_old + inf - r + cf - ea, 0)
+
+    ### Response
+    uz_int_2 = np.maximum(uz_int_1 - perc, 0.0)
+    q_uz = np.minimum(k*(uz_int_2**(1.0 + alpha)), uz_int_2)
+    uz_new = uz_int_2 - q_uz
+
+    lz_int_1 = lz_old + np.minimum(perc, uz_int_1)
+    q_lz = np.minimum(k1*lz_int_1, lz_int_1)
+    lz_new = lz_int_1 - q_lz
+
+    St = np.stack([sp_new, sm_new, uz_new, lz_new, wc_new], axis=1)
+
+    return q_uz, q_lz, St
+
+
+def BatchOutputs(no_cells, no_steps, states=True, out=None, cells=None,
+                 dtype=np.float32):
+    """
+    ================================================================
+        BatchOutputs(no_cells, no_steps, states=True, out=None, cells=None, dtype=np.float32)
+    ================================================================
+    BatchOutputs returns the arrays SimulateBatch writes the results into
+    and the index of the cells in them.
+
+    Parameters
+    ----------
+    no_cells : integer
+        number of cells.
+    no_steps : integer
+        number of time steps of the inputs (n).
+    states : bool, optional
+        False if the states are not kept. The default is True.
+    out : tuple of arrays, optional
+        (q_uz, q_lz, st) of SimulateBatch. If unspecified zero arrays of
+        shape [n_cells, n+1] & [n_cells, n+1, 5] are created.
+    cells : tuple of arrays, optional
+        index of the cells in the out arrays, e.g. (rows, cols) to write into
+        (rows, cols, n+1) cubes. If unspecified the first axis of the out
+        arrays are the cells.
+    dtype : numpy dtype, optional
+        type of the created arrays. The default is np.float32.
+
+    Returns
+    -------
+    q_uz, q_lz, st : arrays
+        the output arrays (st is None if states is False).
+    index : tuple
+        index of the cells, the result of time step i is q_uz[index + (i,)].
+    """
+    if out is None:
+        assert cells is None, "cells is only used with out arrays"
+        q_uz = np.zeros((no_cells, no_steps+1), dtype=dtype)
+        q_lz = np.zeros((no_cells, no_steps+1), dtype=dtype)
+        st = np.zeros((no_cells, no_steps+1, 5), dtype=dtype) if states else None
+    else:
+        q_uz, q_lz, st = out
+        assert not states or st is not None, "out should include the states array"
+
+    if cells is None:
+        index = (slice(None),)
+        assert q_uz.shape[:2] == (no_cells, no_steps+1), "out discharge arrays should be of shape (n_cells, n+1)"
+    else:
+        index = tuple(cells)
+        assert len(index[0]) == no_cells, "cells should have the same number of cells as the inputs"
+        assert q_uz.shape[len(index)] == no_steps+1, "out discharge arrays should have n+1 time steps"
+
+    return q_uz, q_lz, st, index
+
+
+def SimulateBatch(prec, temp, et, par, init_st=None, ll_temp=None,
+                  q_init=None, snow=0, states=True, out=None, cells=None):
+    """
+    ================================================================
+        SimulateBatch(prec, temp, et, par, init_st=None, ll_temp=None, q_init=None, snow=0, states=True, out=None, cells=None)
+    ================================================================
+    Run the HBV model for a number of cells (or parameter sets) together,
+    all cells are advanced one time step at a time using array operations,
+    the results are identical to calling Simulate for each cell separately.
+
+    Parameters
+    ----------
+    prec : array_like [n_cells, n]
+        Average precipitation [mm/h]
+    temp : array_like [n_cells, n]
+        Average temperature [C]
+    et : array_like [n_cells, n]
+        Potential Evapotranspiration [mm/h]
+    par : array_like [n_cells, n_par]
+        Parameter array, one row of parameters (same order as Simulate) for
+        each cell.
+    init_st : array_like [5] or [n_cells, 5], optional
+        Initial model states, [sp, sm, uz, lz, wc].
+    ll_temp : array_like [n_cells, n], optional
+        Long term average temptearature. If unspecified, calculated from temp.
+    q_init : float, optional
+        Initial discharge value.
+    snow : integer, optional
+        0 or 1. The default is 0.
+    states : bool, optional
+        False to not keep the states of each time step (st is None).
+        The default is True.
+    out : tuple of arrays, optional
+        (q_uz, q_lz, st) arrays to write the results into (see BatchOutputs).
+    cells : tuple of arrays, optional
+        index of the cells in the out arrays, e.g. (rows, cols) to write
+        directly into the (rows, cols, n+1) cubes of the distributed model.
+
+    Returns
+    -------
+    q_uz : array_like [n_cells, n+1]
+        upper zone discharge [mm/timestep]
+    q_lz : array_like [n_cells, n+1]
+        lower zone discharge [mm/timestep]
+    st : array_like [n_cells, n+1, 5]
+        Model states for the complete time series [mm]
+    """
+    ### inputs validation
+    assert snow == 0 or snow == 1, " snow input defines whether to consider snow subroutine or not it has to be 0 or 1"
+
+    prec = np.asarray(prec)
+    temp = np.asarray(temp)
+    et = np.asarray(et)
+    par = np.asarray(par, dtype=np.float64)
+    no_cells, no_steps = prec.shape
+
+    if init_st is None:
+        init_st = DEF_ST
+    st_i = np.ones((no_cells, 5)) * np.asarray(init_st, dtype=np.float64)
+    assert st_i.shape[1] == 5, "state variables are 5 and the given initial values are "+str(st_i.shape[1])
+
+    if ll_temp is None:
+        ll_temp = np.broadcast_to(temp.mean(axis=1, dtype=np.float64)[:, None], temp.shape)
+    else:
+        ll_temp = np.asarray(ll_temp)
+
+    q_uz, q_lz, st, index = BatchOutputs(no_cells, no_steps, states, out, cells)
+
+    # the same initial discharge as Simulate (zero with snow if q_init is None)
+    if q_init == None:
+        if snow == 0:
+            q_uz[index + (0,)] = par[:,6]*(st_i[:,2]**(1.0 + par[:,8]))
+            q_lz[index + (0,)] = par[:,7]*st_i[:,3]
+        else:
+            q_uz[index + (0,)] = 0
+            q_lz[index + (0,)] = 0
+    else:
+        q_uz[index + (0,)] = par[:,14]*(st_i[:,2]**(1.0 + par[:,16]))
+        q_lz[index + (0,)] = par[:,15]*st_i[:,3]
+    if states:
+        st[index + (0,)] = st_i
+
+    for i in range(no_steps):
+        # the forcing blocks may be float32 (forcing store), only the current
+        # time step is converted
+        v = [x[:,i].astype(np.float64, copy=False) for x in (prec, temp, et, ll_temp)]
+        # the snow structure is not used like in Simulate
+        q_uzi, q_lzi, st_i = StepRunBatch(par, v, st_i, snow=0)
+        q_uz[index + (i+1,)] = q_uzi
+        q_lz[index + (i+1,)] = q_lzi
+        if states:
+            st[index + (i+1,)] = st_i
+
+    return q_uz, q_lz, st
@@ -27,10 +27,18 @@ surface runoff, interflow and baseflow
 """
 # libraries
 import numpy as np
+from Hapi.hbv import BatchOutputs
 
 DEF_ST = [0.0, 10.0, 10.0, 10.0, 0.0]
 DEF_q0 = 0
 
+# parameters order with snow (1) and without snow (0)
+PAR_NAMES = {1: ["tt", "rfcf", "sfcf", "cfmax", "cwh", "cfr", "fc", "beta",
+                 "e_corr", "lp", "k", "k1", "k2", "uzl", "perc"],
+             0: ["rfcf", "fc", "beta", "e_corr", "lp", "k", "k1", "k2", "uzl", "perc"]}
+# states order
+ST_NAMES = ["sp", "sm", "uz", "lz", "wc"]
+
 def Precipitation(prec, temp, tt, rfcf, sfcf):
     """
     ========================================================
@@ -622,4 +630,226 @@ def Simulate(prec, temp, et, ll_temp, par, init_st=None, q_init=None, snow=0):
         # v = [prec[i], temp[i], et[i], ll_temp[i]]
         # q_uz[i], q_lz[i], st[i,:] = StepRun(par, v, st[i-1,:], snow=snow)
 
-    return q_uz, q_lz, st
\ No newline at end of file
+    return q_uz, q_lz, st
+
+def StepRunBatch(p, v, St, snow=0):
+    """
+    ============================================================
+        StepRunBatch(p, v, St, snow=0)
+    ============================================================
+    Vectorized step of the model, advances the states of many cells (or
+    parameter sets) by one time step at once.
+
+    Parameters
+    ----------
+    p : array_like [n_cells, n_par]
+        Parameter array, one row per cell (same order as Simulate).
+    v : array_like [4, n_cells]
+        Input array setup as:
+        [prec, temp, evap, llt]
+    St : array_like [n_cells, 5]
+        Previous model states setup as:
+        [sp, sm, uz, lz, wc]
+    snow : integer, optional
+        0 or 1. The default is 0.
+
+    Returns
+    -------
+    q_uz : array_like [n_cells]
+        upper zone discharge [mm/timestep]
+    q_lz : array_like [n_cells]
+        lower zone discharge [mm/timestep]
+    St : array_like [n_cells, 5]
+        Posterior model states
+    """
+    ## Parse of parameters from input array to model
+    if snow == 1:
+        tt = p[:,0]
+        rfcf = p[:,1]
+        sfcf = p[:,2]
+        # snow function
+        cfmax = p[:,3]
+        cwh = p[:,4]
+        cfr = p[:,5]
+        #soil function
+        fc = p[:,6]
+        beta = p[:,7]
+        e_corr = p[:,8]
+        lp = p[:,9]
+        # response function
+        k = p[:,10]
+        k1 = p[:,11]
+        k2 = p[:,12]
+        uzl = p[:,13]
+        perc = p[:,14]
+    else:
+        tt = 2.0
+        rfcf = p[:,0]
+        sfcf = 0.00001
+        # snow function
+        cfmax = 0.00001
+        cwh = 0.00001
+        cfr = 0.000001
+        #soil function
+        fc = p[:,1]
+        beta = p[:,2]
+        e_corr = p[:,3]
+        lp = p[:,4]
+        # response function
+        k = p[:,5]
+        k1 = p[:,6]
+        k2 = p[:,7]
+        uzl = p[:,8]
+        perc = p[:,9]
+
+    ## Parse of Inputs
+    prec = v[0]
+    temp = v[1]
+    ep = v[2]
+    tm = v[3]
+
+    ## Parse of states
+    sp_old = St[:,0]
+    sm_old = St[:,1]
+    uz_old = St[:,2]
+    lz_old = St[:,3]
+    wc_old = St[:,4]
+
+    ### Precipitation
+    rain = temp > tt
+    rf = np.where(rain, prec*rfcf, 0.0)
+    sf = np.where(rain, 0.0, prec*sfcf)
+
+    ### Snow
+    melt = np.minimum(cfmax*(temp - tt), sp_old + sf)
+    refr = np.minimum(cfr*cfmax*(tt - temp), wc_old + rf)
+    sp_new = np.where(rain, sp_old + sf - melt, sp_old + sf + refr)
+    wc_int = np.where(rain, wc_old + melt + rf, wc_old - refr + rf)
+
+    excess = wc_int > cwh*sp_new
+    inf = np.where(excess, wc_int - cwh*sp_new, 0.0)
+    wc_new = np.where(excess, cwh*sp_new, wc_int)
+
+    ### Soil
+    r = ((sm_old/fc)** beta) * inf
+    ep_int = (1.0 + (temp - tm)*e_corr)*ep
+    ea = np.minimum(ep_int, (sm_old/(lp*fc))*ep_int)
+    uz_int_1 = uz_old + r
+    sm_new = np.maximum(sm_old + inf - r - ea, 0)
+
+    ### Response
+    uz_int_2 = np.maximum(uz_int_1 - perc, 0.0)
+    q_0 = k*np.maximum(uz_int_2 - uzl, 0)
+    q_1 = k1*uz_int_2
+    full = q_0 + q_1 > uz_int_2
+    q_0 = np.where(full, uz_int_2*0.67, q_0)
+    q_1 = np.where(full, uz_int_2*0.33, q_1)
+    uz_new = uz_int_2 - (q_0 + q_1)
+
+    lz_int_1 = lz_old + np.minimum(perc, uz_int_1)
+    q_2 = np.minimum(k2*lz_int_1, lz_int_1)
+    lz_new = lz_int_1 - q_2
+
+    St = np.stack([sp_new, sm_new, uz_new, lz_new, wc_new], axis=1)
+
+    return q_0 + q_1, q_2, St
+
+
+def SimulateBatch(prec, temp, et, ll_temp, par, init_st=None, q_init=None, snow=0,
+                  states=True, out=None, cells=None):
+    """
+    ================================================================
+        SimulateBatch(prec, temp, et, ll_temp, par, init_st=None, q_init=None, snow=0, states=True, out=None, cells=None)
+    ================================================================
+    Run the HBV model for a number of cells (or parameter sets) together,
+    all cells are advanced one time step at a time using array operations,
+    the results are identical to calling Simulate for each cell separately.
+
+    Parameters
+    ----------
+    prec : array_like [n_cells, n]
+        Average precipitation [mm/h]
+    temp : array_like [n_cells, n]
+        Average temperature [C]
+    et : array_like [n_cells, n]
+        Potential Evapotranspiration [mm/h]
+    ll_temp : array_like [n_cells, n]
+        Long term average temptearature.
+    par : array_like [n_cells, n_par]
+        Parameter array, one row of parameters (same order as Simulate) for
+        each cell.
+    init_st : array_like [5] or [n_cells, 5], optional
+        Initial model states, [sp, sm, uz, lz, wc].
+    q_init : float, optional
+        Initial discharge value.
+    snow : integer, optional
+        0 or 1. The default is 0.
+    states : bool, optional
+        False to not keep the states of each time step (st is None).
+        The default is True.
+    out : tuple of arrays, optional
+        (q_uz, q_lz, st) arrays to write the results into (see
+        hbv.BatchOutputs).
+    cells : tuple of arrays, optional
+        index of the cells in the out arrays, e.g. (rows, cols) to write
+        directly into the (rows, cols, n+1) cubes of the distributed model.
+
+    Returns
+    -------
+    q_uz : array_like [n_cells, n+1]
+        upper zone discharge [mm/timestep]
+    q_lz : array_like [n_cells, n+1]
+        lower zone discharge [mm/timestep]
+    st : array_like [n_cells, n+1, 5]
+        Model states for the complete time series [mm]
+    """
+    prec = np.asarray(prec)
+    temp = np.asarray(temp)
+    et = np.asarray(et)
+    ll_temp = np.asarray(ll_temp)
+    par = np.asarray(par, dtype=np.float64)
+    no_cells, no_steps = prec.shape
+
+    q_uz, q_lz, st, index = BatchOutputs(no_cells, no_steps, states, out, cells)
+
+    # the current state is kept in float32 like the stored states
+    st_i = np.zeros([no_cells, 5], dtype=np.float32)
+    if init_st is None:
+        st_i[:,:] = DEF_ST
+    else:
+        st_i[:,:] = init_st
+
+    if states:
+        st[index + (0,)] = st_i
+
+    ### initial runoff
+    if q_init == None:
+        if snow == 1:
+            q_uz[index + (0,)] = (par[:,10] * np.maximum(st_i[:,2] - par[:,13],0)
+                                  + par[:,11] * st_i[:,2])
+            q_lz[index + (0,)] = par[:,12] * st_i[:,3]
+        else:
+            q_uz[index + (0,)] = (par[:,5] * np.maximum(st_i[:,2] - par[:,8],0)
+                                  + par[:,6] * st_i[:,2])
+            q_lz[index + (0,)] = par[:,7] * st_i[:,3]
+    else:
+        q_uz[index + (0,)] = q_init/2
+        q_lz[index + (0,)] = q_init/2
+
+    # states are stored in float32 and read back at each step like Simulate
+    for i in range(1,no_steps):
+        # the forcing blocks may be float32 (forcing store), only the current
+        # time step is converted
+        v = [x[:,i].astype(np.float64, copy=False) for x in (prec, temp, et, ll_temp)]
+        q_uz[index + (i,)], q_lz[index + (i,)], st_i[:,:] = StepRunBatch(par, v, st_i, snow=snow)
+        if states:
+            st[index + (i,)] = st_i
+
+    # like Simulate the last time step is not calculated
+    if no_steps > 0:
+        q_uz[index + (no_steps,)] = 0
+        q_lz[index + (no_steps,)] = 0
+        if states:
+            st[index + (no_steps,)] = 0
+
+    return q_uz, q_lz, st
@@ -144,8 +144,15 @@ DEF_q0 = 0
 
 import numpy as np
 from scipy.interpolate import InterpolatedUnivariateSpline as interp11
+# the parameters & states order and the batched step are the same as hbv
+from Hapi import hbv
+from Hapi.hbv import StepRunBatch, BatchOutputs
 #import sklearn.metrics as error
 
+# every HBV module defines PAR_NAMES, ST_NAMES & SimulateBatch (see hbv)
+PAR_NAMES = hbv.PAR_NAMES
+ST_NAMES = hbv.ST_NAMES
+
 def Precipitation(temp, ltt, utt, prec, rfcf, sfcf, tfac):
     """
     ==============
@@ -582,10 +589,10 @@ def Step_run(p, p2, v, St,curve,lake_sim,snow=0):
 
 
 def Simulate(prec, temp, et, par, p2, init_st=None, ll_temp=None,
-             q_init=None, snow=0, lake_sim=False, curve=None):
+             q_init=None, snow=0, lake_sim=False, curve=None, out=None):
     """
     ================================================================
-        Simulate(prec, temp, et, par, p2, init_st=None, ll_temp=None, q_0=None, snow=0, lake_sim=False, curve=None)
+        Simulate(prec, temp, et, par, p2, init_st=None, ll_temp=None, q_0=None, snow=0, lake_sim=False, curve=None, out=None)
     ================================================================
     Run the HBV model for the number of steps (n) in precipitation. The
     resluts are (n+1) simulation of discharge as the model calculates step n+1
@@ -611,13 +618,18 @@ def Simulate(prec, temp, et, par, p2, init_st=None, ll_temp=None,
         Long term average temptearature. If unspecified, calculated from temp.
     q_0 : float, optional
         Initial discharge value. If unspecified set to 10.0
+    out : tuple of arrays, optional
+        (q_sim [n+1], st [n+1, 6]) arrays to write the results into (st can
+        have 5 columns to leave out the lake volume), if unspecified float64
+        arrays are created.
     
     Returns
     -------
-    q_sim : array_like [n]
+    q_sim : array_like [n+1]
         Discharge for the n time steps of the precipitation vector [m3/s]
-    st : array_like [n, 5]
-        Model states for the complete time series [mm]
+    st : array_like [n+1, 6]
+        Model states for the complete time series [sp, sm, uz, lz, wc] [mm]
+        and the lake volume (zero at the first step)
     """
     ### inputs validation
     # data type
@@ -627,24 +639,131 @@ def Simulate(prec, temp, et, par, p2, init_st=None, ll_temp=None,
     assert snow == 0 or snow == 1, " snow input defines whether to consider snow subroutine or not it has to be 0 or 1"
     
 
+    no_steps = len(prec)
+    if out is None:
+        q_sim = np.zeros(no_steps+1)
+        st = np.zeros((no_steps+1, 6))
+    else:
+        q_sim, st = out
+        assert q_sim.shape == (no_steps+1,), "out discharge array should have n+1 values"
+        assert st.shape in [(no_steps+1, 5), (no_steps+1, 6)], "out state array should be of shape (n+1, 6) or (n+1, 5)"
+    # number of states stored (the lake volume is the 6th)
+    no_st = st.shape[1]
+
     if init_st is None:  #If unspecified, [0.0, 30.0, 30.0, 30.0, 0.0] mm
-        st = [DEF_ST, ] # if not given take the default
+        st_i = DEF_ST # if not given take the default
     else:
-        st=[init_st,]   # if given take it 
+        st_i = init_st   # if given take it 
+    st[0,:] = 0
+    st[0,:min(no_st, len(st_i))] = st_i[:no_st]
 
     if ll_temp is None: #If Long term average temptearature unspecified, calculated from temp
-        ll_temp = [np.mean(temp), ] * len(prec)
+        ll_temp = [np.mean(temp), ] * no_steps
     
     if q_init == None :
-        q_sim = [DEF_q0 , ]
+        q_sim[0] = DEF_q0
     else:
-        q_sim = [q_init, ]
+        q_sim[0] = q_init
 
-    # run the step by step function
-    for i in range(len(prec)):
+    # run the step by step function, the states are carried to the next step
+    # and written to st
+    for i in range(no_steps):
         v = [prec[i], temp[i], et[i], ll_temp[i]]
-        q_out, st_out = Step_run(par, p2, v, st[i],curve,lake_sim,snow=0)
-        q_sim.append(q_out)
-        st.append(st_out)
+        q_sim[i+1], st_i = Step_run(par, p2, v, st_i, curve, lake_sim, snow=0)
+        st[i+1,:] = st_i[:no_st]
     
-    return q_sim, st
\ No newline at end of file
+    return q_sim, st
+
+
+def SimulateBatch(prec, temp, et, par, init_st=None, ll_temp=None,
+                  q_init=None, snow=0, states=True, out=None, cells=None):
+    """
+    ================================================================
+        SimulateBatch(prec, temp, et, par, init_st=None, ll_temp=None, q_init=None, snow=0, states=True, out=None, cells=None)
+    ================================================================
+    Vectorized version of Simulate (without the lake), runs many cells (or
+    parameter sets) together, the loop is over time steps only.
+    unlike Simulate the discharge is not converted to m3/s, the upper and lower
+    zone discharge are returned in mm/timestep like the other HBV modules
+    (q_sim = (q_uz + q_lz) * area / (3.6 * tfac))
+
+    Parameters
+    ----------
+    prec : array_like [n_cells, n]
+        Average precipitation [mm/h]
+    temp : array_like [n_cells, n]
+        Average temperature [C]
+    et : array_like [n_cells, n]
+        Potential Evapotranspiration [mm/h]
+    par : array_like [n_cells, n_par]
+        Parameter array, one row of parameters (same order as Simulate) for
+        each cell.
+    init_st : array_like [5] or [n_cells, 5], optional
+        Initial model states, [sp, sm, uz, lz, wc].
+    ll_temp : array_like [n_cells, n], optional
+        Long term average temptearature. If unspecified, calculated from temp.
+    q_init : float, optional
+        Initial discharge value [m3/s], not used, the initial upper and lower
+        zone discharge [mm/timestep] are calculated from the initial states.
+    snow : integer, optional
+        0 or 1. The default is 0.
+    states : bool, optional
+        False to not keep the states of each time step (st is None).
+        The default is True.
+    out : tuple of arrays, optional
+        (q_uz, q_lz, st) arrays to write the results into (see
+        hbv.BatchOutputs), if unspecified float64 arrays are created.
+    cells : tuple of arrays, optional
+        index of the cells in the out arrays, e.g. (rows, cols) to write
+        directly into the (rows, cols, n+1) cubes of the distributed model.
+
+    Returns
+    -------
+    q_uz : array_like [n_cells, n+1]
+        upper zone discharge [mm/timestep]
+    q_lz : array_like [n_cells, n+1]
+        lower zone discharge [mm/timestep]
+    st : array_like [n_cells, n+1, 5]
+        Model states for the complete time series [mm]
+    """
+    ### inputs validation
+    assert snow == 0 or snow == 1, " snow input defines whether to consider snow subroutine or not it has to be 0 or 1"
+
+    prec = np.asarray(prec)
+    temp = np.asarray(temp)
+    et = np.asarray(et)
+    par = np.asarray(par, dtype=np.float64)
+    no_cells, no_steps = prec.shape
+
+    if init_st is None:
+        init_st = DEF_ST
+    st_i = np.ones((no_cells, 5)) * np.asarray(init_st, dtype=np.float64)
+    assert st_i.shape[1] == 5, "state variables are 5 and the given initial values are "+str(st_i.shape[1])
+
+    if ll_temp is None:
+        ll_temp = np.broadcast_to(temp.mean(axis=1, dtype=np.float64)[:, None], temp.shape)
+    else:
+        ll_temp = np.asarray(ll_temp)
+
+    q_uz, q_lz, st, index = BatchOutputs(no_cells, no_steps, states, out, cells,
+                                         dtype=np.float64)
+    if states:
+        st[index + (0,)] = st_i
+
+    # the initial discharge of each zone (mm/timestep) is calculated from the
+    # initial storages like the Response function (q_init is in m3/s), the
+    # snow structure is not used like in Simulate so k, k1 & alpha are
+    # par[:,6], par[:,7] & par[:,8]
+    q_uz[index + (0,)] = np.minimum(par[:,6]*(st_i[:,2]**(1.0 + par[:,8])), st_i[:,2])
+    q_lz[index + (0,)] = np.minimum(par[:,7]*st_i[:,3], st_i[:,3])
+
+    for i in range(no_steps):
+        # the forcing blocks may be float32 (forcing store), only the current
+        # time step is converted
+        v = [x[:,i].astype(np.float64, copy=False) for x in (prec, temp, et, ll_temp)]
+        # the snow structure is not used like in Simulate
+        q_uz[index + (i+1,)], q_lz[index + (i+1,)], st_i = StepRunBatch(par, v, st_i, snow=0)
+        if states:
+            st[index + (i+1,)] = st_i
+
+    return q_uz, q_lz, st
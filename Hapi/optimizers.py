@@ -0,0 +1,1193 @@
+# -*- coding: utf-8 -*-
+"""
+Optimizers File contains population based optimization algorithms used in
+the calibration, each algorithm proposes a whole generation of parameter sets
+(n_pop, n_par) and evaluates it in one call so the evaluation can be done
+by a pool of workers or by a vectorized (ensemble) model run
+1- Differential Evolution (DE)
+2- Shuffled Complex Evolution (SCE-UA)
+3- Covariance Matrix Adaptation Evolution Strategy (CMA-ES)
+4- Non-dominated Sorting Genetic Algorithm II (NSGA-II) multi-objective
+
+@author: Mostafa
+"""
+
+#library
+import os
+import hashlib
+import numpy as np
+
+
+
+class Optimizers():
+    """
+    ==============================================================
+        Optimizers
+    ==============================================================
+    Optimizers class contains population based optimization algorithms, all
+    the algorithms minimize the objective function.
+
+    the objective function (Evaluate) takes a 2D array (n_pop, n_par) of
+    parameter sets and returns a 1D array (n_pop) of the objective function
+    values (nan for failed runs, they are treated as the worst value)
+
+    DE & SCEUA can use a bounded objective function (Bounded=True) that takes
+    also a 1D array (n_pop) of thresholds, the value of each parameter set
+    that is compared to the threshold (the member it competes with), the
+    evaluation can stop as soon as a lower bound of the value exceeds the
+    threshold and return that lower bound, the decisions of the algorithm
+    are the same as with the full evaluation, the bounded objective function
+    returns the values and a 1D bool array (n_pop) of the evaluations that
+    stopped (their lower bounds are not memorized in the History)
+
+    NSGA2 minimizes many objectives, the objective function returns a 2D
+    array (n_pop, n_obj) and the result is the Pareto front
+
+    Methods
+        1- DE
+        2- SCEUA
+        3- CMAES
+        4- NSGA2
+        functions
+            1- Initialize
+            2- EvaluateGeneration
+            3- NonDominatedSort
+            4- CrowdingDistance
+    """
+
+    def __init__(self):
+        pass
+
+
+    @staticmethod
+    def Initialize(LB, UB, PopSize, rng, InitialValues=None):
+        """
+        ===========================================================
+         Initialize(LB, UB, PopSize, rng, InitialValues)
+        ===========================================================
+        Initialize creates a random population uniformly distributed between
+        the lower and upper bounds
+
+        inputs:
+        ----------
+            1-LB:
+                [numpy array] lower bound of each parameter
+            2-UB:
+                [numpy array] upper bound of each parameter
+            3-PopSize:
+                [integer] number of parameter sets
+            4-rng:
+                [numpy Generator] random generator
+            5-InitialValues:
+                [list/numpy array] parameter set (or 2D array of parameter
+                sets) to start with, it replaces the first members of the
+                population. default is None
+
+        Outputs:
+        ----------
+            1-population:
+                [numpy array] 2D array (PopSize, n_par)
+       """
+        population = LB + rng.random((PopSize, len(LB))) * (UB - LB)
+        if InitialValues is not None and len(InitialValues) > 0:
+            InitialValues = np.atleast_2d(np.asarray(InitialValues, dtype=np.float64))[:PopSize]
+            assert InitialValues.shape[1] == len(LB), "InitialValues should have the same number of parameters as the bounds"
+            population[:len(InitialValues)] = np.clip(InitialValues, LB, UB)
+
+        return population
+
+
+    @staticmethod
+    def EvaluateGeneration(Evaluate, population, Generation, History=None, Thresholds=None):
+        """
+        ===========================================================
+         EvaluateGeneration(Evaluate, population, Generation, History, Thresholds)
+        ===========================================================
+        EvaluateGeneration evaluates a generation of parameter sets in one
+        call of the objective function and writes them to the history log,
+        if the history memorizes the evaluations (Decimals) only the
+        parameter sets that were not evaluated before are evaluated (once)
+
+        inputs:
+        ----------
+            1-Evaluate:
+                [function] objective function of a 2D array of parameter sets
+            2-population:
+                [numpy array] 2D array (n_pop, n_par) of parameter sets
+            3-Generation:
+                [integer] order of the generation (written in the history)
+            4-History:
+                [History object] binary history log. default is None
+            5-Thresholds:
+                [numpy array] 1D array (n_pop) of the thresholds of a bounded
+                objective function (errors, aborted = Evaluate(population, Thresholds)),
+                default is None (Evaluate(population))
+
+        Outputs:
+        ----------
+            1-errors:
+                [numpy array] 1D array (n_pop) of the objective function
+                values, failed runs (nan) are inf
+       """
+        if Thresholds is not None:
+            Thresholds = np.broadcast_to(np.asarray(Thresholds, dtype=np.float64), (len(population),))
+
+        def Run(index, thresholds=None):
+            n = len(population[index])
+            if Thresholds is None:
+                errors = Evaluate(population[index])
+                aborted = np.zeros(n, dtype=bool)
+            else:
+                errors, aborted = Evaluate(population[index], thresholds)
+            return (np.asarray(errors, dtype=np.float64).reshape(n),
+                    np.asarray(aborted, dtype=bool).reshape(n))
+
+        if History is not None and History.Memo is not None:
+            errors, found = History.Lookup(population)
+            if not found.all():
+                # the new parameter sets (each evaluated once, with the
+                # highest threshold of the copies so the lower bound of an
+                # aborted evaluation exceeds the threshold of every copy)
+                new, keys, thresholds = [], [], []
+                for i in np.where(~found)[0]:
+                    key = History.Key(population[i])
+                    if key not in keys:
+                        keys.append(key)
+                        new.append(i)
+                        thresholds.append(-np.inf)
+                    if Thresholds is not None:
+                        j = keys.index(key)
+                        thresholds[j] = max(thresholds[j], Thresholds[i])
+                new_errors, aborted = Run(new, np.array(thresholds))
+                History.Write(Generation, population[new], new_errors, aborted)
+                errors, found = History.Lookup(population)
+                # the lower bounds of the aborted evaluations are not memorized
+                bounds = {keys[j]: new_errors[j] for j in np.where(aborted)[0]}
+                for i in np.where(~found)[0]:
+                    errors[i] = bounds[History.Key(population[i])]
+        else:
+            errors, aborted = Run(slice(None), Thresholds)
+            if History is not None:
+                History.Write(Generation, population, errors, aborted)
+        return np.where(np.isnan(errors), np.inf, errors)
+
+
+    @staticmethod
+    def DE(Evaluate, LB, UB, PopSize=None, Generations=100, F=0.8, CR=0.9,
+           Seed=None, InitialValues=None, Tolerance=None, History=None,
+           printError=None, Bounded=False):
+        """
+        ===========================================================
+         DE(Evaluate, LB, UB, PopSize, Generations, F, CR, Seed,
+            InitialValues, Tolerance, History, printError, Bounded)
+        ===========================================================
+        Differential Evolution (DE/rand/1/bin), each member of the population
+        is crossed with a mutant made of three other members, the trial
+        replaces the member if it is not worse, all the trials of a
+        generation are evaluated together
+
+        inputs:
+        ----------
+            1-Evaluate:
+                [function] objective function of a 2D array (n_pop, n_par)
+            2-LB:
+                [list/numpy array] lower bound of each parameter
+            3-UB:
+                [list/numpy array] upper bound of each parameter
+            4-PopSize:
+                [integer] number of parameter sets in the population, default
+                is 10 * n_par (between 10 and 100)
+            5-Generations:
+                [integer] number of generations. default is 100
+            6-F:
+                [numeric] differential weight (0,2]. default is 0.8
+            7-CR:
+                [numeric] crossover probability [0,1]. default is 0.9
+            8-Seed:
+                [integer] seed of the random generator. default is None
+            9-InitialValues:
+                [list/numpy array] parameter set(s) to start with. default is None
+            10-Tolerance:
+                [numeric] stop if the range of the objective function values
+                of the population is less than Tolerance. default is None
+            11-History:
+                [History object] binary history log. default is None
+            12-printError:
+                [integer] 1 to print the best value of each generation
+            13-Bounded:
+                [bool] True if Evaluate is bounded, each trial is evaluated
+                with the value of its member as threshold. default is False
+
+        Outputs:
+        ----------
+            1-error:
+                [float] best value of the objective function
+            2-par:
+                [numpy array] best parameter set
+
+        Examples:
+        ----------
+        error, par = Optimizers.DE(Coello.EvaluatePopulation, LB, UB, Generations=50, Seed=1)
+       """
+        LB = np.asarray(LB, dtype=np.float64)
+        UB = np.asarray(UB, dtype=np.float64)
+        n = len(LB)
+        if PopSize is None:
+            PopSize = min(max(10 * n, 10), 100)
+        assert PopSize >= 4, "DE needs at least 4 parameter sets in the population"
+
+        rng = np.random.default_rng(Seed)
+        population = Optimizers.Initialize(LB, UB, PopSize, rng, InitialValues)
+        errors = Optimizers.EvaluateGeneration(Evaluate, population, 0, History)
+
+        members = np.arange(PopSize)
+        for generation in range(1, Generations + 1):
+            # three different members (other than the member itself) for each mutant
+            order = rng.random((PopSize, PopSize))
+            order[members, members] = 2
+            r = np.argsort(order, axis=1)[:,:3]
+            mutant = population[r[:,0]] + F * (population[r[:,1]] - population[r[:,2]])
+
+            # binomial crossover, at least one parameter is taken from the mutant
+            cross = rng.random((PopSize, n)) < CR
+            cross[members, rng.integers(n, size=PopSize)] = True
+            trial = np.where(cross, mutant, population)
+
+            # parameters out of the bounds are moved between the bound and the member
+            trial = np.where(trial < LB, (LB + population) / 2, trial)
+            trial = np.where(trial > UB, (UB + population) / 2, trial)
+
+            # a trial that is worse than its member is rejected anyway
+            trial_errors = Optimizers.EvaluateGeneration(Evaluate, trial, generation, History,
+                                                         errors if Bounded else None)
+            better = trial_errors <= errors
+            population[better] = trial[better]
+            errors[better] = trial_errors[better]
+
+            if printError:
+                print("Generation " + str(generation) + " best = " + str(errors.min()))
+
+            if Tolerance is not None and np.isfinite(errors).all() and errors.max() - errors.min() < Tolerance:
+                break
+
+        best = np.argmin(errors)
+        return errors[best], population[best].copy()
+
+
+    @staticmethod
+    def SCEUA(Evaluate, LB, UB, Complexes=2, PointsComplex=None, PointsSimplex=None,
+              EvolutionSteps=None, Generations=100, Seed=None, InitialValues=None,
+              Tolerance=None, History=None, printError=None, Bounded=False):
+        """
+        ===========================================================
+         SCEUA(Evaluate, LB, UB, Complexes, PointsComplex, PointsSimplex,
+               EvolutionSteps, Generations, Seed, InitialValues, Tolerance,
+               History, printError, Bounded)
+        ===========================================================
+        Shuffled Complex Evolution (SCE-UA, Duan et al. 1992), the population
+        is divided into complexes that evolve with the competitive complex
+        evolution (simplex reflection, contraction or a random point) then
+        the complexes are shuffled, all the complexes evolve at the same time
+        so each evolution step evaluates one parameter set of each complex
+        in one call
+
+        inputs:
+        ----------
+            1-Evaluate:
+                [function] objective function of a 2D array (n_pop, n_par)
+            2-LB:
+                [list/numpy array] lower bound of each parameter
+            3-UB:
+                [list/numpy array] upper bound of each parameter
+            4-Complexes:
+                [integer] number of complexes. default is 2
+            5-PointsComplex:
+                [integer] number of points in each complex. default is 2*n_par+1
+            6-PointsSimplex:
+                [integer] number of points in each simplex. default is n_par+1
+            7-EvolutionSteps:
+                [integer] evolution steps of each complex before shuffling.
+                default is PointsComplex
+            8-Generations:
+                [integer] number of shuffling loops. default is 100
+            9-Seed:
+                [integer] seed of the random generator. default is None
+            10-InitialValues:
+                [list/numpy array] parameter set(s) to start with. default is None
+            11-Tolerance:
+                [numeric] stop if the normalized range of the parameters of
+                the population is less than Tolerance. default is None
+            12-History:
+                [History object] binary history log. default is None
+            13-printError:
+                [integer] 1 to print the best value of each shuffling loop
+            14-Bounded:
+                [bool] True if Evaluate is bounded, the reflection and the
+                contraction are evaluated with the worst point of the simplex
+                as threshold (the random points are evaluated fully).
+                default is False
+
+        Outputs:
+        ----------
+            1-error:
+                [float] best value of the objective function
+            2-par:
+                [numpy array] best parameter set
+
+        Examples:
+        ----------
+        error, par = Optimizers.SCEUA(Coello.EvaluatePopulation, LB, UB, Complexes=4)
+       """
+        LB = np.asarray(LB, dtype=np.float64)
+        UB = np.asarray(UB, dtype=np.float64)
+        n = len(LB)
+        if PointsComplex is None:
+            PointsComplex = 2 * n + 1
+        if PointsSimplex is None:
+            PointsSimplex = n + 1
+        if EvolutionSteps is None:
+            EvolutionSteps = PointsComplex
+        assert 2 <= PointsSimplex <= PointsComplex, "PointsSimplex should be between 2 and PointsComplex"
+
+        rng = np.random.default_rng(Seed)
+        population = Optimizers.Initialize(LB, UB, Complexes * PointsComplex, rng, InitialValues)
+        errors = Optimizers.EvaluateGeneration(Evaluate, population, 0, History)
+
+        # trapezoidal probability of selecting each point (sorted) of a complex
+        probability = 2 * (PointsComplex - np.arange(PointsComplex)) / (PointsComplex * (PointsComplex + 1))
+        complexes = np.arange(Complexes)
+
+        for generation in range(1, Generations + 1):
+            order = np.argsort(errors)
+            population, errors = population[order], errors[order]
+            # partition into complexes, point j of complex k is point k + j*Complexes
+            cpar = population.reshape(PointsComplex, Complexes, n).transpose(1, 0, 2).copy()
+            cerr = errors.reshape(PointsComplex, Complexes).T.copy()
+
+            for step in range(EvolutionSteps):
+                # select a simplex of each complex (sorted from the best point)
+                simplex = np.sort(np.array([rng.choice(PointsComplex, PointsSimplex, replace=False, p=probability)
+                                            for k in complexes]), axis=1)
+                worst = simplex[:,-1]
+                centroid = cpar[complexes[:,None], simplex[:,:-1]].mean(axis=1)
+                sworst = cpar[complexes, worst]
+                eworst = cerr[complexes, worst]
+
+                # the smallest hypercube of each complex for the random points
+                cmin = cpar.min(axis=1)
+                cmax = cpar.max(axis=1)
+
+                # reflection (random point if it is out of the bounds)
+                new = 2 * centroid - sworst
+                outside = ((new < LB) | (new > UB)).any(axis=1)
+                new[outside] = cmin[outside] + rng.random((outside.sum(), n)) * (cmax - cmin)[outside]
+                enew = Optimizers.EvaluateGeneration(Evaluate, new, generation, History,
+                                                     eworst if Bounded else None)
+
+                # contraction of the complexes where the reflection failed
+                failed = enew > eworst
+                if failed.any():
+                    new[failed] = (centroid[failed] + sworst[failed]) / 2
+                    enew[failed] = Optimizers.EvaluateGeneration(Evaluate, new[failed], generation, History,
+                                                                 eworst[failed] if Bounded else None)
+
+                # random point for the complexes where the contraction failed
+                failed = enew > eworst
+                if failed.any():
+                    new[failed] = cmin[failed] + rng.random((failed.sum(), n)) * (cmax - cmin)[failed]
+                    enew[failed] = Optimizers.EvaluateGeneration(Evaluate, new[failed], generation, History)
+
+                cpar[complexes, worst] = new
+                cerr[complexes, worst] = enew
+                # keep each complex sorted
+                corder = np.argsort(cerr, axis=1)
+                cpar = cpar[complexes[:,None], corder]
+                cerr = cerr[complexes[:,None], corder]
+
+            # shuffle the complexes
+            population = cpar.reshape(-1, n)
+            errors = cerr.reshape(-1)
+
+            if printError:
+                print("Generation " + str(generation) + " best = " + str(errors.min()))
+
+            if Tolerance is not None:
+                spread = (population.max(axis=0) - population.min(axis=0)) / np.where(UB > LB, UB - LB, 1)
+                if np.exp(np.mean(np.log(spread + 1e-300))) < Tolerance:
+                    break
+
+        best = np.argmin(errors)
+        return errors[best], population[best].copy()
+
+
+    @staticmethod
+    def CMAES(Evaluate, LB, UB, PopSize=None, Generations=100, Sigma=0.3, Seed=None,
+              InitialValues=None, Tolerance=None, History=None, printError=None):
+        """
+        ===========================================================
+         CMAES(Evaluate, LB, UB, PopSize, Generations, Sigma, Seed,
+               InitialValues, Tolerance, History, printError)
+        ===========================================================
+        Covariance Matrix Adaptation Evolution Strategy (CMA-ES, Hansen 2016),
+        the parameters are normalized by the bounds to [0,1], each generation
+        is sampled from a multivariate normal distribution and the mean, step
+        size and covariance matrix are updated from the best half of it,
+        sampled parameters out of the bounds are clipped to the bounds
+
+        inputs:
+        ----------
+            1-Evaluate:
+                [function] objective function of a 2D array (n_pop, n_par)
+            2-LB:
+                [list/numpy array] lower bound of each parameter
+            3-UB:
+                [list/numpy array] upper bound of each parameter
+            4-PopSize:
+                [integer] number of parameter sets in each generation, default
+                is 4 + 3*ln(n_par)
+            5-Generations:
+                [integer] number of generations. default is 100
+            6-Sigma:
+                [numeric] initial step size (fraction of the range between the
+                bounds). default is 0.3
+            7-Seed:
+                [integer] seed of the random generator. default is None
+            8-InitialValues:
+                [list/numpy array] initial mean of the distribution, default is
+                the middle of the bounds
+            9-Tolerance:
+                [numeric] stop if the step size is less than Tolerance
+                (normalized). default is None
+            10-History:
+                [History object] binary history log. default is None
+            11-printError:
+                [integer] 1 to print the best value of each generation
+
+        Outputs:
+        ----------
+            1-error:
+                [float] best value of the objective function
+            2-par:
+                [numpy array] best parameter set
+
+        Examples:
+        ----------
+        error, par = Optimizers.CMAES(Coello.EvaluatePopulation, LB, UB, Sigma=0.2)
+       """
+        LB = np.asarray(LB, dtype=np.float64)
+        UB = np.asarray(UB, dtype=np.float64)
+        n = len(LB)
+        scale = np.where(UB > LB, UB - LB, 1)
+        if PopSize is None:
+            PopSize = 4 + int(3 * np.log(n))
+        assert PopSize >= 2, "CMA-ES needs at least 2 parameter sets in each generation"
+
+        # selection weights of the best half
+        mu = PopSize // 2
+        weights = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+        weights = weights / weights.sum()
+        mueff = 1 / np.sum(weights**2)
+
+        # adaptation constants
+        cc = (4 + mueff / n) / (n + 4 + 2 * mueff / n)
+        cs = (mueff + 2) / (n + mueff + 5)
+        c1 = 2 / ((n + 1.3)**2 + mueff)
+        cmu = min(1 - c1, 2 * (mueff - 2 + 1 / mueff) / ((n + 2)**2 + mueff))
+        damps = 1 + 2 * max(0, np.sqrt((mueff - 1) / (n + 1)) - 1) + cs
+        chiN = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n**2))
+
+        rng = np.random.default_rng(Seed)
+        if InitialValues is not None and len(InitialValues) > 0:
+            mean = np.clip((np.asarray(InitialValues, dtype=np.float64) - LB) / scale, 0, 1)
+        else:
+            mean = np.ones(n) * 0.5
+        sigma = Sigma
+        pc = np.zeros(n)
+        ps = np.zeros(n)
+        B = np.eye(n)
+        D = np.ones(n)
+        C = np.eye(n)
+        invsqrtC = np.eye(n)
+        # number of evaluations & the number at the last eigen decomposition
+        counteval, eigeneval = 0, 0
+
+        best_error, best_par = np.inf, LB + mean * scale
+        for generation in range(Generations):
+            z = rng.standard_normal((PopSize, n))
+            y = mean + sigma * (z * D) @ B.T
+            y = np.clip(y, 0, 1)
+            population = LB + y * scale
+            errors = Optimizers.EvaluateGeneration(Evaluate, population, generation, History)
+            counteval += PopSize
+
+            order = np.argsort(errors)
+            if errors[order[0]] < best_error:
+                best_error, best_par = errors[order[0]], population[order[0]].copy()
+
+            # update the mean from the best half
+            old_mean = mean
+            mean = weights @ y[order[:mu]]
+            step = (mean - old_mean) / sigma
+
+            # evolution paths
+            ps = (1 - cs) * ps + np.sqrt(cs * (2 - cs) * mueff) * (invsqrtC @ step)
+            hsig = np.linalg.norm(ps) / np.sqrt(1 - (1 - cs)**(2 * (generation + 1))) / chiN < 1.4 + 2 / (n + 1)
+            pc = (1 - cc) * pc + hsig * np.sqrt(cc * (2 - cc) * mueff) * step
+
+            # covariance matrix & step size
+            artmp = (y[order[:mu]] - old_mean) / sigma
+            C = ((1 - c1 - cmu) * C
+                 + c1 * (np.outer(pc, pc) + (1 - hsig) * cc * (2 - cc) * C)
+                 + cmu * (artmp.T * weights) @ artmp)
+            sigma = sigma * np.exp((cs / damps) * (np.linalg.norm(ps) / chiN - 1))
+
+            # the eigen decomposition (O(n^3)) is updated after enough
+            # evaluations for C to change (Hansen's lazy update)
+            if counteval - eigeneval > PopSize / (c1 + cmu) / n / 10:
+                eigeneval = counteval
+                C = np.triu(C) + np.triu(C, 1).T
+                D2, B = np.linalg.eigh(C)
+                D = np.sqrt(np.maximum(D2, 1e-20))
+                invsqrtC = (B / D) @ B.T
+
+            if printError:
+                print("Generation " + str(generation) + " best = " + str(best_error))
+
+            if Tolerance is not None and sigma * D.max() < Tolerance:
+                break
+
+        return best_error, best_par
+
+
+    @staticmethod
+    def NonDominatedSort(Objectives):
+        """
+        ===========================================================
+         NonDominatedSort(Objectives)
+        ===========================================================
+        NonDominatedSort ranks the parameter sets by Pareto dominance, rank 0
+        is the non-dominated front, rank 1 is the front that is dominated
+        only by the rank 0 and so on (all the objectives are minimized)
+
+        inputs:
+        ----------
+            1-Objectives:
+                [numpy array] 2D array (n_pop, n_obj) of the objective values
+
+        Outputs:
+        ----------
+            1-rank:
+                [numpy array] 1D array (n_pop) of the front of each parameter set
+       """
+        F = np.asarray(Objectives, dtype=np.float64)
+        # dominates[i,j] True if i dominates j
+        dominates = (np.all(F[:,None,:] <= F[None,:,:], axis=2)
+                     & np.any(F[:,None,:] < F[None,:,:], axis=2))
+        dominators = dominates.sum(axis=0)
+        rank = np.full(len(F), -1, dtype=np.int64)
+        front = 0
+        current = np.where(dominators == 0)[0]
+        while len(current) > 0:
+            rank[current] = front
+            dominators = dominators - dominates[current].sum(axis=0)
+            dominators[rank >= 0] = -1
+            current = np.where(dominators == 0)[0]
+            front = front + 1
+        return rank
+
+
+    @staticmethod
+    def CrowdingDistance(Objectives):
+        """
+        ===========================================================
+         CrowdingDistance(Objectives)
+        ===========================================================
+        CrowdingDistance calculates the distance of each parameter set of a
+        front to its neighbours along each objective (normalized by the
+        range of the objective), the sets at the ends of the front have an
+        infinite distance
+
+        inputs:
+        ----------
+            1-Objectives:
+                [numpy array] 2D array (n_front, n_obj) of the objective values
+
+        Outputs:
+        ----------
+            1-distance:
+                [numpy array] 1D array (n_front) of the crowding distance
+       """
+        F = np.asarray(Objectives, dtype=np.float64)
+        distance = np.zeros(len(F))
+        if len(F) <= 2:
+            return distance + np.inf
+        for m in range(F.shape[1]):
+            order = np.argsort(F[:,m], kind="stable")
+            values = F[order, m]
+            distance[order[0]] = distance[order[-1]] = np.inf
+            span = values[-1] - values[0]
+            if np.isfinite(span) and span > 0:
+                distance[order[1:-1]] = distance[order[1:-1]] + (values[2:] - values[:-2]) / span
+        return distance
+
+
+    @staticmethod
+    def NSGA2(Evaluate, LB, UB, PopSize=None, Generations=100, CR=0.9, EtaC=15,
+              EtaM=20, PM=None, Seed=None, InitialValues=None, Archive=None,
+              printError=None):
+        """
+        ===========================================================
+         NSGA2(Evaluate, LB, UB, PopSize, Generations, CR, EtaC, EtaM, PM,
+               Seed, InitialValues, Archive, printError)
+        ===========================================================
+        Non-dominated Sorting Genetic Algorithm II (Deb et al. 2002) for
+        multi-objective calibration, the offspring are created by binary
+        tournament selection, simulated binary crossover and polynomial
+        mutation, the parents and the offspring are sorted by their front
+        (NonDominatedSort) and crowding distance (CrowdingDistance) and the
+        best PopSize survive, all the offspring of a generation are evaluated
+        together and added to the Pareto archive (Archive)
+
+        inputs:
+        ----------
+            1-Evaluate:
+                [function] objective function of a 2D array (n_pop, n_par)
+                that returns a 2D array (n_pop, n_obj) of objective values
+                (all minimized, nan for failed runs)
+            2-LB:
+                [list/numpy array] lower bound of each parameter
+            3-UB:
+                [list/numpy array] upper bound of each parameter
+            4-PopSize:
+                [integer] number of parameter sets in the population, default
+                is 10 * n_par (between 20 and 100)
+            5-Generations:
+                [integer] number of generations. default is 100
+            6-CR:
+                [numeric] crossover probability of each pair of parents. default is 0.9
+            7-EtaC:
+                [numeric] distribution index of the crossover. default is 15
+            8-EtaM:
+                [numeric] distribution index of the mutation. default is 20
+            9-PM:
+                [numeric] mutation probability of each parameter. default is 1/n_par
+            10-Seed:
+                [integer] seed of the random generator. default is None
+            11-InitialValues:
+                [list/numpy array] parameter set(s) to start with. default is None
+            12-Archive:
+                [ParetoArchive object] archive of the non-dominated parameter
+                sets of all the generations. default is None
+            13-printError:
+                [integer] 1 to print the size of the first front of each generation
+
+        Outputs:
+        ----------
+            1-objectives:
+                [numpy array] 2D array (n_front, n_obj) objective values of
+                the first front of the last population
+            2-pars:
+                [numpy array] 2D array (n_front, n_par) parameter sets of the
+                first front of the last population
+
+        Examples:
+        ----------
+        objectives, pars = Optimizers.NSGA2(Evaluate, LB, UB, Generations=50, Seed=1)
+       """
+        LB = np.asarray(LB, dtype=np.float64)
+        UB = np.asarray(UB, dtype=np.float64)
+        n = len(LB)
+        if PopSize is None:
+            PopSize = min(max(10 * n, 20), 100)
+        # the offspring are created in pairs
+        PopSize = PopSize + PopSize % 2
+        if PM is None:
+            PM = 1 / n
+
+        def Run(population):
+            objectives = np.asarray(Evaluate(population), dtype=np.float64).reshape(len(population), -1)
+            if Archive is not None:
+                Archive.Update(population, objectives)
+            return np.where(np.isnan(objectives), np.inf, objectives)
+
+        def Survivors(population, objectives):
+            # sort by the front then by the crowding distance (descending)
+            rank = Optimizers.NonDominatedSort(objectives)
+            distance = np.zeros(len(population))
+            for front in np.unique(rank):
+                members = np.where(rank == front)[0]
+                distance[members] = Optimizers.CrowdingDistance(objectives[members])
+            order = np.lexsort((-distance, rank))[:PopSize]
+            return population[order], objectives[order], rank[order], distance[order]
+
+        rng = np.random.default_rng(Seed)
+        population = Optimizers.Initialize(LB, UB, PopSize, rng, InitialValues)
+        objectives = Run(population)
+        population, objectives, rank, distance = Survivors(population, objectives)
+
+        width = UB - LB
+        for generation in range(1, Generations + 1):
+            # binary tournament, lower front then larger crowding distance wins
+            a, b = rng.integers(PopSize, size=(2, PopSize))
+            wins = (rank[a] < rank[b]) | ((rank[a] == rank[b]) & (distance[a] >= distance[b]))
+            parents = population[np.where(wins, a, b)]
+            p1, p2 = parents[0::2], parents[1::2]
+
+            # simulated binary crossover
+            u = rng.random(p1.shape)
+            beta = np.where(u <= 0.5, (2 * u)**(1 / (EtaC + 1)), (1 / (2 * (1 - u)))**(1 / (EtaC + 1)))
+            cross = (rng.random((len(p1), 1)) < CR) & (rng.random(p1.shape) < 0.5)
+            beta = np.where(cross, beta, 1)
+            c1 = 0.5 * ((1 + beta) * p1 + (1 - beta) * p2)
+            c2 = 0.5 * ((1 - beta) * p1 + (1 + beta) * p2)
+            offspring = np.vstack([c1, c2])
+
+            # polynomial mutation
+            u = rng.random(offspring.shape)
+            delta = np.where(u < 0.5, (2 * u)**(1 / (EtaM + 1)) - 1, 1 - (2 * (1 - u))**(1 / (EtaM + 1)))
+            mutate = rng.random(offspring.shape) < PM
+            offspring = np.clip(np.where(mutate, offspring + delta * width, offspring), LB, UB)
+
+            offspring_objectives = Run(offspring)
+            population, objectives, rank, distance = Survivors(np.vstack([population, offspring]),
+                                                               np.vstack([objectives, offspring_objectives]))
+            if printError:
+                print("Generation " + str(generation) + " first front = " + str(np.sum(rank == 0)))
+
+        front = rank == 0
+        return objectives[front].copy(), population[front].copy()
+
+
+
+class History():
+    """
+    ==============================================================
+        History
+    ==============================================================
+    History class writes every evaluated parameter set and its objective
+    function value to a compact binary log, each record is the generation
+    (int32), the objective function value (float64) and the parameters
+    (n_par float64) after a 16 bytes header (b"HAPIHIST", version, n_par),
+    the records of each generation are flushed to the disk so the log is
+    complete up to the last generation if the calibration is killed
+
+    if Decimals is given the history memorizes the objective function value
+    of each parameter set (rounded to Decimals) so a parameter set is never
+    evaluated twice (the optimizers only evaluate the sets that Lookup does
+    not find), a calibration that was killed resumes by running the same
+    optimizer with the same Seed and the same log (Append), all the
+    generations in the log are replayed from the memory without running the
+    model and the calibration continues from the last generation.
+
+    the evaluations of a bounded objective function that stopped early
+    (aborted) have only a lower bound of the objective function value, they
+    are written to the log with an infinite value and are not memorized (a
+    resumed calibration evaluates them again).
+
+    Methods
+        1- Dtype
+        2- ReadHeader
+        3- Key
+        4- Lookup
+        5- Write
+        6- Read
+    """
+    Header = b"HAPIHIST"
+    Version = 1
+
+    def __init__(self, Path, NoPar, Append=False, Decimals=None):
+        """
+        =============================================================================
+             History(Path, NoPar, Append=False, Decimals=None)
+        =============================================================================
+        Parameters
+        ----------
+        Path : [str]
+            path of the log file, None to keep the memory only (no file).
+        NoPar : [int]
+            number of parameters of each parameter set.
+        Append : [bool], optional
+            True to add the records to an existing log (the number of
+            parameters should be the same), False to start a new log.
+            The default is False.
+        Decimals : [int], optional
+            number of decimals the parameters are rounded to before they are
+            hashed to memorize the objective function values, None to not
+            memorize. The default is None.
+
+        Returns
+        -------
+        None.
+        """
+        self.Path = Path
+        self.NoPar = NoPar
+        self.dtype = History.Dtype(NoPar)
+        self.Decimals = Decimals
+        # {hash of the rounded parameters: objective function value}
+        if Decimals is None:
+            self.Memo = None
+        else:
+            self.Memo = {}
+
+        if Path is None:
+            return
+
+        if Append and os.path.exists(Path) and os.path.getsize(Path) > 0:
+            records = History.Read(Path)
+            assert records.dtype == self.dtype, Path + " was written with a different number of parameters"
+            # remove an incomplete last record before appending
+            os.truncate(Path, 16 + len(records) * self.dtype.itemsize)
+            if self.Memo is not None:
+                # the aborted evaluations are not memorized
+                records = records[records["Error"] != np.inf]
+                for key, error in zip(self.Key(records["Parameters"]), records["Error"]):
+                    self.Memo[key] = error
+        else:
+            with open(Path, "wb") as f:
+                f.write(History.Header)
+                np.array([History.Version, NoPar], dtype="<i4").tofile(f)
+
+
+    @staticmethod
+    def Dtype(NoPar):
+        """
+        Dtype returns the record type of a log of NoPar parameters
+        """
+        return np.dtype([("Generation", "<i4"), ("Error", "<f8"), ("Parameters", "<f8", (NoPar,))])
+
+
+    @staticmethod
+    def ReadHeader(Path):
+        """
+        ReadHeader checks the header of the log and returns the number of
+        parameters of each record
+        """
+        with open(Path, "rb") as f:
+            assert f.read(8) == History.Header, Path + " is not a calibration history log"
+            version, NoPar = np.fromfile(f, dtype="<i4", count=2)
+        return int(NoPar)
+
+
+    def Key(self, Pars):
+        """
+        ==============================================================
+            Key(Pars)
+        ==============================================================
+        Key method returns the hash of the rounded parameters
+
+        Parameters
+        ----------
+        Pars : [array]
+            parameter set or 2D array (n_sets, n_par) of parameter sets.
+
+        Returns
+        -------
+        key : [bytes/list]
+            hash of the parameter set (list of hashes for a 2D array).
+        """
+        Pars = np.asarray(Pars, dtype=np.float64)
+        # + 0.0 to have the same key for 0 and -0
+        rounded = np.ascontiguousarray(np.round(Pars, self.Decimals) + 0.0)
+        if rounded.ndim == 1:
+            return hashlib.sha1(rounded.tobytes()).digest()
+        return [hashlib.sha1(row.tobytes()).digest() for row in rounded]
+
+
+    def Lookup(self, Pars):
+        """
+        ==============================================================
+            Lookup(Pars)
+        ==============================================================
+        Lookup method returns the memorized objective function values
+
+        Parameters
+        ----------
+        Pars : [array]
+            2D array (n_sets, n_par) of parameter sets.
+
+        Returns
+        -------
+        errors : [array]
+            1D array (n_sets) of the objective function values (nan if not found).
+        found : [array]
+            1D bool array (n_sets), True if the parameter set was evaluated before.
+        """
+        keys = self.Key(np.atleast_2d(Pars))
+        found = np.array([key in self.Memo for key in keys], dtype=bool)
+        errors = np.array([self.Memo.get(key, np.nan) for key in keys], dtype=np.float64)
+        return errors, found
+
+
+    def Write(self, Generation, Pars, Errors, Aborted=None):
+        """
+        ==============================================================
+            Write(Generation, Pars, Errors, Aborted=None)
+        ==============================================================
+        Write method appends the evaluated parameter sets to the log (and
+        to the memory), the aborted evaluations are written with an
+        infinite value and are not memorized
+
+        Parameters
+        ----------
+        Generation : [int]
+            order of the generation.
+        Pars : [array]
+            2D array (n_sets, n_par) of parameter sets.
+        Errors : [array]
+            1D array (n_sets) of the objective function values.
+        Aborted : [array], optional
+            1D bool array (n_sets), True for the evaluations of a bounded
+            objective function that stopped early. The default is None.
+
+        Returns
+        -------
+        None.
+        """
+        Errors = np.atleast_1d(np.asarray(Errors, dtype=np.float64))
+        if Aborted is None:
+            Aborted = np.zeros(len(Errors), dtype=bool)
+        Errors = np.where(Aborted, np.inf, Errors)
+
+        if self.Memo is not None:
+            for key, error, aborted in zip(self.Key(np.atleast_2d(Pars)), Errors, Aborted):
+                if not aborted:
+                    self.Memo[key] = float(error)
+
+        if self.Path is None:
+            return
+
+        records = np.zeros(len(Pars), dtype=self.dtype)
+        records["Generation"] = Generation
+        records["Error"] = Errors
+        records["Parameters"] = Pars
+        with open(self.Path, "ab") as f:
+            records.tofile(f)
+
+
+    @staticmethod
+    def Read(Path, Aborted=True):
+        """
+        ==============================================================
+            Read(Path, Aborted=True)
+        ==============================================================
+        Read method reads the history log
+
+        Parameters
+        ----------
+        Path : [str]
+            path of the log file.
+        Aborted : [bool], optional
+            False to skip the records of the aborted evaluations (infinite
+            objective function value). The default is True.
+
+        Returns
+        -------
+        records : [structured array]
+            array with the fields "Generation", "Error" & "Parameters"
+            (n_records, n_par), an incomplete last record (if the writing
+            was interrupted) is ignored.
+        """
+        NoPar = History.ReadHeader(Path)
+        dtype = History.Dtype(NoPar)
+        count = (os.path.getsize(Path) - 16) // dtype.itemsize
+        records = np.fromfile(Path, dtype=dtype, count=count, offset=16)
+        if not Aborted:
+            records = records[records["Error"] != np.inf]
+        return records
+
+
+
+class ParetoArchive():
+    """
+    ==============================================================
+        ParetoArchive
+    ==============================================================
+    ParetoArchive class keeps the non-dominated parameter sets of a
+    multi-objective calibration (all the objectives are minimized), with
+    Epsilon the objective space is divided into boxes of size Epsilon and
+    only one parameter set is kept in each non-dominated box (epsilon
+    dominance, Laumanns et al. 2002) which limits the size of the archive
+    and keeps the front evenly spread.
+
+    the archive is saved to a binary file after each update, the file is
+    written next to the archive and renamed so a killed calibration always
+    leaves a complete archive, it has a 20 bytes header (b"HAPIPARE",
+    version, n_par, n_obj) and a record of the objectives (n_obj float64)
+    and the parameters (n_par float64) of each parameter set.
+
+    Methods
+        1- Dtype
+        2- Box
+        3- Update
+        4- Save
+        5- Read
+    """
+    Header = b"HAPIPARE"
+    Version = 1
+
+    def __init__(self, Path, NoPar, NoObj, Epsilon=None, Append=False):
+        """
+        =============================================================================
+             ParetoArchive(Path, NoPar, NoObj, Epsilon=None, Append=False)
+        =============================================================================
+        Parameters
+        ----------
+        Path : [str]
+            path of the archive file, None to keep the archive in memory only.
+        NoPar : [int]
+            number of parameters of each parameter set.
+        NoObj : [int]
+            number of objectives.
+        Epsilon : [numeric/list], optional
+            size of the boxes of each objective (one value for all the
+            objectives), None to keep all the non-dominated parameter sets.
+            The default is None.
+        Append : [bool], optional
+            True to start from the parameter sets of an existing archive
+            (e.g. to resume a calibration), False to start a new archive that
+            replaces the file at the first Save. The default is False.
+
+        Returns
+        -------
+        None.
+        """
+        self.Path = Path
+        self.NoPar = NoPar
+        self.NoObj = NoObj
+        if Epsilon is None:
+            self.Epsilon = None
+        else:
+            self.Epsilon = np.broadcast_to(np.asarray(Epsilon, dtype=np.float64), (NoObj,)).copy()
+            assert np.all(self.Epsilon > 0), "Epsilon should be positive"
+
+        self.Parameters = np.zeros((0, NoPar))
+        self.Objectives = np.zeros((0, NoObj))
+
+        if Path is not None and Append and os.path.exists(Path):
+            records = ParetoArchive.Read(Path)
+            assert records.dtype == ParetoArchive.Dtype(NoPar, NoObj), Path + " was written with a different number of parameters or objectives"
+            self.Update(records["Parameters"], records["Objectives"])
+
+
+    @staticmethod
+    def Dtype(NoPar, NoObj):
+        """
+        Dtype returns the record type of an archive of NoPar parameters and
+        NoObj objectives
+        """
+        return np.dtype([("Objectives", "<f8", (NoObj,)), ("Parameters", "<f8", (NoPar,))])
+
+
+    def Box(self, Objectives):
+        """
+        Box returns the box of the objective values (the objective values
+        themselves if there is no Epsilon)
+        """
+        if self.Epsilon is None:
+            return np.asarray(Objectives, dtype=np.float64)
+        return np.floor(np.asarray(Objectives, dtype=np.float64) / self.Epsilon)
+
+
+    def Update(self, Pars, Objectives):
+        """
+        ==============================================================
+            Update(Pars, Objectives)
+        ==============================================================
+        Update method adds the parameter sets that are not dominated by the
+        archive, removes the parameter sets they dominate and saves the
+        archive, parameter sets with nan/inf objective values are skipped
+
+        Parameters
+        ----------
+        Pars : [array]
+            2D array (n_sets, n_par) of parameter sets.
+        Objectives : [array]
+            2D array (n_sets, n_obj) of the objective values.
+
+        Returns
+        -------
+        added : [int]
+            number of parameter sets added to the archive.
+        """
+        Pars = np.atleast_2d(np.asarray(Pars, dtype=np.float64))
+        Objectives = np.asarray(Objectives, dtype=np.float64).reshape(len(Pars), self.NoObj)
+        added = 0
+        for par, f in zip(Pars, Objectives):
+            if not np.all(np.isfinite(f)):
+                continue
+            box = self.Box(f)
+            boxes = self.Box(self.Objectives)
+            if np.any(np.all(boxes <= box, axis=1) & np.any(boxes < box, axis=1)):
+                # dominated by the archive
+                continue
+
+            same = np.all(boxes == box, axis=1)
+            if np.any(same):
+                if self.Epsilon is None:
+                    continue
+                # one parameter set in a box, the one that dominates or is
+                # closer to the corner of the box
+                g = self.Objectives[same][0]
+                corner = box * self.Epsilon
+                if not (np.all(f <= g) and np.any(f < g)):
+                    if (np.all(g <= f) and np.any(g < f)) or np.sum((f - corner)**2) >= np.sum((g - corner)**2):
+                        continue
+
+            keep = ~same & ~(np.all(box <= boxes, axis=1) & np.any(box < boxes, axis=1))
+            self.Parameters = np.vstack([self.Parameters[keep], par])
+            self.Objectives = np.vstack([self.Objectives[keep], f])
+            added = added + 1
+
+        if added > 0:
+            self.Save()
+        return added
+
+
+    def Save(self):
+        """
+        ==============================================================
+            Save()
+        ==============================================================
+        Save method writes the archive to Path (nothing if Path is None)
+
+        Returns
+        -------
+        None.
+        """
+        if self.Path is None:
+            return
+
+        records = np.zeros(len(self.Parameters), dtype=ParetoArchive.Dtype(self.NoPar, self.NoObj))
+        records["Objectives"] = self.Objectives
+        records["Parameters"] = self.Parameters
+        tmp = self.Path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(ParetoArchive.Header)
+            np.array([ParetoArchive.Version, self.NoPar, self.NoObj], dtype="<i4").tofile(f)
+            records.tofile(f)
+        os.replace(tmp, self.Path)
+
+
+    @staticmethod
+    def Read(Path):
+        """
+        ==============================================================
+            Read(Path)
+        ==============================================================
+        Read method reads an archive file
+
+        Parameters
+        ----------
+        Path : [str]
+            path of the archive file.
+
+        Returns
+        -------
+        records : [structured array]
+            array with the fields "Objectives" (n_sets, n_obj) & "Parameters"
+            (n_sets, n_par).
+        """
+        with open(Path, "rb") as f:
+            assert f.read(8) == ParetoArchive.Header, Path + " is not a Pareto archive"
+            version, NoPar, NoObj = np.fromfile(f, dtype="<i4", count=3)
+        return np.fromfile(Path, dtype=ParetoArchive.Dtype(int(NoPar), int(NoObj)), offset=20)
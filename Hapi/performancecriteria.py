@@ -1,6 +1,5 @@
 import numpy as np
 import numbers
-from sklearn.metrics import r2_score
 
 
 def RMSE(Qobs,Qsim):
@@ -32,6 +31,70 @@ def RMSE(Qobs,Qsim):
 
     return rmse
 
+def _CheckWeightingScheme(WStype, N, alpha):
+    """
+    validate the weighting scheme of RMSEHF & RMSELF
+    """
+    # data type
+    assert type(WStype)== int, "Weighting scheme should be an integer number between 1 and 4 and you entered "+str(WStype)
+    assert isinstance(alpha, numbers.Number), "alpha should be a number and between 0 & 1"
+    assert isinstance(N, numbers.Number), "N should be a number and between 0 & 1"
+    # Input values
+    assert WStype >= 1 and WStype <= 4 , "Weighting scheme should be an integer number between 1 and 4 you have enters "+ str(WStype)
+    assert N >= 0 , "Weighting scheme Power should be positive number you have entered "+ str(N)
+    assert alpha > 0 and alpha <1, "alpha should be float number and between 0 & 1 you have entered "+ str(alpha)
+
+
+def _HFWeights(Qobs, Qmax, WStype, N, alpha):
+    """
+    weights of the high flow (RMSEHF) of the observed flow Qobs
+    """
+    h=Qobs/Qmax # rational Discharge
+
+    if WStype==1:
+         w = h**N        # rational Discharge power N
+    elif WStype==2: #-------------------------------------------------------------N is not in the equation
+        w=(h/alpha)**N
+        w[h>alpha] = 1
+    elif WStype==3:
+        w = np.zeros(np.shape(h))  # zero for h < alpha and 1 for h > alpha
+        w[h>alpha] = 1
+    elif WStype==4:
+        w = np.zeros(np.shape(h))  # zero for h < alpha and 1 for h > alpha
+        w[h>alpha] = 1
+    else:                      # sigmoid function
+        w=1/(1+np.exp(-10*h+5))
+
+    return w
+
+
+def _LFWeights(Qobs, Qmax, WStype, N, alpha):
+    """
+    weights of the low flow (RMSELF) of the observed flow Qobs
+    """
+    l= (Qmax-Qobs)/Qmax # rational Discharge power N
+
+    if WStype==1:
+         w = l**N
+    elif WStype==2: #------------------------------- N is not in the equation
+#        w=1-l*((0.50 - alpha)**N)
+        w=((1/(alpha**2))*(1-l)**2)-((2/alpha)*(1-l))+1
+        w[1-l> alpha]=0
+    elif WStype==3:   # the same like WStype 2
+#        w=1-l*((0.50 - alpha)**N)
+        w=((1/(alpha**2))*(1-l)**2)-((2/alpha)*(1-l))+1
+        w[1-l> alpha]=0
+    elif WStype==4:
+    #        w = 1-l*(0.50 - alpha)
+        w= 1 - ((1-l)/alpha)
+        w[1-l>alpha] = 0
+    else:                     # sigmoid function
+#        w=1/(1+np.exp(10*h-5))
+        w=1/(1+np.exp(-10*l+5))
+
+    return w
+
+
 def RMSEHF(Qobs,Qsim,WStype,N,alpha):
     """
     ====================
@@ -56,14 +119,7 @@ def RMSEHF(Qobs,Qsim,WStype,N,alpha):
         1- error values
     """
     # input data validation
-    # data type
-    assert type(WStype)== int, "Weighting scheme should be an integer number between 1 and 4 and you entered "+str(WStype)
-    assert isinstance(alpha, numbers.Number), "alpha should be a number and between 0 & 1"
-    assert isinstance(N, numbers.Number), "N should be a number and between 0 & 1"
-    # Input values
-    assert WStype >= 1 and WStype <= 4 , "Weighting scheme should be an integer number between 1 and 4 you have enters "+ str(WStype)
-    assert N >= 0 , "Weighting scheme Power should be positive number you have entered "+ str(N)
-    assert alpha > 0 and alpha <1, "alpha should be float number and between 0 & 1 you have entered "+ str(alpha)
+    _CheckWeightingScheme(WStype, N, alpha)
 
     # convert Qobs & Qsim into arrays
     Qobs=np.array(Qobs)
@@ -71,21 +127,7 @@ def RMSEHF(Qobs,Qsim,WStype,N,alpha):
 
 
     Qmax=max(Qobs)
-    h=Qobs/Qmax # rational Discharge
-
-    if WStype==1:
-         w = h**N        # rational Discharge power N
-    elif WStype==2: #-------------------------------------------------------------N is not in the equation
-        w=(h/alpha)**N
-        w[h>alpha] = 1
-    elif WStype==3:
-        w = np.zeros(np.size(h))  # zero for h < alpha and 1 for h > alpha
-        w[h>alpha] = 1
-    elif WStype==4:
-        w = np.zeros(np.size(h))  # zero for h < alpha and 1 for h > alpha
-        w[h>alpha] = 1
-    else:                      # sigmoid function
-        w=1/(1+np.exp(-10*h+5))
+    w = _HFWeights(Qobs, Qmax, WStype, N, alpha)
 
     a= (Qobs-Qsim)**2
     b=a*w
@@ -115,40 +157,15 @@ def RMSELF(Qobs,Qsim,WStype,N,alpha):
         1- error values
     """
     # input data validation
-    # data type
-    assert type(WStype)== int, "Weighting scheme should be an integer number between 1 and 4 and you entered "+str(WStype)
-    assert isinstance(alpha, numbers.Number), "alpha should be a number and between 0 & 1"
-    assert isinstance(N, numbers.Number), "N should be a number and between 0 & 1"
-    # Input values
-    assert WStype >= 1 and WStype <= 4 , "Weighting scheme should be an integer number between 1 and 4 you have enters "+ str(WStype)
-    assert N >= 0 , "Weighting scheme Power should be positive number you have entered "+ str(N)
-    assert alpha > 0 and alpha <1, "alpha should be float number and between 0 & 1 you have entered "+ str(alpha)
+    _CheckWeightingScheme(WStype, N, alpha)
 
     # convert Qobs & Qsim into arrays
     Qobs=np.array(Qobs)
     Qsim=np.array(Qsim)
 
 
-    Qmax=max(Qobs)  # rational Discharge power N
-    l= (Qmax-Qobs)/Qmax
-
-    if WStype==1:
-         w = l**N
-    elif WStype==2: #------------------------------- N is not in the equation
-#        w=1-l*((0.50 - alpha)**N)
-        w=((1/(alpha**2))*(1-l)**2)-((2/alpha)*(1-l))+1
-        w[1-l> alpha]=0
-    elif WStype==3:   # the same like WStype 2
-#        w=1-l*((0.50 - alpha)**N)
-        w=((1/(alpha**2))*(1-l)**2)-((2/alpha)*(1-l))+1
-        w[1-l> alpha]=0
-    elif WStype==4:
-    #        w = 1-l*(0.50 - alpha)
-        w= 1 - ((1-l)/alpha)
-        w[1-l>alpha] = 0
-    else:                     # sigmoid function
-#        w=1/(1+np.exp(10*h-5))
-        w=1/(1+np.exp(-10*l+5))
+    Qmax=max(Qobs)
+    w = _LFWeights(Qobs, Qmax, WStype, N, alpha)
 
     a= (Qobs-Qsim)**2
     b=a*w
@@ -370,6 +387,439 @@ def R2(Qobs,Qsim):
 
 	Since R² indicates the distance of points from the 1:1 line, it does depend
 	on the magnitude of the numbers (unlike r² peason correlation coefficient).
+
+	R² = 1 - sum((Qobs - Qsim)²) / sum((Qobs - mean(Qobs))²)
 	"""
+	Qobs = np.array(Qobs, dtype=np.float64)
+	Qsim = np.array(Qsim, dtype=np.float64)
+
+	return 1 - np.sum((Qobs - Qsim)**2) / np.sum((Qobs - Qobs.mean())**2)
+
+
+# metrics of FusedMetrics
+FusedNames = ["RMSE", "NSE", "NSEHF", "KGE", "WB", "PearsonCorre", "R2"]
+
+def FusedMetrics(Qobs, Qsim, Metrics=FusedNames):
+    """
+    ====================
+    FusedMetrics
+    ====================
+    FusedMetrics calculates RMSE, NSE, NSEHF, KGE, WB, PearsonCorre & R2 of
+    many time series together from the same sums, the means of the observed
+    and simulated discharge and then the sums of the squares & products of
+    the deviations are calculated once for all the metrics (the same values
+    as the functions of each metric), the time steps with no observation
+    (nan in Qobs) are skipped, float32 inputs are summed in float64 without
+    copying the inputs to float64.
+
+    inputs:
+    ----------
+        1- Qobs : [numpy ndarray]
+            observed flow, 1D (T) or 2D (n_series, T) array.
+        2- Qsim : [numpy ndarray]
+            simulated flow with the same shape as Qobs (or 1D (T) for all the
+            series of Qobs).
+        3- Metrics : [list]
+            names of the metrics. default is all
+            ["RMSE", "NSE", "NSEHF", "KGE", "WB", "PearsonCorre", "R2"]
+
+    Output:
+    ----------
+        1- metrics : [dict]
+            {name of the metric: value (float for 1D inputs or 1D array
+            (n_series) for 2D inputs)}
+    """
+    for name in Metrics:
+        assert name in FusedNames, name + " is not one of the metrics " + str(FusedNames)
+
+    Qobs = np.asarray(Qobs)
+    Qsim = np.asarray(Qsim)
+    single = Qobs.ndim == 1 and Qsim.ndim == 1
+    Qobs, Qsim = np.broadcast_arrays(np.atleast_2d(Qobs), np.atleast_2d(Qsim))
+
+    # observation gaps
+    observed = ~np.isnan(Qobs)
+    gaps = not observed.all()
+    if gaps:
+        Qobs = np.where(observed, Qobs, 0)
+        Qsim = np.where(observed, Qsim, 0)
+    n = observed.sum(axis=1)
+
+    # first pass: sums (means) of the observed & simulated flow
+    So = np.sum(Qobs, axis=1, dtype=np.float64)
+    Ss = np.sum(Qsim, axis=1, dtype=np.float64)
+    mo = (So / n)[:,None]
+    ms = (Ss / n)[:,None]
+
+    # second pass: sums of the squares & products of the deviations
+    do = Qobs - mo
+    ds = Qsim - ms
+    e = Qobs - Qsim
+    if gaps:
+        do = np.where(observed, do, 0)
+        ds = np.where(observed, ds, 0)
+    See = np.sum(e * e, axis=1, dtype=np.float64)
+    Soo = np.sum(do * do, axis=1, dtype=np.float64)
+    Sss = np.sum(ds * ds, axis=1, dtype=np.float64)
+    Sos = np.sum(do * ds, axis=1, dtype=np.float64)
+
+    metrics = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if "RMSE" in Metrics:
+            metrics["RMSE"] = np.sqrt(See / n)
+        if "NSE" in Metrics or "R2" in Metrics:
+            nse = 1 - See / Soo
+            if "NSE" in Metrics:
+                metrics["NSE"] = nse
+            if "R2" in Metrics:
+                metrics["R2"] = nse
+        if "NSEHF" in Metrics:
+            metrics["NSEHF"] = 1 - (np.sum(Qobs * e * e, axis=1, dtype=np.float64)
+                                    / np.sum(Qobs * do * do, axis=1, dtype=np.float64))
+        if "KGE" in Metrics or "PearsonCorre" in Metrics:
+            c = Sos / np.sqrt(Soo * Sss)
+            if "KGE" in Metrics:
+                alpha = np.sqrt(Sss / Soo)
+                beta = Ss / So
+                metrics["KGE"] = 1 - np.sqrt((c - 1)**2 + (alpha - 1)**2 + (beta - 1)**2)
+            if "PearsonCorre" in Metrics:
+                metrics["PearsonCorre"] = c**2
+        if "WB" in Metrics:
+            metrics["WB"] = 100 * (1 - np.abs(1 - Ss / So))
+
+    if single:
+        metrics = {name: float(value[0]) for name, value in metrics.items()}
+    return {name: metrics[name] for name in Metrics}
+
+
+class Accumulator():
+    """
+    ================================
+        Accumulator
+    ================================
+    Accumulator calculates RMSE, NSE, KGE, WB, PearsonCorre & R2 of a
+    simulation chunk by chunk without keeping the whole hydrographs, the
+    accumulator keeps the number of observations, the sums and the sums of
+    the squares & products of the deviations from the mean of the observed
+    and simulated flow, the chunks are added with the pairwise update of
+    Chan et al. (1979), so accumulators of different parts of the period
+    (e.g. calculated by different workers) can be merged in any order and the
+    final values are the same as the functions of each metric for the whole
+    period.
+
+    the time steps with no observation (nan in Qobs) are skipped like
+    FusedMetrics, and the accumulator can calculate the metrics of many
+    series together (chunks of shape (n_series, T)).
+
+    methods:
+        1-Update
+        2-Merge
+        3-Finalize
+    """
+
+    def __init__(self):
+        """
+        =============================================================================
+            Accumulator()
+        =============================================================================
+        the accumulator is empty until the first chunk is added (Update).
+        """
+        self.Single = None
+        self.n = 0
+        self.So = 0
+        self.Ss = 0
+        self.Soo = 0
+        self.Sss = 0
+        self.Sos = 0
+        self.See = 0
+
+    def Update(self, Qobs, Qsim):
+        """
+        =============================================================================
+            Update(Qobs, Qsim)
+        =============================================================================
+        Update adds a chunk of the observed and simulated flow.
+
+        Parameters
+        ----------
+        Qobs : [numpy ndarray]
+            observed flow, 1D (T) or 2D (n_series, T) array.
+        Qsim : [numpy ndarray]
+            simulated flow with the same shape as Qobs.
+
+        Returns
+        -------
+        self
+        """
+        single = np.ndim(Qobs) == 1 and np.ndim(Qsim) == 1
+        Qobs, Qsim = np.broadcast_arrays(np.atleast_2d(Qobs), np.atleast_2d(Qsim))
+        observed = ~np.isnan(Qobs)
+        Qobs = np.where(observed, Qobs, 0)
+        Qsim = np.where(observed, Qsim, 0)
+
+        chunk = Accumulator()
+        chunk.Single = single
+        chunk.n = observed.sum(axis=1)
+        chunk.So = np.sum(Qobs, axis=1, dtype=np.float64)
+        chunk.Ss = np.sum(Qsim, axis=1, dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            do = np.where(observed, Qobs - (chunk.So / chunk.n)[:,None], 0)
+            ds = np.where(observed, Qsim - (chunk.Ss / chunk.n)[:,None], 0)
+        e = Qobs - Qsim
+        chunk.Soo = np.sum(do * do, axis=1, dtype=np.float64)
+        chunk.Sss = np.sum(ds * ds, axis=1, dtype=np.float64)
+        chunk.Sos = np.sum(do * ds, axis=1, dtype=np.float64)
+        chunk.See = np.sum(e * e, axis=1, dtype=np.float64)
+
+        return self.Merge(chunk)
+
+    def Merge(self, other):
+        """
+        =============================================================================
+            Merge(other)
+        =============================================================================
+        Merge adds the chunks of another accumulator (of another part of the
+        period) to this accumulator.
+
+        Parameters
+        ----------
+        other : [Accumulator]
+            accumulator of the same series.
+
+        Returns
+        -------
+        self
+        """
+        if other.Single is None:
+            return self
+        if self.Single is None:
+            self.__dict__.update(other.__dict__)
+            return self
+        assert self.Single == other.Single, "the accumulators have different number of series"
+
+        n = self.n + other.n
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # difference between the means of the two parts
+            dmo = np.where(other.n > 0, other.So / other.n, 0) - np.where(self.n > 0, self.So / self.n, 0)
+            dms = np.where(other.n > 0, other.Ss / other.n, 0) - np.where(self.n > 0, self.Ss / self.n, 0)
+            f = np.where(n > 0, self.n * other.n / n, 0)
+
+        self.Soo = self.Soo + other.Soo + dmo * dmo * f
+        self.Sss = self.Sss + other.Sss + dms * dms * f
+        self.Sos = self.Sos + other.Sos + dmo * dms * f
+        self.So = self.So + other.So
+        self.Ss = self.Ss + other.Ss
+        self.See = self.See + other.See
+        self.n = n
+
+        return self
+
+    def Finalize(self, Metrics=["RMSE", "NSE", "KGE", "WB", "PearsonCorre", "R2"]):
+        """
+        =============================================================================
+            Finalize(Metrics)
+        =============================================================================
+        Finalize calculates the metrics of the chunks added so far, the
+        accumulator is not changed so more chunks can be added afterwards.
+
+        Parameters
+        ----------
+        Metrics : [list], optional
+            names of the metrics. The default is
+            ["RMSE", "NSE", "KGE", "WB", "PearsonCorre", "R2"].
+
+        Returns
+        -------
+        metrics : [dict]
+            {name of the metric: value (float for 1D chunks or 1D array
+            (n_series) for 2D chunks)}
+        """
+        names = ["RMSE", "NSE", "KGE", "WB", "PearsonCorre", "R2"]
+        for name in Metrics:
+            assert name in names, name + " is not one of the metrics " + str(names)
+        assert self.Single is not None, "no chunk has been added to the accumulator"
+
+        metrics = {}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if "RMSE" in Metrics:
+                metrics["RMSE"] = np.sqrt(self.See / self.n)
+            if "NSE" in Metrics:
+                metrics["NSE"] = 1 - self.See / self.Soo
+            if "R2" in Metrics:
+                metrics["R2"] = 1 - self.See / self.Soo
+            c = self.Sos / np.sqrt(self.Soo * self.Sss)
+            if "KGE" in Metrics:
+                alpha = np.sqrt(self.Sss / self.Soo)
+                beta = self.Ss / self.So
+                metrics["KGE"] = 1 - np.sqrt((c - 1)**2 + (alpha - 1)**2 + (beta - 1)**2)
+            if "PearsonCorre" in Metrics:
+                metrics["PearsonCorre"] = c**2
+            if "WB" in Metrics:
+                metrics["WB"] = 100 * (1 - np.abs(1 - self.Ss / self.So))
+
+        if self.Single:
+            metrics = {name: float(value[0]) for name, value in metrics.items()}
+        return {name: metrics[name] for name in Metrics}
+
+
+class WeightedAccumulator():
+    """
+    ================================
+        WeightedAccumulator
+    ================================
+    WeightedAccumulator calculates the weighted RMSE for high flow (RMSEHF)
+    or low flow (RMSELF) chunk by chunk, it keeps the number of observations
+    and the sum of the weighted squared errors, so accumulators of different
+    parts of the period can be merged and the final value is the same as
+    RMSEHF/RMSELF for the whole period.
+
+    the weights depend on the maximum observed flow of the whole period
+    (Qmax), the observed flow is known before the simulation so Qmax should
+    be given, only for RMSEHF with weighting scheme 1 (w = (Qobs/Qmax)**N)
+    Qmax can be left out, the weights are then calculated from the maximum
+    observed flow of the chunks added so far.
+
+    methods:
+        1-Update
+        2-Merge
+        3-Finalize
+    """
 
-	return  r2_score(np.array(Qobs),np.array(Qsim))
\ No newline at end of file
+    def __init__(self, Flow, WStype, N, alpha, Qmax=None):
+        """
+        =============================================================================
+            WeightedAccumulator(Flow, WStype, N, alpha, Qmax=None)
+        =============================================================================
+        Parameters
+        ----------
+        Flow : [str]
+            "HF" for RMSEHF or "LF" for RMSELF.
+        WStype : [integer]
+            Weighting scheme (1,2,3,4).
+        N : [numeric]
+            power.
+        alpha : [numeric]
+            Upper limit for low flow weight.
+        Qmax : [numeric/array], optional
+            maximum observed flow of the whole period (one value for each
+            series for 2D chunks). The default is None.
+        """
+        assert Flow in ["HF", "LF"], "Flow should be 'HF' or 'LF'"
+        _CheckWeightingScheme(WStype, N, alpha)
+        assert Qmax is not None or (Flow == "HF" and WStype == 1), \
+            "Qmax of the whole period is needed for the weighting scheme " + str(WStype) + " of RMSE" + Flow
+
+        self.Flow = Flow
+        self.WStype = WStype
+        self.N = N
+        self.alpha = alpha
+        self.Qmax = Qmax
+        self.Single = None
+        self.n = 0
+        # sum of the weighted squared errors (sum of Qobs**N * error**2 if
+        # Qmax is not known)
+        self.Swee = 0
+        # maximum observed flow of the chunks
+        self.Max = -np.inf
+
+    def Update(self, Qobs, Qsim):
+        """
+        =============================================================================
+            Update(Qobs, Qsim)
+        =============================================================================
+        Update adds a chunk of the observed and simulated flow.
+
+        Parameters
+        ----------
+        Qobs : [numpy ndarray]
+            observed flow, 1D (T) or 2D (n_series, T) array.
+        Qsim : [numpy ndarray]
+            simulated flow with the same shape as Qobs.
+
+        Returns
+        -------
+        self
+        """
+        single = np.ndim(Qobs) == 1 and np.ndim(Qsim) == 1
+        Qobs, Qsim = np.broadcast_arrays(np.atleast_2d(Qobs), np.atleast_2d(Qsim))
+        observed = ~np.isnan(Qobs)
+        Qobs = np.where(observed, Qobs, 0).astype(np.float64)
+        Qsim = np.where(observed, Qsim, 0).astype(np.float64)
+
+        if self.Qmax is None:
+            w = Qobs**self.N
+        else:
+            Qmax = np.reshape(np.asarray(self.Qmax, dtype=np.float64), (-1, 1))
+            Qmax = np.broadcast_to(Qmax, Qobs.shape)
+            if self.Flow == "HF":
+                w = _HFWeights(Qobs, Qmax, self.WStype, self.N, self.alpha)
+            else:
+                w = _LFWeights(Qobs, Qmax, self.WStype, self.N, self.alpha)
+        w = np.where(observed, w, 0)
+
+        chunk = WeightedAccumulator(self.Flow, self.WStype, self.N, self.alpha, self.Qmax)
+        chunk.Single = single
+        chunk.n = observed.sum(axis=1)
+        chunk.Swee = np.sum(w * (Qobs - Qsim)**2, axis=1)
+        chunk.Max = np.max(np.where(observed, Qobs, -np.inf), axis=1)
+
+        return self.Merge(chunk)
+
+    def Merge(self, other):
+        """
+        =============================================================================
+            Merge(other)
+        =============================================================================
+        Merge adds the chunks of another accumulator (of another part of the
+        period) to this accumulator.
+
+        Parameters
+        ----------
+        other : [WeightedAccumulator]
+            accumulator of the same series and weighting scheme.
+
+        Returns
+        -------
+        self
+        """
+        assert (other.Flow, other.WStype, other.N, other.alpha) == (self.Flow, self.WStype, self.N, self.alpha), \
+            "the accumulators have different weighting schemes"
+        # the weights of the two parts are relative to the same Qmax
+        assert (self.Qmax is None) == (other.Qmax is None) and (self.Qmax is None or
+            np.array_equal(np.asarray(self.Qmax), np.asarray(other.Qmax))), \
+            "the accumulators have different Qmax"
+        if other.Single is None:
+            return self
+        if self.Single is None:
+            self.Single = other.Single
+        assert self.Single == other.Single, "the accumulators have different number of series"
+
+        self.n = self.n + other.n
+        self.Swee = self.Swee + other.Swee
+        self.Max = np.maximum(self.Max, other.Max)
+
+        return self
+
+    def Finalize(self):
+        """
+        =============================================================================
+            Finalize()
+        =============================================================================
+        Finalize calculates RMSEHF/RMSELF of the chunks added so far, the
+        accumulator is not changed so more chunks can be added afterwards.
+
+        Returns
+        -------
+        error : [float/array]
+            float for 1D chunks or 1D array (n_series) for 2D chunks.
+        """
+        assert self.Single is not None, "no chunk has been added to the accumulator"
+        Swee = self.Swee
+        if self.Qmax is None:
+            Swee = Swee / self.Max**self.N
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            error = np.sqrt(Swee / self.n)
+        if self.Single:
+            return float(error[0])
+        return error
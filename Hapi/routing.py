@@ -11,6 +11,7 @@ Created on Sun Apr 29 17:42:04 2018
 
 #library
 import numpy as np
+from functools import lru_cache
 
 
 
@@ -24,12 +25,18 @@ class Routing():
     Methods
     1- Muskingum
     2- Muskingum_V
-    3- TriangularRouting1
+    3- MuskingumBatch
+    4- TriangularRouting1
         functions :
         1- CalculateWeights
-    4- TriangularRouting2
+    5- TriangularRouting2
         functions
         1- Tf
+    6- TriangularRoutingBatch
+        functions
+        1- MaxbasWeights
+    7- MuskingumResponse
+    8- MuskingumCoefficients
     """
     def __init__(self):
         pass
@@ -137,6 +144,205 @@ class Routing():
 
         return O
 
+    @staticmethod
+    def MuskingumBatch(inflow,Qinitial=None,k=None,x=None,dt=None,nonnegative=True,decimals=None,
+                       coefficients=None):
+        """
+        ===========================================================
+         MuskingumBatch(inflow,Qinitial,k,x,dt,nonnegative,decimals,coefficients)
+        ===========================================================
+        Batched version of Muskingum, routes many hydrographs (reaches) in one
+        call each with its own k & x, the reaches are advanced together so the
+        only loop is the time loop of the c3 recursion, the recursion is
+        accumulated in float64 and the outflow has the type of the inflow
+
+        inputs:
+        ----------
+            1-inflow:
+                [numpy array] 2D array (n_reaches, n_steps) of the inflow
+                hydrographs (a 1D time series is routed as one reach)
+            2-Qinitial:
+                [numeric/numpy array] initial value for outflow of each reach,
+                default is the first value of the inflow (inflow[:,0])
+            3-k:
+                [numeric/numpy array] travelling time (hours) of each reach,
+                needed if the coefficients are not given
+            4-x:
+                [numeric/numpy array] surface nonlinearity coefficient (0,0.5)
+                of each reach, needed if the coefficients are not given
+            5-dt:
+                [numeric] delta t, needed if the coefficients are not given
+            6-nonnegative:
+                [bool] if True the c3 term is not added when it makes the
+                outflow negative (same as Muskingum_V), if False the recursion
+                is applied to all time steps (same as Muskingum). default is True
+            7-decimals:
+                [integer] number of decimals to round the outflow to, Muskingum
+                rounds to 4 decimals. default is None (no rounding)
+            8-coefficients:
+                [numpy array] 2D array (n_reaches, 3) of the coefficients
+                [c1, c2, c3] already calculated by MuskingumCoefficients, if
+                given k, x & dt are not used. default is None
+
+        Outputs:
+        ----------
+            1-outflow:
+                [numpy array] 2D array (n_reaches, n_steps) of routed hydrographs
+
+        Examples:
+        ----------
+        # same as Muskingum_V for each cell
+        q_routed = Routing.MuskingumBatch(q_uz,q_uz[:,0],pars[:,10],pars[:,11],1)
+        # same as Muskingum for each cell
+        q_routed = Routing.MuskingumBatch(q_uz,q_uz[:,0],pars[:,10],pars[:,11],1,
+                                          nonnegative=False, decimals=4)
+       """
+        inflow = np.asarray(inflow)
+        single = inflow.ndim == 1
+        if single:
+            inflow = inflow[np.newaxis,:]
+
+        assert inflow.ndim == 2, "inflow should be a 2D array (n_reaches, n_steps)"
+
+        if coefficients is None:
+            assert k is not None and x is not None and dt is not None, \
+                "either the coefficients or k, x & dt should be given"
+            coefficients = Routing.MuskingumCoefficients(k, x, dt)
+        else:
+            coefficients = np.asarray(coefficients, dtype=np.float64)
+            assert coefficients.shape[-1] == 3, "coefficients should be (n_reaches, 3) array of c1, c2, c3"
+
+        c1 = coefficients[...,0]
+        c2 = coefficients[...,1]
+        c3 = coefficients[...,2]
+
+        # time is the first axis to make each step a contiguous row
+        I = inflow.T.astype(np.float64)
+        O = np.zeros_like(I)
+        if Qinitial is None:
+            O[0] = I[0]
+        else:
+            O[0] = Qinitial
+        O[1:] = c1 * I[1:] + c2 * I[0:-1]
+
+        if nonnegative:
+            for i in range(1,len(I)):
+                Oi = O[i] + c3 * O[i-1]
+                O[i] = np.where(Oi < 0, O[i], Oi)
+        else:
+            for i in range(1,len(I)):
+                O[i] = O[i] + c3 * O[i-1]
+
+        if decimals is not None:
+            O = np.round(O,decimals)
+
+        outflow = np.ascontiguousarray(O.T, dtype=np.result_type(inflow.dtype, np.float32))
+        if single:
+            outflow = outflow[0]
+
+        return outflow
+
+    @staticmethod
+    def MuskingumResponse(k, x, dt, length):
+        """
+        ===========================================================
+         MuskingumResponse(k, x, dt, length)
+        ===========================================================
+        MuskingumResponse calculates the impulse response of the Muskingum
+        recursion (MuskingumBatch with nonnegative=False) of each reach, as the
+        outflow at the first time step is the inflow (Qinitial = inflow[0]),
+        the response to the inflow at the first time step (h0) differs from
+        the response to the inflow at any other time step (h)
+
+            outflow[t] = sum(h[t-s] * inflow[s]) + (h0[t] - h[t]) * inflow[0]
+
+        inputs:
+        ----------
+            1-k:
+                [numeric/numpy array] travelling time (hours) of each reach
+            2-x:
+                [numeric/numpy array] surface nonlinearity coefficient (0,0.5)
+                of each reach
+            3-dt:
+                [numeric] delta t
+            4-length:
+                [integer] number of time steps of the responses
+
+        Outputs:
+        ----------
+            1-h:
+                [numpy array] 2D array (n_reaches, length) response to a unit
+                inflow at time step s >= 1 (shifted by s)
+            2-h0:
+                [numpy array] 2D array (n_reaches, length) response to a unit
+                inflow at the first time step
+
+        Examples:
+        ----------
+        h, h0 = Routing.MuskingumResponse(pars[:,10], pars[:,11], 1, 100)
+       """
+        k = np.atleast_1d(np.asarray(k, dtype=np.float64))
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+
+        c1 = (dt-2*k*x)/(2*k*(1-x)+dt)
+        c2 = (dt+2*k*x)/(2*k*(1-x)+dt)
+        c3 = (2*k*(1-x)-dt)/(2*k*(1-x)+dt)
+
+        # the recession of the outflow after the inflow pulse is c3**(t-1)
+        recession = c3[:,np.newaxis] ** np.arange(length-1)[np.newaxis,:]
+
+        h = np.zeros((len(k), length))
+        h[:,0] = c1
+        h[:,1:] = (c2 + c3*c1)[:,np.newaxis] * recession
+
+        h0 = np.zeros((len(k), length))
+        h0[:,0] = 1
+        h0[:,1:] = (c2 + c3)[:,np.newaxis] * recession
+
+        return h, h0
+
+    @staticmethod
+    def MuskingumCoefficients(k, x, dt):
+        """
+        ===========================================================
+         MuskingumCoefficients(k, x, dt)
+        ===========================================================
+        MuskingumCoefficients calculates the coefficients of the Muskingum
+        recursion of each reach, the coefficients depend only on k, x & dt so
+        they can be calculated once for each parameter set and reused for all
+        the routing calls (MuskingumBatch(coefficients=...))
+
+            outflow[t] = c1 * inflow[t] + c2 * inflow[t-1] + c3 * outflow[t-1]
+
+        inputs:
+        ----------
+            1-k:
+                [numeric/numpy array] travelling time (hours) of each reach
+            2-x:
+                [numeric/numpy array] surface nonlinearity coefficient (0,0.5)
+                of each reach
+            3-dt:
+                [numeric] delta t
+
+        Outputs:
+        ----------
+            1-coefficients:
+                [numpy array] array (k.shape + (3,)) of c1, c2 & c3
+
+        Examples:
+        ----------
+        coef = Routing.MuskingumCoefficients(pars[:,10], pars[:,11], 1)
+        q_routed = Routing.MuskingumBatch(q_uz, q_uz[:,0], coefficients=coef)
+       """
+        k = np.asarray(k, dtype=np.float64)
+        x = np.asarray(x, dtype=np.float64)
+
+        c1 = (dt-2*k*x)/(2*k*(1-x)+dt)
+        c2 = (dt+2*k*x)/(2*k*(1-x)+dt)
+        c3 = (2*k*(1-x)-dt)/(2*k*(1-x)+dt)
+
+        return np.stack([c1, c2, c3], axis=-1)
+
     @staticmethod
     def Tf(maxbas):
         """
@@ -336,42 +542,121 @@ class Routing():
         """
 
         # CALCULATE MAXBAS WEIGHTS
-        maxbasW = Routing.CalculateWeights(MAXBAS);
-
-        Qw = np.ones((len(Q),len(maxbasW)))
-        # Calculate the matrix discharge
-        for i in range(len(Q)): # 0 to 10
-            for k in range(len(maxbasW)):  # 0 to 4
-                Qw[i,k] = maxbasW[k]*Q[i]
-
-        def mm(A,s):
-            tot=[]
-            for o in range(np.shape(A)[1]): # columns
-                for t in range(np.shape(A)[0]): # rows
-                    tot.append(A[t,o])
-            Su=tot[s:-1:s]
-            return Su
-
-        # Calculate routing
-        j = 0
-        Qout = np.ones(shape=(len(Q)))
-
-        for i in range(len(Q) ):
-            if i == 0:
-                Qout[i] = Qw[i,i]
-            elif i < len(maxbasW)-1:
-                A = Qw[0:i+1,:]
-                s = len(A)-1    # len(A) is the no of rows or use int(np.shape(A)[0])
-                Su= mm(A,s)
-
-                Qout[i] = sum(Su[0:i+1])
-            else:
-                A = Qw[j:i+1,:]
-                s = len(A)-1
-                Su = mm(A,s)
-                Qout[i] = sum(Su)
-                j = j + 1
+        maxbasW = Routing.MaxbasWeights(MAXBAS)
+
+        # Calculate routing (the first len(Q) values of the convolution)
+        Qout = np.convolve(np.asarray(Q, dtype=np.float64), maxbasW)[:len(Q)]
 
-    #        del A ,s, Su
+        return Qout #,maxbasW
 
-        return Qout #,maxbasW
\ No newline at end of file
+
+    @staticmethod
+    def MaxbasWeights(MAXBAS, method=1):
+        """
+        ======================================================
+            MaxbasWeights(MAXBAS, method=1)
+        ======================================================
+        MaxbasWeights returns the weights of the triangular routing function,
+        the weights of the last MaxbasCacheSize MAXBAS values used are kept
+        so they are calculated only once for all the cells with the same value
+
+        Inputs:
+        ----------
+            1-MAXBAS:
+                [numeric] MAXBAS parameter
+            2-method:
+                [integer] 1 for the weights of TriangularRouting1 (CalculateWeights)
+                and 2 for the weights of TriangularRouting2 (Tf). default is 1
+
+        Outputs:
+        ----------
+            1-weights:
+                [numpy array] read only array of the weights
+
+        Example:
+        ----------
+            maxbasW = Routing.MaxbasWeights(5)
+        """
+        assert method in [1,2], "method should be 1 (CalculateWeights) or 2 (Tf)"
+
+        if method == 2:
+            assert MAXBAS >= 1, 'Maxbas value has to be larger than 1'
+            # Get integer part of maxbas
+            MAXBAS = int(round(MAXBAS,0))
+
+        return _MaxbasWeights(method, MAXBAS)
+
+
+    @staticmethod
+    def TriangularRoutingBatch(Q, MAXBAS, method=1):
+        """
+        ====================================================
+             TriangularRoutingBatch(Q, MAXBAS, method=1)
+        ====================================================
+        TriangularRoutingBatch routes many hydrographs (e.g. the quz cube of
+        all the cells) in one call, each with its own MAXBAS, the hydrographs
+        with the same MAXBAS value are convolved with the weights together
+
+        Inputs:
+        ----------
+            1-Q:
+                [numpy array] array of hydrographs with time as the last axis
+                (n_cells, n_steps) or (rows, cols, n_steps)
+            2-MAXBAS:
+                [numeric/numpy array] MAXBAS of each hydrograph with the
+                shape of Q without the time axis
+            3-method:
+                [integer] 1 to route like TriangularRouting1 and 2 to route
+                like TriangularRouting2. default is 1
+
+        Outputs:
+        ----------
+            1-Qout:
+                [numpy array] routed hydrographs with the same shape as Q
+
+        Example:
+        ----------
+            rows, cols = np.where(Model.FlowAccArr != Model.NoDataValue)
+            Model.quz[rows,cols,:] = Routing.TriangularRoutingBatch(Model.quz[rows,cols,:],
+                                                                    Model.Parameters[rows,cols,-1])
+        """
+        Q = np.asarray(Q)
+        shape = Q.shape
+        n_steps = shape[-1]
+        # flatten all the hydrographs to (n_hydrographs, n_steps)
+        Q = Q.reshape(-1, n_steps)
+        if method == 2:
+            # TriangularRouting2 convert the discharge to float32 before routing
+            Q = np.float32(Q)
+
+        MAXBAS = np.broadcast_to(np.asarray(MAXBAS, dtype=np.float64), shape[:-1]).reshape(-1)
+
+        Qout = np.zeros(Q.shape, dtype=np.float64)
+        for val in np.unique(MAXBAS):
+            group = np.where(MAXBAS == val)[0]
+            weights = Routing.MaxbasWeights(val, method)
+            q = Q[group,:]
+            qout = np.zeros(q.shape, dtype=np.float64)
+            # shift the hydrographs by i time steps and add them with the weight
+            for i in range(min(len(weights), n_steps)):
+                qout[:,i:] += weights[i] * q[:,:n_steps-i]
+            Qout[group,:] = qout
+
+        return Qout.reshape(shape)
+
+
+# number of MAXBAS values of which the weights are kept (MAXBAS is a
+# calibrated parameter so every parameter set brings new values)
+MaxbasCacheSize = 1024
+
+@lru_cache(maxsize=MaxbasCacheSize)
+def _MaxbasWeights(method, MAXBAS):
+    """
+    weights of one MAXBAS value (Routing.MaxbasWeights)
+    """
+    if method == 1:
+        weights = np.array(Routing.CalculateWeights(MAXBAS), dtype=np.float64)
+    else:
+        weights = np.array(Routing.Tf(MAXBAS), dtype=np.float64)
+    weights.flags.writeable = False
+    return weights
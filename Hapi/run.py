@@ -34,6 +34,7 @@ class Run(Catchment):
         3- RunFW1
         4- RunFW1withLake
         5- RunLumped
+        6- RunLumpedEnsemble
     """
 
     def __init__(self):
@@ -103,9 +104,13 @@ class Run(Catchment):
         assert fd_rows == self.rows and fd_cols == self.cols, "all input data should have the same number of rows"
 
         # input dimensions
-        assert np.shape(self.Prec)[0] == self.rows and np.shape(self.ET)[0] == self.rows and np.shape(self.Temp)[0] == self.rows and np.shape(self.Parameters)[0] == self.rows, "all input data should have the same number of rows"
-        assert np.shape(self.Prec)[1] == self.cols and np.shape(self.ET)[1] == self.cols and np.shape(self.Temp)[1] == self.cols and np.shape(self.Parameters)[1] == self.cols, "all input data should have the same number of columns"
-        assert np.shape(self.Prec)[2] == np.shape(self.ET)[2] and np.shape(self.Temp)[2], "all meteorological input data should have the same length"
+        if not hasattr(self, "PrecStore"):
+            assert np.shape(self.Prec)[0] == self.rows and np.shape(self.ET)[0] == self.rows and np.shape(self.Temp)[0] == self.rows and np.shape(self.Parameters)[0] == self.rows, "all input data should have the same number of rows"
+            assert np.shape(self.Prec)[1] == self.cols and np.shape(self.ET)[1] == self.cols and np.shape(self.Temp)[1] == self.cols and np.shape(self.Parameters)[1] == self.cols, "all input data should have the same number of columns"
+            assert np.shape(self.Prec)[2] == np.shape(self.ET)[2] and np.shape(self.Temp)[2], "all meteorological input data should have the same length"
+        else:
+            # forcing is read from the memory-mapped store (ReadForcingStore)
+            assert self.PrecStore.shape[0] == len(self.StoreCells), "the forcing store is not complete"
 
         #run the model
         Wrapper.HapiModel(self)
@@ -242,9 +247,13 @@ class Run(Catchment):
         # input data validation
 
         # input dimensions
-        assert np.shape(self.Prec)[0] == self.rows and np.shape(self.ET)[0] == self.rows and np.shape(self.Temp)[0] == self.rows and np.shape(self.Parameters)[0] == self.rows, "all input data should have the same number of rows"
-        assert np.shape(self.Prec)[1] == self.cols and np.shape(self.ET)[1] == self.cols and np.shape(self.Temp)[1] == self.cols and np.shape(self.Parameters)[1] == self.cols, "all input data should have the same number of columns"
-        assert np.shape(self.Prec)[2] == np.shape(self.ET)[2] and np.shape(self.Temp)[2], "all meteorological input data should have the same length"
+        if not hasattr(self, "PrecStore"):
+            assert np.shape(self.Prec)[0] == self.rows and np.shape(self.ET)[0] == self.rows and np.shape(self.Temp)[0] == self.rows and np.shape(self.Parameters)[0] == self.rows, "all input data should have the same number of rows"
+            assert np.shape(self.Prec)[1] == self.cols and np.shape(self.ET)[1] == self.cols and np.shape(self.Temp)[1] == self.cols and np.shape(self.Parameters)[1] == self.cols, "all input data should have the same number of columns"
+            assert np.shape(self.Prec)[2] == np.shape(self.ET)[2] and np.shape(self.Temp)[2], "all meteorological input data should have the same length"
+        else:
+            # forcing is read from the memory-mapped store (ReadForcingStore)
+            assert self.PrecStore.shape[0] == len(self.StoreCells), "the forcing store is not complete"
 
         #run the model
         Wrapper.FW1(self)
@@ -372,3 +381,41 @@ class Run(Catchment):
         self.Qsim = Qsim[:]
 
         print("Model Run has finished")
+
+    def RunLumpedEnsemble(self, Parameters, Route=0, RoutingFn=[], States=False,
+                          BatchSize=None):
+        """
+        =============================================================
+            RunLumpedEnsemble(Parameters, Route=0, RoutingFn=[], States=False, BatchSize=None)
+        =============================================================
+        this function runs lumped conceptual model for many parameter sets in
+        one call (see Wrapper.LumpedEnsemble)
+
+        Inputs:
+        ----------
+            1-Parameters:
+                [numpy array] 2D array (n_sets, n_parameters) each row is a
+                parameter set
+            2-Route:
+                [0 or 1] to decide wether t route the generated discharge hydrograph or not
+            3-RoutingFn:
+                [function] function to route the dischrge hydrograph.
+            4-States:
+                [bool] True to keep the state variables of all the sets.
+                default is False
+            5-BatchSize:
+                [integer] number of parameter sets to run together.
+                default is None (all the sets together)
+
+        Outputs:
+        ----------
+            1-QsimEnsemble:
+                [numpy array] 2D array (n_sets, n_steps) of the calculated
+                discharge of each parameter set
+            2-StatesEnsemble:
+                [numpy array] 3D array (n_sets, n_steps+1, 5) of the state
+                variables (only if States is True)
+        """
+        Wrapper.LumpedEnsemble(self, Parameters, Route, RoutingFn, States, BatchSize)
+
+        print("Model Run has finished")
@@ -4,7 +4,11 @@ Created on Mon Mar 29 21:32:29 2021
 
 @author: mofarrag
 """
+import os
+import hashlib
 import numpy as np
+from functools import partial
+from scipy.stats import qmc
 import matplotlib.pyplot as plt
 import Hapi.visualizer as V
 Vis = V.Visualize(1)
@@ -16,9 +20,22 @@ class SensitivityAnalysis():
     ==============================
     SensitivityAnalysis class
 
+    the one-at-a-time (OAT), the variance based (SobolIndices) and the
+    elementary effects (Morris) methods build all the parameter sets first
+    and evaluate them in batches (EvaluateSamples) serially, by an executor
+    (process pool) or by a vectorized function, the metric values of the
+    completed batches can be saved to a checkpoint file to resume a killed
+    analysis
+
     Methods
-        1- OAT
-        2- Sobol
+        1- DesignMatrix
+        2- EvaluateSamples
+        3- OAT
+        4- SaltelliSample
+        5- SobolIndices
+        6- MorrisSample
+        7- Morris
+        8- Sobol
 
     """
     def __init__(self, Parameter, LB, UB, Function, Positions=[], NoValues=5, Type=1):
@@ -77,76 +94,464 @@ class SensitivityAnalysis():
             self.Positions = Positions
 
 
-    def OAT(self, *args,**kwargs):
+    def DesignMatrix(self):
         """
         ======================================================================
-           OAT(Parameter, LB, UB, Function,*args,**kwargs)
+           DesignMatrix()
+        ======================================================================
+        DesignMatrix method builds all the parameter sets of the one-at-a-time
+        sensitivity analysis, for each parameter (Positions) NoValues values
+        between the bounds and the value of the parameter (sorted) while the
+        other parameters keep their values
+
+        Returns
+        -------
+        Design : [array attribute]
+            2D array (n_runs, n_parameters) of the parameter sets.
+        DesignPositions : [array attribute]
+            1D array (n_runs) position of the changed parameter of each run.
+        """
+        values = np.asarray(self.Parameter['value'], dtype=np.float64)
+        Design = []
+        DesignPositions = []
+        for i in range(self.NoPar):
+            k = self.Positions[i]
+            # NoValues values between the high and low parameter bounds
+            rand_value = np.linspace(self.LB[k],self.UB[k],self.NoValues)
+            # add the value of the calibrated parameter and sort the values
+            rand_value = np.sort(np.append(rand_value,values[k]))
+
+            runs = np.repeat(values[None,:], len(rand_value), axis=0)
+            runs[:,k] = rand_value
+            Design.append(runs)
+            DesignPositions.append(np.full(len(rand_value), k))
+
+        self.Design = np.vstack(Design)
+        self.DesignPositions = np.concatenate(DesignPositions)
+
+
+    def EvaluateSamples(self, Samples, args=(), kwargs={}, Executor=None,
+                        Vectorized=False, BatchSize=None, Checkpoint=None):
+        """
+        ======================================================================
+           EvaluateSamples(Samples, args, kwargs, Executor, Vectorized,
+                           BatchSize, Checkpoint)
+        ======================================================================
+        EvaluateSamples method evaluates the Function with each parameter set
+        in batches of BatchSize parameter sets, serially, by an Executor or by
+        one call of a vectorized Function for each batch, if a Checkpoint
+        file is given the metric values are saved after each batch and the
+        batches that are already in the checkpoint (of the same Samples) are
+        not evaluated again.
+
+        Parameters
+        ----------
+        Samples : [array]
+            2D array (n_runs, n_parameters) of the parameter sets.
+        args : [tuple], optional
+            arguments of the Function. The default is ().
+        kwargs : [dict], optional
+            keyword arguments of the Function. The default is {}.
+        Executor : [object], optional
+            executor with a map(function, iterable) method that keeps the
+            order (e.g. multiprocessing.Pool), the Function & its arguments
+            have to be picklable for a process pool. The default is None (serial).
+        Vectorized : [bool], optional
+            True if the Function takes a 2D array of parameter sets and
+            returns a 1D array of the metric values (Type=1) or the metric
+            values and a list of the calculated values (Type=2). The default is False.
+        BatchSize : [int], optional
+            number of parameter sets in each batch. The default is None (one batch).
+        Checkpoint : [str], optional
+            path of the checkpoint file (.npz) of the metric values (only
+            for Type=1). The default is None.
+
+        Returns
+        -------
+        metrics : [array]
+            1D array (n_runs) of the metric values.
+        calculated : [list]
+            calculated values of each run (Type=2), None for Type=1.
+        """
+        Samples = np.atleast_2d(np.asarray(Samples, dtype=np.float64))
+        if BatchSize is None:
+            BatchSize = max(len(Samples), 1)
+        message = """the Given Function returns more than one value,
+                    the function should return only one value for Type=1, or
+                    two values for Type=2.
+                    """
+
+        metrics = np.full(len(Samples), np.nan)
+        done = np.zeros(len(Samples), dtype=bool)
+        calculated = None if self.Type == 1 else [None]*len(Samples)
+        if Checkpoint is not None:
+            assert self.Type == 1, "the checkpoint keeps only the metric values, use Type=1"
+            key = hashlib.sha1(np.ascontiguousarray(Samples).tobytes()).hexdigest()
+            if os.path.exists(Checkpoint):
+                with np.load(Checkpoint) as saved:
+                    assert str(saved["Key"]) == key, Checkpoint + " was saved for different parameter sets"
+                    metrics[...] = saved["Metrics"]
+                    done[...] = saved["Done"]
+
+        run = partial(_Run, self.Function, args, kwargs)
+        for start in range(0, len(Samples), BatchSize):
+            batch = slice(start, start + BatchSize)
+            if done[batch].all():
+                continue
+
+            if Vectorized:
+                results = self.Function(Samples[batch], *args, **kwargs)
+                if self.Type == 1:
+                    values = results
+                else:
+                    values, calculated[batch] = results
+            else:
+                if Executor is None:
+                    results = list(map(run, Samples[batch]))
+                else:
+                    results = list(Executor.map(run, Samples[batch]))
+                if self.Type == 1:
+                    values = results
+                else:
+                    values = [result[0] for result in results]
+                    calculated[batch] = [result[1] for result in results]
+
+            values = np.asarray(values, dtype=object)
+            assert values.shape == (len(Samples[batch]),), message
+            metrics[batch] = values.astype(np.float64)
+            done[batch] = True
+
+            if Checkpoint is not None:
+                tmp = Checkpoint + ".tmp"
+                with open(tmp, "wb") as f:
+                    np.savez(f, Key=key, Metrics=metrics, Done=done)
+                os.replace(tmp, Checkpoint)
+
+        return metrics, calculated
+
+
+    def OAT(self, *args, Executor=None, Vectorized=False, BatchSize=None,
+            Checkpoint=None, **kwargs):
+        """
+        ======================================================================
+           OAT(*args, Executor=None, Vectorized=False, BatchSize=None,
+               Checkpoint=None, **kwargs)
         ======================================================================
         OAT one-at-a-time sensitivity analysis.
 
+        all the parameter sets are built first (DesignMatrix) and evaluated
+        together (EvaluateSamples), serially, by an Executor (e.g.
+        multiprocessing.Pool or concurrent.futures.ProcessPoolExecutor,
+        anything with a map method that keeps the order) or by one call of a
+        vectorized Function, a parameter set that appears more than once
+        (the value of the parameter itself) is evaluated once.
+
         Parameters
         ----------
-        Parameter : [dataframe]
-            parameters dataframe including the parameters values in a column with
-            name 'value' and the parameters name as index.
-        LB : [List]
-            parameters upper bounds.
-        UB : [List]
-            parameters lower bounds.
-        Function : [function]
-            the function you want to run it several times.
         *args : [positional argument]
             arguments of the function with the same exact names inside the function.
+        Executor : [object], optional
+            executor with a map(function, iterable) method to evaluate the
+            parameter sets in parallel, the Function & its arguments have to
+            be picklable for a process pool. The default is None (serial).
+        Vectorized : [bool], optional
+            True if the Function takes a 2D array (n_runs, n_parameters) of
+            parameter sets and returns a 1D array of the metric values (Type=1)
+            or the metric values and a list of the calculated values (Type=2).
+            The default is False.
+        BatchSize : [int], optional
+            number of parameter sets in each batch. The default is None (one batch).
+        Checkpoint : [str], optional
+            path of the checkpoint file of the metric values (Type=1).
+            The default is None.
         **kwargs : [keyword argument]
             keyword arguments of the function with the same exact names inside the function.
 
         Returns
         -------
-        sen : [Dictionary]
+        Results : [structured array]
+            one record for each run with the fields "Parameter" (name),
+            "Position", "Value" (real parameter value), "Relative" (parameter
+            value relative to the value of the parameter) & "Metric".
+        CalculatedValues : [list attribute]
+            calculated values of each run (Type=2).
+        sen : [Dictionary attribute]
             for each parameter as a key, there is a list containing 4 lists,
             1-relative parameter values, 2-metric values, 3-Real parameter values
             4- adition calculated values from the function if you choose Type=2.
 
         """
-
+        self.DesignMatrix()
+        # evaluate each distinct parameter set once
+        unique, inverse = np.unique(self.Design, axis=0, return_inverse=True)
+        inverse = np.asarray(inverse).ravel()
+
+        metrics, calculated = self.EvaluateSamples(unique, args, kwargs, Executor, Vectorized,
+                                                   BatchSize, Checkpoint)
+
+        values = np.asarray(self.Parameter['value'], dtype=np.float64)
+        names = np.asarray(self.Parameter.index)[self.DesignPositions].astype(str)
+        self.Results = np.zeros(len(self.Design), dtype=[("Parameter", names.dtype),
+                                                         ("Position", np.int64),
+                                                         ("Value", np.float64),
+                                                         ("Relative", np.float64),
+                                                         ("Metric", np.float64)])
+        self.Results["Parameter"] = names
+        self.Results["Position"] = self.DesignPositions
+        self.Results["Value"] = self.Design[np.arange(len(self.Design)), self.DesignPositions]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.Results["Relative"] = self.Results["Value"] / values[self.DesignPositions]
+        self.Results["Metric"] = metrics[inverse]
+        if self.Type != 1:
+            self.CalculatedValues = [calculated[i] for i in inverse]
+
+        # the nested lists of the plots (Sobol)
         self.sen={}
-
         for i in range(self.NoPar):
             k = self.Positions[i]
-            if self.Type == 1:
-                self.sen[self.Parameter.index[k]]=[[],[],[]]
-            else:
-                self.sen[self.Parameter.index[k]]=[[],[],[],[]]
-            # generate 5 random values between the high and low parameter bounds
-            rand_value = np.linspace(self.LB[k],self.UB[k],self.NoValues)
-            # add the value of the calibrated parameter and sort the values
-            rand_value = np.sort(np.append(rand_value,self.Parameter['value'][k]))
-            # store the relative values of the parameters in the first list in the dict
-            self.sen[self.Parameter.index[k]][0] = [((h)/self.Parameter['value'][k]) for h in rand_value]
-
-            Randpar = self.Parameter['value'].tolist()
-            for j in range(len(rand_value)):
-                Randpar[k] = rand_value[j]
-                # args = list(args)
-                # args.insert(Position,Randpar)
-                if self.Type == 1:
-                    metric = self.Function(Randpar,*args,**kwargs)
-                else:
-                    metric, CalculatedValues= self.Function(Randpar,*args,**kwargs)
-                    self.sen[self.Parameter.index[k]][3].append(CalculatedValues)
-                try:
-                    # store the metric value in the second list in the dict
-                    self.sen[self.Parameter.index[k]][1].append(round(metric,3))
-                except TypeError:
-                    message = """the Given Function returns more than one value,
-                    the function should return only one value for Type=1, or
-                    two values for Type=2.
-                    """
-                    assert False, message
-                # store the real values of the parameter in the third list in the dict
-                self.sen[self.Parameter.index[k]][2].append(round(rand_value[j],4))
-                print( str(k)+'-'+self.Parameter.index[k]+' -'+ str(j))
-                print(round(metric,3))
+            runs = np.where(self.DesignPositions == k)[0]
+            self.sen[self.Parameter.index[k]] = [self.Results["Relative"][runs].tolist(),
+                                                 np.round(self.Results["Metric"][runs],3).tolist(),
+                                                 np.round(self.Results["Value"][runs],4).tolist()]
+            if self.Type != 1:
+                self.sen[self.Parameter.index[k]].append([self.CalculatedValues[j] for j in runs])
+
+        return self.Results
+
+
+    def SaltelliSample(self, N, Seed=None):
+        """
+        ======================================================================
+           SaltelliSample(N, Seed=None)
+        ======================================================================
+        SaltelliSample method builds the parameter sets of the Saltelli
+        scheme, two matrices A & B of N parameter sets (scrambled Sobol
+        sequence between the bounds of the parameters in Positions, the
+        other parameters keep their values) and for each parameter i a
+        matrix AB_i (A with the column i from B), N * (NoPar + 2) parameter
+        sets in the order A, B, AB_1, ..., AB_NoPar
+
+        Parameters
+        ----------
+        N : [int]
+            number of base parameter sets (a power of 2 keeps the balance
+            of the Sobol sequence).
+        Seed : [int], optional
+            seed of the scrambling. The default is None.
+
+        Returns
+        -------
+        Samples : [array attribute]
+            2D array (N * (NoPar + 2), n_parameters) of the parameter sets.
+        """
+        values = np.asarray(self.Parameter['value'], dtype=np.float64)
+        LB = np.asarray(self.LB, dtype=np.float64)[self.Positions]
+        UB = np.asarray(self.UB, dtype=np.float64)[self.Positions]
+
+        base = qmc.Sobol(d=2*self.NoPar, scramble=True, seed=Seed).random(N)
+        A = LB + base[:,:self.NoPar]*(UB - LB)
+        B = LB + base[:,self.NoPar:]*(UB - LB)
+
+        self.Samples = np.repeat(values[None,:], N*(self.NoPar + 2), axis=0)
+        self.Samples[:N,self.Positions] = A
+        self.Samples[N:2*N,self.Positions] = B
+        for i in range(self.NoPar):
+            AB = A.copy()
+            AB[:,i] = B[:,i]
+            self.Samples[(i + 2)*N:(i + 3)*N,self.Positions] = AB
+
+
+    def SobolIndices(self, N, *args, Seed=None, Bootstrap=100, Confidence=0.95,
+                     Executor=None, Vectorized=False, BatchSize=None,
+                     Checkpoint=None, **kwargs):
+        """
+        ======================================================================
+           SobolIndices(N, *args, Seed=None, Bootstrap=100, Confidence=0.95,
+                        Executor=None, Vectorized=False, BatchSize=None,
+                        Checkpoint=None, **kwargs)
+        ======================================================================
+        SobolIndices method calculates the first order & the total order
+        variance based sensitivity indices of the parameters in Positions
+        from the Saltelli parameter sets (SaltelliSample), the first order
+        index with the estimator of Saltelli et al. 2010 and the total order
+        index with the estimator of Jansen 1999, the confidence intervals are
+        the percentiles of the indices of Bootstrap resamples of the N base
+        parameter sets.
+
+            S1_i = mean(f(B) * (f(AB_i) - f(A))) / V
+            ST_i = mean((f(A) - f(AB_i))**2) / (2 * V)
+
+        Parameters
+        ----------
+        N : [int]
+            number of base parameter sets (N * (NoPar + 2) runs).
+        *args : [positional argument]
+            arguments of the function.
+        Seed : [int], optional
+            seed of the parameter sets & the bootstrap. The default is None.
+        Bootstrap : [int], optional
+            number of bootstrap resamples. The default is 100.
+        Confidence : [numeric], optional
+            confidence level of the intervals. The default is 0.95.
+        Executor, Vectorized, BatchSize, Checkpoint : optional
+            evaluation of the parameter sets (see EvaluateSamples).
+        **kwargs : [keyword argument]
+            keyword arguments of the function.
+
+        Returns
+        -------
+        SobolResults : [structured array]
+            one record for each parameter with the fields "Parameter", "S1",
+            "S1Low", "S1High", "ST", "STLow" & "STHigh".
+        Metrics : [array attribute]
+            metric value of each parameter set of the Samples.
+        """
+        assert 0 < Confidence < 1, "Confidence should be between 0 and 1"
+        self.SaltelliSample(N, Seed)
+        self.Metrics, _ = self.EvaluateSamples(self.Samples, args, kwargs, Executor, Vectorized,
+                                               BatchSize, Checkpoint)
+
+        fA = self.Metrics[:N]
+        fB = self.Metrics[N:2*N]
+        fAB = self.Metrics[2*N:].reshape(self.NoPar, N)
+
+        def Indices(rows):
+            # rows: (n_resamples, N) indices of the base parameter sets
+            a, b, ab = fA[rows], fB[rows], fAB[:,rows]
+            V = np.var(np.concatenate([a, b], axis=-1), axis=-1)
+            S1 = np.mean(b*(ab - a), axis=-1)/V
+            ST = 0.5*np.mean((a - ab)**2, axis=-1)/V
+            return S1, ST
+
+        S1, ST = Indices(np.arange(N)[None,:])
+        rng = np.random.default_rng(Seed)
+        S1b, STb = Indices(rng.integers(N, size=(Bootstrap, N)))
+        q = [100*(1 - Confidence)/2, 100*(1 + Confidence)/2]
+
+        names = np.asarray(self.Parameter.index)[self.Positions].astype(str)
+        self.SobolResults = np.zeros(self.NoPar, dtype=[("Parameter", names.dtype),
+                                                        ("S1", np.float64), ("S1Low", np.float64),
+                                                        ("S1High", np.float64), ("ST", np.float64),
+                                                        ("STLow", np.float64), ("STHigh", np.float64)])
+        self.SobolResults["Parameter"] = names
+        self.SobolResults["S1"] = S1[:,0]
+        self.SobolResults["S1Low"], self.SobolResults["S1High"] = np.percentile(S1b, q, axis=1)
+        self.SobolResults["ST"] = ST[:,0]
+        self.SobolResults["STLow"], self.SobolResults["STHigh"] = np.percentile(STb, q, axis=1)
+
+        return self.SobolResults
+
+
+    def MorrisSample(self, Trajectories, Levels=4, Seed=None):
+        """
+        ======================================================================
+           MorrisSample(Trajectories, Levels=4, Seed=None)
+        ======================================================================
+        MorrisSample method builds the trajectories of the elementary effects
+        method, each trajectory starts from a random point of a grid of
+        Levels values between the bounds of each parameter in Positions and
+        changes the parameters one at a time (in a random order) by
+        Delta = Levels / (2 * (Levels - 1)) of the range of the parameter,
+        NoPar + 1 parameter sets for each trajectory
+
+        Parameters
+        ----------
+        Trajectories : [int]
+            number of trajectories.
+        Levels : [int], optional
+            number of grid levels (even number). The default is 4.
+        Seed : [int], optional
+            seed of the random generator. The default is None.
+
+        Returns
+        -------
+        Samples : [array attribute]
+            2D array (Trajectories * (NoPar + 1), n_parameters) of the parameter sets.
+        Steps : [array attribute]
+            3D array (Trajectories, NoPar, 2) the changed parameter (order in
+            Positions) & the change (+/- Delta) of each step.
+        """
+        assert Levels >= 2, "Levels should be at least 2"
+        values = np.asarray(self.Parameter['value'], dtype=np.float64)
+        LB = np.asarray(self.LB, dtype=np.float64)[self.Positions]
+        UB = np.asarray(self.UB, dtype=np.float64)[self.Positions]
+        rng = np.random.default_rng(Seed)
+        Delta = Levels/(2*(Levels - 1))
+
+        points = np.zeros((Trajectories, self.NoPar + 1, self.NoPar))
+        self.Steps = np.zeros((Trajectories, self.NoPar, 2))
+        points[:,0,:] = rng.integers(Levels, size=(Trajectories, self.NoPar))/(Levels - 1)
+        for t in range(Trajectories):
+            x = points[t,0,:].copy()
+            for j, i in enumerate(rng.permutation(self.NoPar)):
+                step = Delta if x[i] + Delta <= 1 else -Delta
+                x[i] = x[i] + step
+                points[t,j + 1,:] = x
+                self.Steps[t,j,:] = [i, step]
+
+        self.Samples = np.repeat(values[None,:], Trajectories*(self.NoPar + 1), axis=0)
+        self.Samples[:,self.Positions] = LB + points.reshape(-1, self.NoPar)*(UB - LB)
+
+
+    def Morris(self, Trajectories, *args, Levels=4, Seed=None, Executor=None,
+               Vectorized=False, BatchSize=None, Checkpoint=None, **kwargs):
+        """
+        ======================================================================
+           Morris(Trajectories, *args, Levels=4, Seed=None, Executor=None,
+                  Vectorized=False, BatchSize=None, Checkpoint=None, **kwargs)
+        ======================================================================
+        Morris method screens the parameters in Positions with the elementary
+        effects of the trajectories (MorrisSample), the elementary effect of
+        a parameter is the change of the metric divided by the change of the
+        parameter (as a fraction of its range), Mu is the mean, MuStar the
+        mean of the absolute values (Campolongo et al. 2007) and Sigma the
+        standard deviation of the elementary effects of each parameter.
+
+        Parameters
+        ----------
+        Trajectories : [int]
+            number of trajectories (Trajectories * (NoPar + 1) runs).
+        *args : [positional argument]
+            arguments of the function.
+        Levels : [int], optional
+            number of grid levels. The default is 4.
+        Seed : [int], optional
+            seed of the random generator. The default is None.
+        Executor, Vectorized, BatchSize, Checkpoint : optional
+            evaluation of the parameter sets (see EvaluateSamples).
+        **kwargs : [keyword argument]
+            keyword arguments of the function.
+
+        Returns
+        -------
+        MorrisResults : [structured array]
+            one record for each parameter with the fields "Parameter", "Mu",
+            "MuStar" & "Sigma".
+        ElementaryEffects : [array attribute]
+            2D array (Trajectories, NoPar) of the elementary effects.
+        Metrics : [array attribute]
+            metric value of each parameter set of the Samples.
+        """
+        self.MorrisSample(Trajectories, Levels, Seed)
+        self.Metrics, _ = self.EvaluateSamples(self.Samples, args, kwargs, Executor, Vectorized,
+                                               BatchSize, Checkpoint)
+
+        metrics = self.Metrics.reshape(Trajectories, self.NoPar + 1)
+        order = self.Steps[:,:,0].astype(np.int64)
+        self.ElementaryEffects = np.zeros((Trajectories, self.NoPar))
+        np.put_along_axis(self.ElementaryEffects, order,
+                          np.diff(metrics, axis=1)/self.Steps[:,:,1], axis=1)
+
+        names = np.asarray(self.Parameter.index)[self.Positions].astype(str)
+        self.MorrisResults = np.zeros(self.NoPar, dtype=[("Parameter", names.dtype),
+                                                         ("Mu", np.float64), ("MuStar", np.float64),
+                                                         ("Sigma", np.float64)])
+        self.MorrisResults["Parameter"] = names
+        self.MorrisResults["Mu"] = self.ElementaryEffects.mean(axis=0)
+        self.MorrisResults["MuStar"] = np.abs(self.ElementaryEffects).mean(axis=0)
+        self.MorrisResults["Sigma"] = self.ElementaryEffects.std(axis=0, ddof=1) if Trajectories > 1 else np.nan
+
+        return self.MorrisResults
 
 
     def Sobol(self, RealValues=False, Title='',  #CalculatedValues=False,
@@ -291,3 +696,10 @@ class SensitivityAnalysis():
                 print(str(key) + ' : ' + repr(self.__dict__[key]))
 
         print('\n')
+
+
+def _Run(Function, args, kwargs, par):
+    """
+    run the Function of SensitivityAnalysis.OAT with one parameter set
+    """
+    return Function(list(par), *args, **kwargs)
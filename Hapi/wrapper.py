@@ -23,12 +23,14 @@ class Wrapper():
         3- FW1
         4- FW1Withlake
         5- Lumped
+        6- LumpedEnsemble
     """
     def __init__(self):
         pass
 
     @staticmethod
-    def HapiModel(Model, ll_temp=None, q_0=None):
+    def HapiModel(Model, ll_temp=None, q_0=None, Lean=False, ChunkSize=1000,
+                  Impulse=False):
         """
         =======================================================================
           Dist_model(DEM,flow_acc,flow_direct,sp_prec,sp_et,sp_temp,sp_par,p2,kub,klb,init_st,ll_temp,q_0)
@@ -36,6 +38,13 @@ class Wrapper():
             HapiModel connect two modules :
             1- The distributed rainfall runoff: model runs separately for each cell
             2- The Spatial routing scheme (routing is following river network)
+            if the cache is enabled (Catchment.CreateCache) and only the routing
+            parameters have changed since the last run, the lumped model is not
+            run again, if Lean is True the model is run in blocks of ChunkSize
+            time steps and only the discharge at the outlet and at the gauges
+            is kept (DistributedRRM.LeanRun), if Impulse is True the discharge at
+            the outlet and at the gauges is calculated from the impulse
+            responses of the cells (DistributedRRM.ImpulseRouting)
 
         Inputs:
         ----------
@@ -72,6 +81,16 @@ class Wrapper():
                 [numpy array] 3d array of the long term average temperature data
             13-q_0:
                 [float] initial discharge m3/s
+            14-Lean:
+                [bool] True to keep only the discharge at the outlet and the
+                gauges (GaugesQtot) instead of the distributed arrays. default=False
+            15-ChunkSize:
+                [integer] number of time steps in each block of the lean run (and in each
+                window of RunLumpedRRM).
+                default=1000
+            16-Impulse:
+                [bool] True to route with the impulse responses of the cells
+                (only the outlet and the gauges GaugesQtot). default=False
 
         Outputs:
         ----------
@@ -90,11 +109,40 @@ class Wrapper():
             6-qlz_translated:
                 [numpy ndarray] 3D array of the lower zone discharge translated at each time step
         """
-        # run the rainfall runoff model separately
-        distrrm.RunLumpedRRM(Model)
-
-        # run the GIS part to rout from cell to another
-        distrrm.SpatialRouting(Model)
+        if Lean:
+            distrrm.LeanRun(Model, ChunkSize)
+        elif hasattr(Model, "Cache"):
+            RunoffKey = Model.RunoffKey()
+            Routing = np.array(Model.Parameters[:,:,Model.RoutingParameters])
+            if Model.Cache.get("Runoff") != RunoffKey:
+                distrrm.RunLumpedRRM(Model, ChunkSize)
+                Model.Cache["Runoff"] = RunoffKey
+
+            if Impulse:
+                distrrm.ImpulseRouting(Model)
+            elif "Routing" in Model.Cache and hasattr(Model, "quz_routed"):
+                # only the routing parameters have changed so quz & qlz of the
+                # last run are used and only the changed paths are routed again
+                Previous = Model.Cache["Routing"]
+                same = (Routing == Previous) | (np.isnan(Routing) & np.isnan(Previous))
+                distrrm.SpatialRouting(Model, Changed=~same.all(axis=2))
+            else:
+                distrrm.SpatialRouting(Model)
+
+            # quz_routed of the impulse response routing is not calculated
+            if Impulse:
+                Model.Cache.pop("Routing", None)
+            else:
+                Model.Cache["Routing"] = Routing
+        else:
+            # run the rainfall runoff model separately
+            distrrm.RunLumpedRRM(Model, ChunkSize)
+
+            # run the GIS part to rout from cell to another
+            if Impulse:
+                distrrm.ImpulseRouting(Model)
+            else:
+                distrrm.SpatialRouting(Model)
 
         Model.qout = Model.qout[:-1]
 
@@ -312,11 +360,23 @@ class Wrapper():
         tm = Model.data[:,3]
 
         # from the conceptual model calculate the upper and lower response mm/time step
-        Model.quz, Model.qlz, Model.statevariables = Model.LumpedModel.Simulate(p, t, et, tm,
-                                                     Model.Parameters,
-                                                     init_st = Model.InitialCond,
-                                                     q_init = Model.q_init,
-                                                     snow = Model.Snow)
+        if hasattr(Model.LumpedModel, "SimulateBatch"):
+            # the lumped catchment is run as one cell
+            quz, qlz, st = Model.LumpedModel.SimulateBatch(prec = p[None,:],
+                                                           temp = t[None,:],
+                                                           et = et[None,:],
+                                                           ll_temp = tm[None,:],
+                                                           par = np.asarray(Model.Parameters)[None,:],
+                                                           init_st = Model.InitialCond,
+                                                           q_init = Model.q_init,
+                                                           snow = Model.Snow)
+            Model.quz, Model.qlz, Model.statevariables = quz[0], qlz[0], st[0]
+        else:
+            Model.quz, Model.qlz, Model.statevariables = Model.LumpedModel.Simulate(p, t, et, tm,
+                                                         Model.Parameters,
+                                                         init_st = Model.InitialCond,
+                                                         q_init = Model.q_init,
+                                                         snow = Model.Snow)
         # q mm , area sq km  (1000**2)/1000/f/60/60 = 1/(3.6*f)
         # if daily tfac=24 if hourly tfac=1 if 15 min tfac=0.25
         Model.quz = Model.quz*Model.CatArea/(Model.Timef*3.6)
@@ -329,3 +389,117 @@ class Wrapper():
         elif Routing != 0:
             Model.Qsim = RoutingFn(np.array(Model.Qsim[:-1]), Model.Qsim[0],
                                    Model.Parameters[-2], Model.Parameters[-1], Model.Timef)
+
+
+    @staticmethod
+    def LumpedEnsemble(Model, Parameters, Routing=0, RoutingFn=[], States=False,
+                       BatchSize=None):
+        """
+        ==========================================================
+            LumpedEnsemble(Model, Parameters, Routing=0, RoutingFn=[], States=False, BatchSize=None)
+        ==========================================================
+        LumpedEnsemble runs the lumped conceptual model for many parameter sets
+        in one call, the parameter sets are advanced together in time by the
+        batched conceptual model (SimulateBatch) as if each set was a cell
+
+        Inputs:
+        ----------
+            1-Model:
+                [Catchment object] with the data, the LumpedModel, CatArea,
+                Timef, InitialCond, q_init and Snow like in Lumped
+            2-Parameters:
+                [numpy array] 2D array (n_sets, n_parameters) each row is a
+                parameter set
+            3-Routing:
+                [0 or 1] to decide wether t route the generated discharge hydrograph or not
+            4-RoutingFn:
+                [function] function to route the dischrge hydrograph.
+            5-States:
+                [bool] True to keep the state variables of all the sets.
+                default is False
+            6-BatchSize:
+                [integer] number of parameter sets to run together, to limit
+                the memory. default is None (all the sets together)
+
+        Outputs:
+        ----------
+            1-Model.QsimEnsemble:
+                [numpy array] 2D array (n_sets, n_steps) of the calculated
+                discharge of each parameter set
+            2-Model.StatesEnsemble:
+                [numpy array] 3D array (n_sets, n_steps+1, 5) of the state
+                variables (only if States is True)
+
+        Examples:
+        ----------
+            Pars = np.random.uniform(LB, UB, (1000, len(LB)))
+            Wrapper.LumpedEnsemble(Model, Pars, Routing=1,
+                                   RoutingFn=Routing.TriangularRouting1)
+        """
+        ### input data validation
+        assert hasattr(Model.LumpedModel, "SimulateBatch"), ("the conceptual model "
+            "does not have a batched version (SimulateBatch)")
+        if Routing != 0:
+            assert callable(RoutingFn) , "routing function should be of type callable (function that takes arguments)"
+
+        Parameters = np.atleast_2d(np.asarray(Parameters, dtype=np.float64))
+        n_sets = Parameters.shape[0]
+        if BatchSize is None:
+            BatchSize = n_sets
+        assert BatchSize >= 1, "BatchSize should be a positive integer"
+
+        # data
+        n_steps = Model.data.shape[0]
+        p = Model.data[:,0].astype(np.float64)
+        et = Model.data[:,1].astype(np.float64)
+        t = Model.data[:,2].astype(np.float64)
+        tm = Model.data[:,3].astype(np.float64)
+
+        Qsim = np.zeros((n_sets, n_steps+1), dtype=np.float64)
+        if States:
+            statevariables = np.zeros((n_sets, n_steps+1, 5), dtype=np.float32)
+
+        for start in range(0, n_sets, BatchSize):
+            end = min(start + BatchSize, n_sets)
+            shape = (end - start, n_steps)
+            # the same forcing is shared by all the sets
+            quz, qlz, st = Model.LumpedModel.SimulateBatch(prec = np.broadcast_to(p, shape),
+                                                           temp = np.broadcast_to(t, shape),
+                                                           et = np.broadcast_to(et, shape),
+                                                           ll_temp = np.broadcast_to(tm, shape),
+                                                           par = Parameters[start:end],
+                                                           init_st = Model.InitialCond,
+                                                           q_init = Model.q_init,
+                                                           snow = Model.Snow,
+                                                           states = States)
+            # q mm , area sq km  (1000**2)/1000/f/60/60 = 1/(3.6*f)
+            Qsim[start:end] = (quz + qlz) * Model.CatArea / (Model.Timef * 3.6)
+            if States:
+                statevariables[start:end] = st
+
+        if Routing != 0 and Model.Maxbas:
+            if RoutingFn in (routing.TriangularRouting1, routing.TriangularRouting2):
+                method = 1 if RoutingFn == routing.TriangularRouting1 else 2
+                Qsim = routing.TriangularRoutingBatch(Qsim[:,:-1], Parameters[:,-1],
+                                                      method=method)
+            else:
+                Qsim = np.array([RoutingFn(np.array(Qsim[i,:-1]), Parameters[i,-1])
+                                 for i in range(n_sets)])
+        elif Routing != 0:
+            if RoutingFn in (routing.Muskingum, routing.Muskingum_V):
+                # Muskingum does not clip the outflow at zero and rounds it to 4 decimals
+                if RoutingFn == routing.Muskingum:
+                    nonnegative, decimals = False, 4
+                else:
+                    nonnegative, decimals = True, None
+                Qsim = routing.MuskingumBatch(Qsim[:,:-1], Qsim[:,0], Parameters[:,-2],
+                                              Parameters[:,-1], Model.Timef,
+                                              nonnegative=nonnegative, decimals=decimals)
+            else:
+                Qsim = np.array([RoutingFn(np.array(Qsim[i,:-1]), Qsim[i,0],
+                                           Parameters[i,-2], Parameters[i,-1], Model.Timef)
+                                 for i in range(n_sets)])
+
+        Model.QsimEnsemble = Qsim
+        if States:
+            Model.StatesEnsemble = statevariables
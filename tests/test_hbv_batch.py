@@ -0,0 +1,135 @@
+"""
+regression tests of the batched HBV kernels (SimulateBatch) against the
+scalar Simulate of each module (hbv, hbv_bergestrom92 and hbvlumped)
+"""
+import numpy as np
+import pytest
+
+from Hapi import hbv, hbv_bergestrom92, hbvlumped
+
+NoCells = 5
+NoSteps = 200
+InitSt = [0.0, 5.0, 5.0, 5.0, 0.0]
+
+
+def Inputs(seed=1):
+    rng = np.random.default_rng(seed)
+    prec = rng.gamma(0.6, 4, (NoCells, NoSteps))
+    et = rng.uniform(0, 3, (NoCells, NoSteps))
+    temp = rng.uniform(-5, 25, (NoCells, NoSteps))
+    ll_temp = np.repeat(temp.mean(axis=1)[:, None], NoSteps, axis=1)
+    return rng, prec, temp, et, ll_temp
+
+
+def HBVParameters(rng):
+    # [rfcf, fc, beta, etf, lp, c_flux, k, k1, alpha, perc] followed by
+    # the rest of the 18 parameters (k, k1 & alpha at 14, 15 & 16)
+    par = np.column_stack([rng.uniform(0.8, 1.2, NoCells), rng.uniform(100, 300, NoCells),
+                           rng.uniform(1, 4, NoCells), rng.uniform(0, 1, NoCells),
+                           rng.uniform(0.3, 1, NoCells), rng.uniform(0, 0.1, NoCells),
+                           rng.uniform(0.01, 0.1, NoCells), rng.uniform(0.001, 0.01, NoCells),
+                           rng.uniform(0.1, 1, NoCells), rng.uniform(0.1, 1, NoCells)])
+    rest = np.column_stack([rng.uniform(0, 1, (NoCells, 4)),
+                            rng.uniform(0.01, 0.1, NoCells), rng.uniform(0.001, 0.01, NoCells),
+                            rng.uniform(0.1, 1, NoCells), rng.uniform(0.1, 1, NoCells)])
+    return np.column_stack([par, rest])
+
+
+def BergestromParameters(rng, snow):
+    # [rfcf, fc, beta, e_corr, lp, k, k1, k2, uzl, perc]
+    par = np.column_stack([rng.uniform(0.8, 1.2, NoCells), rng.uniform(100, 300, NoCells),
+                           rng.uniform(1, 4, NoCells), rng.uniform(0.8, 1.2, NoCells),
+                           rng.uniform(0.3, 1, NoCells), rng.uniform(0.01, 0.1, NoCells),
+                           rng.uniform(0.01, 0.1, NoCells), rng.uniform(0.001, 0.01, NoCells),
+                           rng.uniform(5, 30, NoCells), rng.uniform(0.1, 1, NoCells)])
+    if snow == 1:
+        # [tt, rfcf, sfcf, cfmax, cwh, cfr] + [fc, beta, e_corr, lp, k, k1, k2, uzl, perc]
+        snowpar = np.column_stack([rng.uniform(-1, 1, NoCells), par[:,0],
+                                   rng.uniform(0.8, 1.2, NoCells), rng.uniform(1, 5, NoCells),
+                                   rng.uniform(0, 0.2, NoCells), rng.uniform(0, 0.1, NoCells)])
+        par = np.column_stack([snowpar, par[:,1:]])
+    return par
+
+
+@pytest.mark.parametrize("snow", [0, 1])
+@pytest.mark.parametrize("q_init", [None, 3.0])
+def test_hbv(snow, q_init):
+    rng, prec, temp, et, ll_temp = Inputs()
+    par = HBVParameters(rng)
+    q_uz, q_lz, st = hbv.SimulateBatch(prec, temp, et, par, init_st=InitSt,
+                                       ll_temp=ll_temp, q_init=q_init, snow=snow)
+    for i in range(NoCells):
+        q_uzi, q_lzi, sti = hbv.Simulate(prec[i], temp[i], et[i], par[i], init_st=InitSt,
+                                         ll_temp=ll_temp[i], q_init=q_init, snow=snow)
+        np.testing.assert_allclose(q_uz[i], q_uzi, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(q_lz[i], q_lzi, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(st[i], sti, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("snow", [0, 1])
+@pytest.mark.parametrize("q_init", [None, 3.0])
+def test_hbv_bergestrom92(snow, q_init):
+    rng, prec, temp, et, ll_temp = Inputs()
+    par = BergestromParameters(rng, snow)
+    q_uz, q_lz, st = hbv_bergestrom92.SimulateBatch(prec, temp, et, ll_temp, par, init_st=InitSt,
+                                                    q_init=q_init, snow=snow)
+    for i in range(NoCells):
+        q_uzi, q_lzi, sti = hbv_bergestrom92.Simulate(prec[i], temp[i], et[i], ll_temp[i], par[i],
+                                                      init_st=InitSt, q_init=q_init, snow=snow)
+        np.testing.assert_allclose(q_uz[i], q_uzi, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(q_lz[i], q_lzi, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(st[i], sti, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("snow", [0, 1])
+@pytest.mark.parametrize("q_init", [None, 3.0])
+def test_hbvlumped(snow, q_init):
+    rng, prec, temp, et, ll_temp = Inputs()
+    par = HBVParameters(rng)
+    p2 = [24, 1500.0]
+    q_uz, q_lz, st = hbvlumped.SimulateBatch(prec, temp, et, par, init_st=InitSt,
+                                             ll_temp=ll_temp, q_init=q_init, snow=snow)
+    # the batched discharge is in mm/timestep, the initial discharge is
+    # calculated from the initial storages
+    q_sim = (q_uz + q_lz) * p2[1] / (3.6 * p2[0])
+    np.testing.assert_allclose(q_uz[:,0], np.minimum(par[:,6] * InitSt[2]**(1 + par[:,8]), InitSt[2]))
+    np.testing.assert_allclose(q_lz[:,0], np.minimum(par[:,7] * InitSt[3], InitSt[3]))
+    for i in range(NoCells):
+        q_simi, sti = hbvlumped.Simulate(prec[i], temp[i], et[i], par[i], p2, init_st=InitSt,
+                                         ll_temp=ll_temp[i], q_init=q_init, snow=snow)
+        np.testing.assert_allclose(q_sim[i,1:], q_simi[1:], rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(st[i], sti[:,:5], rtol=1e-8, atol=1e-10)
+
+
+
+@pytest.mark.parametrize("module", [hbv, hbvlumped])
+def test_out(module):
+    rng, prec, temp, et, ll_temp = Inputs()
+    par = HBVParameters(rng)
+    q_uz, q_lz, st = module.SimulateBatch(prec, temp, et, par, init_st=InitSt, ll_temp=ll_temp)
+    # write into the cells of a (rows, cols, steps) cube
+    rows, cols = np.arange(NoCells), np.zeros(NoCells, dtype=int)
+    out = (np.zeros((NoCells, 2, NoSteps + 1), dtype=q_uz.dtype),
+           np.zeros((NoCells, 2, NoSteps + 1), dtype=q_lz.dtype),
+           np.zeros((NoCells, 2, NoSteps + 1, st.shape[2]), dtype=st.dtype))
+    res = module.SimulateBatch(prec, temp, et, par, init_st=InitSt, ll_temp=ll_temp,
+                               out=out, cells=(rows, cols))
+    assert all(r is o for r, o in zip(res, out))
+    np.testing.assert_array_equal(out[0][:, 0], q_uz)
+    np.testing.assert_array_equal(out[1][:, 0], q_lz)
+    np.testing.assert_array_equal(out[2][:, 0], st)
+    assert not out[0][:, 1].any()
+
+
+@pytest.mark.parametrize("module", [hbv, hbvlumped])
+def test_float32_forcing(module):
+    # forcing read from the store is float32, it is converted one time step at a time
+    rng, prec, temp, et, ll_temp = Inputs()
+    par = HBVParameters(rng)
+    prec, temp, et, ll_temp = [x.astype(np.float32) for x in (prec, temp, et, ll_temp)]
+    q_uz, q_lz, st = module.SimulateBatch(prec, temp, et, par, init_st=InitSt, ll_temp=ll_temp)
+    q_uz64, q_lz64, st64 = module.SimulateBatch(*[x.astype(np.float64) for x in (prec, temp, et)],
+                                                par, init_st=InitSt, ll_temp=ll_temp.astype(np.float64))
+    np.testing.assert_array_equal(q_uz, q_uz64)
+    np.testing.assert_array_equal(q_lz, q_lz64)
+    np.testing.assert_array_equal(st, st64)
@@ -0,0 +1,88 @@
+"""
+tests of DistributedRRM.StreamRun, a run that is resumed from the
+checkpoint gives the same results as one run over the whole period
+"""
+import numpy as np
+import pytest
+
+from Hapi import hbv
+from Hapi.catchment import Catchment
+from Hapi.distrrm import DistributedRRM
+
+NoCells = 6
+NoSteps = 300
+ChunkSize = 64
+
+
+def Forcing(seed=1):
+    rng = np.random.default_rng(seed)
+    prec = rng.gamma(0.6, 4, (1, NoCells, NoSteps))
+    et = rng.uniform(0, 0.3, (1, NoCells, NoSteps))
+    temp = rng.uniform(5, 25, (1, NoCells, NoSteps))
+    return prec, temp, et
+
+
+def Model(no_steps, seed=1):
+    # one row of cells draining to the east, the last cell is the outlet
+    Coello = Catchment("test", "2000-01-01", "2000-12-31")
+    Coello.rows, Coello.cols = 1, NoCells
+    Coello.NoDataValue = -9999.0
+    Coello.FlowAccArr = np.arange(NoCells, dtype=np.float64)[np.newaxis, :]
+    Coello.CellIndex = np.arange(NoCells, dtype=np.int32)[np.newaxis, :]
+    Coello.Cells = np.column_stack([np.zeros(NoCells), np.arange(NoCells)]).astype(np.int32)
+    Coello.DownstreamCell = np.append(np.arange(1, NoCells), -1).astype(np.int32)
+    Coello.UpstreamOffsets = np.append(0, np.arange(NoCells)).astype(np.int32)
+    Coello.UpstreamCells = np.arange(NoCells - 1, dtype=np.int32)
+    Coello.acc_val = list(range(NoCells))
+    Coello.no_elem = NoCells
+
+    prec, temp, et = Forcing(seed)
+    Coello.Prec = prec[:, :, :no_steps]
+    Coello.Temp = temp[:, :, :no_steps]
+    Coello.ET = et[:, :, :no_steps]
+    Coello.ll_temp = np.broadcast_to(temp.mean(axis=2)[:, :, np.newaxis], Coello.Temp.shape)
+    Coello.TS = no_steps + 1
+
+    # [rfcf, fc, beta, etf, lp, c_flux, k, k1, alpha, perc] + muskingum [k, x]
+    Coello.Parameters = np.zeros((1, NoCells, 12))
+    Coello.Parameters[...] = [1, 150, 2, 0.5, 0.8, 0.05, 0.05, 0.005, 0.5, 0.5, 2, 0.2]
+    Coello.LumpedModel = hbv
+    Coello.InitialCond = [0, 5, 5, 5, 0]
+    Coello.q_init = None
+    Coello.Snow = 0
+    Coello.CatArea = Coello.px_tot_area = NoCells
+    Coello.px_area = 1
+    return Coello
+
+
+def test_resume_extended_forcing(tmp_path):
+    whole = str(tmp_path / "whole")
+    DistributedRRM.StreamRun(Model(NoSteps), whole, ChunkSize)
+    _, quz, qlz = DistributedRRM.ReadStream(whole)
+
+    # an operational run continued after new forcing data are added
+    resumed = str(tmp_path / "resumed")
+    DistributedRRM.StreamRun(Model(200), resumed, ChunkSize)
+    Extended = Model(NoSteps)
+    Extended.ForcingVersion = 5
+    DistributedRRM.StreamRun(Extended, resumed, ChunkSize, Resume=True)
+    _, quz_r, qlz_r = DistributedRRM.ReadStream(resumed)
+
+    assert quz_r.shape == quz.shape == (NoCells, NoSteps + 1)
+    np.testing.assert_allclose(quz_r, quz, rtol=1e-5, atol=1e-7)
+    np.testing.assert_allclose(qlz_r, qlz, rtol=1e-5, atol=1e-7)
+
+
+def test_resume_changed_forcing(tmp_path):
+    path = str(tmp_path / "stream")
+    DistributedRRM.StreamRun(Model(200), path, ChunkSize)
+
+    Changed = Model(NoSteps)
+    Changed.Prec = Changed.Prec.copy()
+    Changed.Prec[0, 2, 50] += 1
+    with pytest.raises(AssertionError, match="forcing of the part that was already simulated"):
+        DistributedRRM.StreamRun(Changed, path, ChunkSize, Resume=True)
+
+    # the forcing is shorter than the part that was already simulated
+    with pytest.raises(AssertionError, match="shorter"):
+        DistributedRRM.StreamRun(Model(150), path, ChunkSize, Resume=True)